@@ -1,20 +1,55 @@
+import hmac
 import os
 import sqlite3
+import threading
 import time
 from datetime import date
 from pathlib import Path
-from string import Template
 
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, Blueprint, jsonify
+from flask import Flask, render_template, request, Blueprint, jsonify, abort
+
+from api.metrics import metrics
 
 load_dotenv()
 
-DATABASE = Path(__file__).parent / 'database.db'
+DATABASE = Path(os.environ.get('ASSET_DB', Path(__file__).parent / 'database.db'))
 SEARCH_DIRECTORY = os.environ.get('ASSET_DIR')
 RESULT_DIRECTORY = os.environ.get('DOWNLOAD_DIR')
 BUILD_DB = bool(int(os.environ.get('BUILD_DB')))
 STORAGE_DIRECTORY = os.environ.get('STORAGE_DIR')
+# token required by the /admin routes, they are disabled if it is not set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Version of the database schema in schema.sql, stored in the database with
+# PRAGMA user_version. Older databases are upgraded by the scripts in migrations/.
+SCHEMA_VERSION = 4
+MIGRATIONS_DIRECTORY = Path(__file__).parent / 'migrations'
+
+# Seconds between incremental refreshes of the GUID index (0 means build it only
+# once) and seconds that a GUID that was not found is remembered as missing.
+GUID_INDEX_REFRESH = int(os.environ.get('GUID_INDEX_REFRESH', 600))
+MISSING_GUID_TTL = int(os.environ.get('MISSING_GUID_TTL', 600))
+
+# Maximum number of cached /searchapi results (0 disables the cache) and the number
+# of seconds they are kept.
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 10000))
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 300))
+# number of rows kept in the map_changes table, see api/result_cache.py
+MAX_MAP_CHANGES = 100000
+
+# Set to 0 to resolve guids with the database only and not with the memory-mapped
+# path index that is written for each snapshot, see api/path_index.py.
+PATH_INDEX = os.environ.get('PATH_INDEX', '1') in ('1', 't', 'true', 'True')
+
+# Set to 'auto', 'inotify' or 'poll' to keep the map table in sync with changes in
+# the assets directory, see api/watcher.py.
+WATCH_ASSETS = os.environ.get('WATCH_ASSETS', '')
+
+# Access dates are buffered and written every ACCESS_FLUSH_INTERVAL seconds or when
+# ACCESS_FLUSH_SIZE accesses are waiting, whichever comes first.
+ACCESS_FLUSH_INTERVAL = int(os.environ.get('ACCESS_FLUSH_INTERVAL', 60))
+ACCESS_FLUSH_SIZE = int(os.environ.get('ACCESS_FLUSH_SIZE', 1000))
 
 # Asset file types
 file_types = [
@@ -31,6 +66,13 @@ for file_type, extensions in file_types:
 
 bp = Blueprint('app', __name__, template_folder='templates')
 
+# index of asset file names, buffer of access dates, cache of search results and
+# index of the current snapshot, set up by create_app()
+guid_index = None
+access_log = None
+result_cache = None
+snapshot_index = None
+
 
 def print_settings():
     """Debugging method."""
@@ -40,6 +82,14 @@ def print_settings():
     print(f'>>   BUILD_DB           =  {BUILD_DB}')
 
 
+def check_admin_token():
+    """aborts the request unless it carries the admin token in the X-Admin-Token header"""
+    if not ADMIN_TOKEN:
+        abort(403, 'admin routes are disabled, set ADMIN_TOKEN to enable them')
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        abort(403, 'invalid admin token')
+
+
 def shorten_guid(guid):
     if guid.startswith('cpb'):
         return '-'.join(guid[10:].split('.', 1)[0].split('-')[:2])
@@ -57,67 +107,242 @@ def check_symlink(fpath):
     return False
 
 
-def batch_insert(connection, batch):
-    """inserts a batch of files into the database"""
-    q = f"INSERT INTO map VALUES {batch};"
-    connection.execute(q)
-    connection.commit()
+def is_asset_path(path: str):
+    """checks whether a file path should be added to the database when the assets
+    directory is scanned, which excludes files in hidden directories"""
+    return os.path.basename(path).startswith('cpb') and '/.' not in path
 
 
-def initialize_database(populate: bool = False):
-    """
-    Creates the database from the schema. If populate is True then an existing
-    table in the database will be dropped, recreated and populated from paths in
-    the assets directory. Otherwise the code just makes sure that the table exists.
-    """
-    connection = sqlite3.connect(DATABASE)
-    if populate:
-        with open(Path(__file__).parent / 'schema_scratch.sql') as f:
-            connection.executescript(f.read())
-        files = []
-        file_template = Template(
-            """('${guid}', '${type}', '${path}', '${created}', '${accessed}')""")
-        c = 0
-        sdir = Path(SEARCH_DIRECTORY)
-        # make sure the directory exists
-        sdir.iterdir()
-        time.sleep(1)
-        for f in sdir.glob("**/*"):
-            if check_symlink(f):
-                continue
-            if f.name.startswith('cpb') and '/.' not in str(f):
-                file = file_template.substitute(
-                    guid=shorten_guid(f.stem), type=file_typer(f), path=str(f),
-                    created=date.today(), accessed=date.today())
-                files.append(file)
-                if c % 1000 == 0:
-                    batch_insert(connection, ", ".join(files))
-                    files = []
-                    print(c, f)
-                c += 1
-        if len(files) > 0:
-            batch_insert(connection, ", ".join(files))
+def initialize_database():
+    """
+    Creates the database from the schema if needed and migrates it to the current
+    schema version. The database is never filled in place, a populated database is
+    built as a snapshot by rebuild.rebuild_database() and swapped in.
+    """
+    # a worker that starts while another one migrates waits for it
+    connection = sqlite3.connect(database_path(), timeout=600)
+    # WAL mode is persistent, so setting it once here covers all later connections
+    connection.execute('PRAGMA journal_mode=WAL;')
+    migrate_database(connection)
+    with open(Path(__file__).parent / 'schema.sql') as f:
+        connection.executescript(f.read())
+    set_schema_version(connection, SCHEMA_VERSION)
+    connection.close()
+
+
+def populate_database(connection, incremental: bool = False, workers: int = None,
+                      progress=None):
+    """
+    Adds the files in the assets directory to the map table. Without incremental the
+    tables are expected to be empty and all files are added. With incremental the
+    directory listings from the previous scan are used to only add and remove the
+    paths that changed. All changes are written in a single transaction. If given,
+    progress is called with the number of directories scanned so far.
+    """
+    from api.scanner import AssetScanner, SCAN_WORKERS
+    sdir = Path(SEARCH_DIRECTORY)
+    # make sure the directory exists
+    sdir.iterdir()
+    time.sleep(1)
+    scanner = AssetScanner(sdir, workers or SCAN_WORKERS)
+    if incremental:
+        scanner.load(connection)
+    # without saved listings an incremental scan cannot know what was removed, so
+    # the paths in the database are compared with what was found instead
+    reconcile = incremental and not scanner.listings
+    t0 = time.time()
+    result = scanner.scan(progress)
+    print(f'>>   Scanned {len(scanner.listings)} directories in {time.time() - t0:.2f}s')
+    added = [path for path in result.added if is_asset_path(path)]
+    if reconcile:
+        found = set(path for path in scanner.files() if is_asset_path(path))
+        removed = [path for (path,) in connection.execute("SELECT server_path FROM map;")
+                   if path not in found]
     else:
-        with open(Path(__file__).parent / 'schema.sql') as f:
-            connection.executescript(f.read())
+        removed = [path for path in result.removed if is_asset_path(path)]
+    with connection:
+        update_map(connection, added, removed)
+        scanner.save(connection, result)
+        if not incremental:
+            # a new database starts out without changes to invalidate
+            connection.execute("""DELETE FROM map_changes;""")
+    print(f'>>   Added {len(added)} and removed {len(removed)} paths '
+          f'in {time.time() - t0:.2f}s')
+    return added, removed
+
+
+def update_map(connection, added, removed, removed_dirs=()):
+    """
+    Adds and removes paths in the map table. Removing a directory removes all paths
+    below it. This does not commit so that callers can make it part of a larger
+    transaction.
+    """
+    today = date.today()
+    connection.executemany(
+        """INSERT OR IGNORE INTO map VALUES (?, ?, ?, ?, ?);""",
+        ((shorten_guid(Path(path).stem), file_typer(Path(path)), path, today, today)
+         for path in added))
+    connection.executemany(
+        """DELETE FROM map WHERE server_path=?;""", ((path,) for path in removed))
+    # '0' is the character after '/', so this is a range scan over the directory
+    connection.executemany(
+        """DELETE FROM map WHERE server_path>=? and server_path<?;""",
+        ((directory.rstrip('/') + '/', directory.rstrip('/') + '0') for directory in removed_dirs))
+    connection.execute(
+        """DELETE FROM map_changes WHERE seq<=(SELECT max(seq) FROM map_changes)-?;""",
+        (MAX_MAP_CHANGES,))
 
 
-def get_db_connection():
-    """gets connection to the database in order to work with it"""
-    connection = sqlite3.connect(DATABASE)
+def get_schema_version(connection):
+    return connection.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def set_schema_version(connection, version: int):
+    # PRAGMA does not take parameters, but version is always an int from our code
+    connection.execute(f'PRAGMA user_version={int(version)};')
+    connection.commit()
+
+
+def migrate_database(connection):
+    """
+    Upgrades an existing database in place by running the migration scripts for
+    all versions newer than the one stored in the database. A database without the
+    map table is left alone since the schema will create it at the latest version.
+    """
+    # the write lock is taken before the version is read, so when several workers
+    # start at the same time only the first one migrates and the others see the new
+    # version, and a failure leaves the database at the version it had
+    connection.execute('BEGIN IMMEDIATE;')
+    try:
+        version = get_schema_version(connection)
+        has_map = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='map';").fetchone()
+        if has_map:
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                print(f'>>   Migrating database to schema version {target}')
+                with open(MIGRATIONS_DIRECTORY / f'v{target}.sql') as f:
+                    # executescript() would commit, so the statements are run one by one
+                    for statement in script_statements(f.read()):
+                        connection.execute(statement)
+                connection.execute(f'PRAGMA user_version={target};')
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def script_statements(script: str):
+    """splits an SQL script into its statements, which may span several lines"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+
+
+def database_path():
+    """
+    Returns the path of the database file. After the first rebuild DATABASE is a
+    symbolic link to the current snapshot (see api/rebuild.py). Connections always
+    open the snapshot itself because SQLite names the WAL files after the path it
+    was given, and a WAL file must never be shared between two snapshots.
+    """
+    return os.path.realpath(DATABASE)
+
+
+# connections are kept per thread and per process so that each gunicorn worker
+# (and each thread of the development server) reuses a single connection
+_connections = threading.local()
+
+
+def open_db_connection(database=None):
+    """opens a new connection with the settings used for request handling"""
+    connection = sqlite3.connect(database or database_path(), timeout=30)
     connection.row_factory = sqlite3.Row
+    # NORMAL is durable enough in WAL mode and avoids an fsync on every commit
+    connection.execute('PRAGMA synchronous=NORMAL;')
     return connection
 
 
+def get_db_connection():
+    """gets connection to the database in order to work with it"""
+    # the pid check makes sure a connection inherited from a forking parent
+    # process is never shared with the child, the inode check makes the worker
+    # switch to a new snapshot once a rebuild has swapped it in
+    pid = os.getpid()
+    try:
+        inode = os.stat(DATABASE).st_ino
+    except FileNotFoundError:
+        inode = None
+    if getattr(_connections, 'pid', None) != pid or _connections.inode != inode:
+        if getattr(_connections, 'pid', None) == pid:
+            _connections.connection.close()
+            # cached results may be outdated in the new snapshot
+            if result_cache is not None:
+                result_cache.clear()
+        database = database_path()
+        _connections.connection = open_db_connection(database)
+        if snapshot_index is not None:
+            snapshot_index.load(database)
+        _connections.pid = pid
+        _connections.inode = inode
+        _connections.data_version = None
+    return _connections.connection
+
+
+def sync_caches(connection):
+    """invalidates cached results and path index entries for guids changed by other
+    connections, this only reads the map_changes table if another connection
+    committed since the last call"""
+    data_version = connection.execute('PRAGMA data_version;').fetchone()[0]
+    if data_version != _connections.data_version:
+        if result_cache is not None:
+            result_cache.apply_changes(connection)
+        if snapshot_index is not None:
+            snapshot_index.apply_changes(connection)
+        _connections.data_version = data_version
+
+
+def filename_search(guid):
+    """returns the locations of all files for the given guid, using the GUID index
+    if it is available and falling back to a directory search otherwise"""
+    if guid_index is not None:
+        paths = guid_index.lookup(guid)
+        if paths is not None:
+            return paths
+    return directory_search(guid)
+
+
+def filename_search_many(guids):
+    """returns a dictionary with the locations of all files for each of the given
+    guids, like filename_search() but a directory search is done only once"""
+    if guid_index is not None:
+        results = {guid: guid_index.lookup(guid) for guid in guids}
+        if all(paths is not None for paths in results.values()):
+            return results
+    results = {guid: [] for guid in guids}
+    with metrics.timer('directory_search_duration_seconds'):
+        for file in Path(SEARCH_DIRECTORY).glob("**/*"):
+            if check_symlink(file):
+                continue
+            for guid in guids:
+                if guid in file.stem:
+                    results[guid].append(file)
+    return results
+
+
 def directory_search(guid):
     """returns the locations of all files in the SEARCH_DIRECTORY that begin with the
-    given guid"""
+    given guid, this walks the entire directory and is only used while the GUID index
+    is not available"""
     paths = []
-    for file in Path(SEARCH_DIRECTORY).glob("**/*"):
-        if check_symlink(file):
-            continue
-        if guid in file.stem:
-            paths.append(file)
+    with metrics.timer('directory_search_duration_seconds'):
+        for file in Path(SEARCH_DIRECTORY).glob("**/*"):
+            if check_symlink(file):
+                continue
+            if guid in file.stem:
+                paths.append(file)
     return paths
 
 
@@ -126,24 +351,56 @@ def file_typer(path):
     return file_types_idx.get(path.suffix, 'other')
 
 
+def type_filter(types):
+    """returns an SQL condition that restricts the file type and its parameters, the
+    condition is empty if no file types are given"""
+    if not types:
+        return '', ()
+    return f" and file_type in ({', '.join('?' * len(types))})", tuple(types)
+
+
 def database_search(connection, guid, types):
-    """searches the database for files"""
+    """searches the database for files, the access dates of the files found are
+    recorded in the access log and written to the database later"""
     guid = shorten_guid(guid)
-    # TODO: use 'WHERE file_type in (...)'
-    # TODO: use 'WHERE GUID like %?%'
-    if len(types) == 1:
-        paths = connection.execute("""SELECT file_type, server_path FROM map WHERE GUID=? and file_type=? GROUP BY file_type, server_path;""", (guid, types[0])).fetchall()
-        connection.execute("""UPDATE map SET date_last_accessed=? WHERE GUID=? and file_type=?;""", (date.today(), guid, types[0]))
-    elif len(types) == 2:
-        paths = connection.execute("""SELECT file_type, server_path FROM map WHERE GUID=? and file_type in (?, ?) GROUP BY file_type, server_path;""", (guid, types[0], types[1])).fetchall()
-        connection.execute("""UPDATE map SET date_last_accessed=? WHERE GUID=? and file_type in (?, ?);""", (date.today(), guid, types[0], types[1]))
-    elif len(types) == 3:
-        paths = connection.execute("""SELECT file_type, server_path FROM map WHERE GUID=? and file_type in (?, ?, ?) GROUP BY file_type, server_path;""", (guid, types[0], types[1], types[2])).fetchall()
-        connection.execute("""UPDATE map SET date_last_accessed=? WHERE GUID=? and file_type in (?, ?, ?);""", (date.today(), guid, types[0], types[1], types[2]))
-    else:
-        paths = connection.execute("""SELECT file_type, server_path FROM map WHERE GUID=? GROUP BY file_type, server_path;""", (guid,)).fetchall()
-        connection.execute("""UPDATE map SET date_last_accessed=? WHERE GUID=?;""", (date.today(), guid))
+    condition, parameters = type_filter(types)
+    with metrics.timer('sqlite_query_duration_seconds', query='database_search'):
+        paths = connection.execute(
+            f"""SELECT file_type, server_path FROM map WHERE GUID=?{condition} GROUP BY file_type, server_path;""",
+            (guid, *parameters)).fetchall()
+    if access_log is not None:
+        for file_type in set(path['file_type'] for path in paths):
+            access_log.touch(guid, file_type)
+    return paths
+
+
+def database_search_batch(connection, guids, types):
+    """
+    Searches the database for the files of many guids with a single query by joining
+    the map with a temporary table of guids. Returns a dictionary from shortened guids
+    to the rows found, guids without files are not in the dictionary.
+    """
+    connection.execute("""CREATE TEMP TABLE IF NOT EXISTS batch_guids (GUID TEXT PRIMARY KEY);""")
+    connection.execute("""DELETE FROM batch_guids;""")
+    connection.executemany(
+        """INSERT OR IGNORE INTO batch_guids VALUES (?);""",
+        ((shorten_guid(guid),) for guid in guids))
+    condition, parameters = type_filter(types)
+    with metrics.timer('sqlite_query_duration_seconds', query='database_search_batch'):
+        rows = connection.execute(
+            f"""SELECT map.GUID, file_type, server_path FROM batch_guids
+                JOIN map ON map.GUID=batch_guids.GUID{condition}
+                ORDER BY map.GUID, file_type, server_path;""", parameters).fetchall()
+    # only the temporary table was written, but the transaction has to be closed so
+    # that later reads see changes made by other connections
     connection.commit()
+    paths = {}
+    for row in rows:
+        paths.setdefault(row['GUID'], []).append(row)
+    if access_log is not None:
+        for guid, guid_rows in paths.items():
+            for file_type in set(row['file_type'] for row in guid_rows):
+                access_log.touch(guid, file_type)
     return paths
 
 
@@ -151,10 +408,31 @@ def insert_into_db(connection, guid, result):
     """inserts new entry into the database"""
     guid = shorten_guid(guid)
     type = file_typer(result)
+    # the path may already be known under another file type, hence the OR IGNORE
     connection.execute(
-        """INSERT INTO map VALUES (?, ?, ?, ?, ?);""",
+        """INSERT OR IGNORE INTO map VALUES (?, ?, ?, ?, ?);""",
         (guid, type, str(result), date.today(), date.today()))
     connection.commit()
+    if result_cache is not None:
+        result_cache.invalidate(guid)
+    if snapshot_index is not None:
+        snapshot_index.invalidate(guid)
+
+
+def insert_many_into_db(connection, results):
+    """inserts the entries for a dictionary from guids to lists of paths into the
+    database with a single transaction"""
+    today = date.today()
+    with connection:
+        connection.executemany(
+            """INSERT OR IGNORE INTO map VALUES (?, ?, ?, ?, ?);""",
+            ((shorten_guid(guid), file_typer(path), str(path), today, today)
+             for guid, paths in results.items() for path in paths))
+    for guid in results:
+        if result_cache is not None:
+            result_cache.invalidate(shorten_guid(guid))
+        if snapshot_index is not None:
+            snapshot_index.invalidate(guid)
 
 
 def aapb_generate(guid, extension):
@@ -173,35 +451,188 @@ def aapb_generate(guid, extension):
 def search_api():
     file_type = [request.args['file']] if 'file' in request.args else []
     guid = request.args['guid']
+    if 'match' in request.args:
+        return partial_search_api(guid, request.args['match'], file_type)
     only_first = request.args.get('onlyfirst', False)
+    paths = find_paths(guid, file_type)
+    if len(paths) > 0:
+        if only_first:
+            return paths[0]['server_path']
+        else:
+            return [path['server_path'] for path in paths]
+    else:
+        return 'The requested file does not exist in our server'
+
+
+def find_paths(guid, file_type):
+    """
+    Returns the rows with the file type and server path of the files for a guid, from
+    the path index, the result cache or the database, in that order. Guids that are
+    not in the database are looked for in the assets directory, unless they were
+    recently not found there, and added to the database if they are found there.
+    """
     connection = get_db_connection()
-    paths = database_search(connection, guid, file_type)
-    # TODO (marc @ 4/15/25): this looks like you do a full directory search each
-    # time you do not find results in the database, could be very inefficient
+    sync_caches(connection)
+    paths = None
+    # the path index answers for all guids that did not change since the snapshot was
+    # written, so the result cache only holds, and only counts lookups of, the others
+    if snapshot_index is not None:
+        paths = snapshot_index.lookup(guid, file_type)
+    if paths is None and result_cache is not None:
+        paths = result_cache.get(shorten_guid(guid), tuple(file_type))
+    if paths is not None and len(paths) > 0:
+        if access_log is not None:
+            for row_type in set(path['file_type'] for path in paths):
+                access_log.touch(shorten_guid(guid), row_type)
+        return paths
+    if paths is None:
+        paths = database_search(connection, guid, file_type)
     if len(paths) == 0:
-        results = directory_search(guid)
+        # the database is asked first because rows are also added by the watcher,
+        # other workers and rebuilds, only the directory search is skipped for guids
+        # that were not found there recently
+        if guid_index is not None and guid_index.is_missing(guid):
+            return []
+        results = filename_search(guid)
         if len(results) > 0:
             for result in results:
                 insert_into_db(connection, guid, result)
             paths = database_search(connection, guid, file_type)
             connection.commit()
-    connection.close()
-    if len(paths) > 0:
+        elif guid_index is not None:
+            guid_index.remember_missing(guid)
+    if len(paths) > 0 and result_cache is not None:
+        result_cache.put(shorten_guid(guid), tuple(file_type), paths)
+    return paths
+
+
+def partial_search_api(query, mode, file_type):
+    """
+    Searches for guids that start with or contain the query, or that are close to it,
+    see api/guid_search.py. Returns a JSON object with the ranked matches, the number
+    of matches is limited by the limit parameter and the edit distance of fuzzy
+    matches by the distance parameter.
+    """
+    from api import guid_search
+    if mode not in guid_search.MATCH_MODES:
+        return jsonify({'error': f'Unknown match mode, use one of {", ".join(guid_search.MATCH_MODES)}'}), 400
+    try:
+        limit = int(request.args.get('limit', guid_search.SEARCH_LIMIT))
+        distance = int(request.args.get('distance', guid_search.FUZZY_DISTANCE))
+    except ValueError:
+        return jsonify({'error': 'limit and distance must be integers'}), 400
+    limit = max(1, min(limit, guid_search.MAX_SEARCH_LIMIT))
+    distance = max(0, min(distance, guid_search.MAX_FUZZY_DISTANCE))
+    results = guid_search.search(get_db_connection(), query, mode, file_type, limit, distance)
+    return jsonify({'query': query, 'match': mode, 'results': results})
+
+
+@bp.route('/searchapi/stats', methods=['GET'])
+def search_stats():
+    """returns statistics of the result cache of this worker"""
+    return jsonify({'pid': os.getpid(),
+                    'result_cache': result_cache.info() if result_cache is not None else None})
+
+
+@bp.route('/searchapi/batch', methods=['POST'])
+def batch_search_api():
+    """
+    Resolves many guids with one request. The body is a JSON object with a list of
+    guids, and optionally a file type (or list of file types) in "file" and the
+    "onlyfirst" flag. Returns a JSON object from the guids to their lists of paths,
+    or to the first path (or null) if onlyfirst was used.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    guids = data.get('guids')
+    if not isinstance(guids, list) or not all(isinstance(guid, str) for guid in guids):
+        return jsonify({'error': 'Missing required parameter: guids must be a list of strings'}), 400
+    file_type = data.get('file', [])
+    file_type = [file_type] if isinstance(file_type, str) else file_type
+    if not isinstance(file_type, list) or not all(isinstance(type_, str) for type_ in file_type):
+        return jsonify({'error': 'Invalid parameter: file must be a string or a list of strings'}), 400
+    only_first = data.get('onlyfirst', False)
+    connection = get_db_connection()
+    found = database_search_batch(connection, guids, file_type)
+    missing = set(shorten_guid(guid) for guid in guids) - set(found)
+    if guid_index is not None:
+        missing = set(guid for guid in missing if not guid_index.is_missing(guid))
+    if missing:
+        results = filename_search_many(missing)
+        insert_many_into_db(connection, results)
+        found.update(database_search_batch(
+            connection, [guid for guid, paths in results.items() if paths], file_type))
+        if guid_index is not None:
+            for guid, paths in results.items():
+                if not paths:
+                    guid_index.remember_missing(guid)
+    response = {}
+    for guid in guids:
+        paths = [row['server_path'] for row in found.get(shorten_guid(guid), [])]
         if only_first:
-            return paths[0]['server_path']
+            response[guid] = paths[0] if paths else None
         else:
-            return [path['server_path'] for path in paths]
-    else:
-        return 'The requested file does not exist in our server'
+            response[guid] = paths
+    return jsonify(response)
 
 
 def create_app(build_db=BUILD_DB):
-    initialize_database(build_db)
+    """Creates the application. If build_db is True the database is rebuilt in the
+    background while requests are served from the current database, unless it was
+    rebuilt less than REBUILD_MAX_AGE seconds ago (see api/rebuild.py)."""
+    global guid_index, access_log, result_cache, snapshot_index
+    initialize_database()
+    if build_db:
+        from api import rebuild
+        rebuild.start_rebuild(max_age=rebuild.REBUILD_MAX_AGE)
+
+    from api.guid_index import GuidIndex
+    guid_index = GuidIndex(SEARCH_DIRECTORY, MISSING_GUID_TTL)
+    guid_index.start(GUID_INDEX_REFRESH)
+
+    from api.access_log import AccessLog
+    access_log = AccessLog(ACCESS_FLUSH_INTERVAL, ACCESS_FLUSH_SIZE)
+    access_log.start()
+
+    if RESULT_CACHE_SIZE > 0:
+        from api.result_cache import ResultCache
+        result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        metrics.add_collector(lambda: [
+            ('cache_requests_total', {'cache': 'result', 'result': 'hit'}, result_cache.stats['hits']),
+            ('cache_requests_total', {'cache': 'result', 'result': 'miss'}, result_cache.stats['misses'])])
+    if PATH_INDEX:
+        from api.path_index import PathIndex
+        snapshot_index = PathIndex()
+    metrics.start()
+
+    if WATCH_ASSETS:
+        from api.watcher import start_watcher
+        start_watcher(WATCH_ASSETS)
 
     app = Flask(__name__)
     app.config.from_prefixed_env()
     app.register_blueprint(bp)
 
+    from api.metrics import bp as metrics_bp, instrument
+    if metrics.enabled:
+        instrument(app)
+    app.register_blueprint(metrics_bp)
+
+    from api import profiling
+    if profiling.PROFILE_DIR:
+        profiling.instrument(app)
+
+    from api.rebuild import bp as rebuild_bp
+    app.register_blueprint(rebuild_bp)
+
+    from api.asset_streaming import bp as assets_bp
+    app.register_blueprint(assets_bp)
+
+    from api import catalog
+    catalog.initialize_catalog()
+    catalog.start_bootstrap()
+
     from api.mmif_storage import bp as mmif_bp
     # instead of using `url_prefix`, we use dedicated `API_PREFIX` vars in blueprints
     # this will eliminate unnecessary redirection step (and forced use of `-L` flag in curl command)
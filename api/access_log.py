@@ -0,0 +1,79 @@
+"""
+Write-behind buffer for the date_last_accessed column of the map table.
+
+Updating the access date on every lookup turns each read into a write transaction,
+which takes the database write lock and makes concurrent workers wait for each other.
+Instead, lookups only record which (GUID, file type) pairs were accessed and the
+buffer is written to the database in a single transaction when it gets large enough
+or when the flush interval has passed. Each pair is written at most once a day.
+"""
+
+import atexit
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import api
+
+
+class AccessLog:
+
+    def __init__(self, flush_interval: int = 60, max_pending: int = 1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = set()
+        self.flushed = set()
+        self.day = date.today().isoformat()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def touch(self, guid: str, file_type: str):
+        """Records an access of the files of a type for a (shortened) guid."""
+        today = date.today().isoformat()
+        with self.lock:
+            if today != self.day:
+                self.day = today
+                self.flushed = set()
+            key = (guid, file_type, today)
+            if key in self.flushed:
+                return
+            self.pending.add(key)
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes all pending accesses to the database in one transaction."""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, set()
+            if not batch:
+                return
+            connection = api.open_db_connection()
+            try:
+                with connection:
+                    connection.executemany(
+                        """UPDATE map SET date_last_accessed=? WHERE GUID=? and file_type=?
+                           and (date_last_accessed IS NULL or date_last_accessed<?);""",
+                        ((day, guid, file_type, day) for guid, file_type, day in batch))
+            except sqlite3.OperationalError as e:
+                # most likely the database was locked for too long, the accesses are
+                # kept so that they are written with the next flush
+                print(f'>>   Could not write access dates: {e}')
+                with self.lock:
+                    self.pending.update(batch)
+                return
+            finally:
+                connection.close()
+            with self.lock:
+                self.flushed.update(key for key in batch if key[2] == self.day)
+
+    def start(self):
+        """Starts flushing in a background thread and at exit."""
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+        threading.Thread(target=run, name='access-log', daemon=True).start()
+        atexit.register(self.flush)
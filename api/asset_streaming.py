@@ -0,0 +1,74 @@
+"""
+Streaming assets to clients that cannot read the assets directory.
+
+The /assetapi route resolves a guid and file type like /searchapi and sends the
+first file found. The file is never read into memory:
+
+- By default it is sent with send_file(), which gunicorn hands to the kernel with
+  sendfile() for whole files. Range requests, which video players use to seek, get a
+  206 with the requested bytes, and If-Range, If-None-Match and If-Modified-Since
+  are honored.
+- With FLASK_USE_X_SENDFILE=1 the response has an X-Sendfile header and no body,
+  for Apache with mod_xsendfile or lighttpd, which then send the file and handle
+  ranges themselves.
+- With ASSET_ACCEL_REDIRECT set to an internal nginx location that maps to the
+  assets directory, for example /protected-assets/, the response has an
+  X-Accel-Redirect header with the path of the file below that location.
+
+Only files below SEARCH_DIRECTORY are sent, after resolving symbolic links, so a
+path in the database that points elsewhere gets a 403.
+"""
+
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Blueprint, Response, jsonify, request, send_file
+
+import api
+
+
+ASSET_ACCEL_REDIRECT = os.environ.get('ASSET_ACCEL_REDIRECT')
+
+bp = Blueprint('assets', __name__)
+
+
+def confined_path(path: str):
+    """Returns the real path of a file if it is below SEARCH_DIRECTORY, None otherwise."""
+    root = os.path.realpath(api.SEARCH_DIRECTORY)
+    real = os.path.realpath(path)
+    if os.path.commonpath([root, real]) != root:
+        return None
+    return real
+
+
+def accel_redirect_response(path: str):
+    relative = os.path.relpath(path, os.path.realpath(api.SEARCH_DIRECTORY))
+    # nginx sends the file and answers range requests itself
+    response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = ASSET_ACCEL_REDIRECT.rstrip('/') + '/' + quote(relative)
+    return response
+
+
+@bp.route('/assetapi', methods=['GET'])
+def asset_api():
+    """
+    Sends the asset for the guid and file type in the query string, the file type is
+    optional. Returns a 404 if there is no such asset and a 403 if its path is outside
+    of the assets directory.
+    """
+    guid = request.args.get('guid')
+    if not guid:
+        return jsonify({'error': 'Missing required parameter: guid'}), 400
+    file_type = [request.args['file']] if 'file' in request.args else []
+    paths = api.find_paths(guid, file_type)
+    if not paths:
+        return jsonify({'error': f'Did not find: {guid}'}), 404
+    path = confined_path(paths[0]['server_path'])
+    if path is None:
+        return jsonify({'error': 'The asset is outside of the assets directory'}), 403
+    if not os.path.isfile(path):
+        return jsonify({'error': f'Did not find: {guid}'}), 404
+    if ASSET_ACCEL_REDIRECT:
+        return accel_redirect_response(path)
+    return send_file(path, conditional=True, etag=True)
@@ -0,0 +1,99 @@
+"""
+Content-addressed storage of MMIF files.
+
+When STORAGE_DEDUP is set, the content of an uploaded MMIF file is stored once, as a
+blob named by its SHA-256 hash in the .blobs directory of STORAGE_DIR:
+
+    .blobs/<first two hex digits>/<sha256>.mmif
+
+and the file in the pipeline directory is a hard link to the blob. Uploads of the
+same content to other pipelines, or with parameters in a different order, only add
+a link, and an overwrite with unchanged content writes nothing. The precompressed
+copies of a blob (see MMIF_SIDECARS) are shared the same way. Since the files in the
+pipeline directories are ordinary files, nothing that reads them needs to know about
+blobs, and the .blobs directory is hidden, so it is skipped by everything that walks
+the storage directory.
+
+A blob that is not linked from any pipeline directory anymore, because the file was
+overwritten with other content or removed, has a link count of one. Those blobs are
+removed with
+
+$ python -m api.catalog gc [--min-age SECONDS]
+
+which leaves blobs younger than --min-age (default one hour) alone, so that it can
+run while uploads are stored.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+
+STORAGE_DEDUP = os.environ.get('STORAGE_DEDUP', '0') in ('1', 't', 'true', 'True')
+
+BLOB_DIRECTORY = '.blobs'
+GC_MIN_AGE = 3600
+CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_path(storage_directory, digest: str) -> Path:
+    return Path(storage_directory) / BLOB_DIRECTORY / digest[:2] / f'{digest}.mmif'
+
+
+def is_stored_as(path, blob) -> bool:
+    """Returns whether path is a link to the blob."""
+    try:
+        return os.path.samefile(path, blob)
+    except FileNotFoundError:
+        return False
+
+
+def link_into_place(blob, path):
+    """Makes path a hard link to the blob, replacing an existing file in one step.
+    Raises FileNotFoundError if the blob does not exist."""
+    path = Path(path)
+    tmp = path.parent / f'.{path.name}.{os.getpid()}-{threading.get_ident()}.link'
+    tmp.unlink(missing_ok=True)
+    os.link(blob, tmp)
+    os.replace(tmp, path)
+
+
+def blob_digests(storage_directory):
+    """Returns a dictionary from the inodes of the blobs to their digests."""
+    digests = {}
+    for path in (Path(storage_directory) / BLOB_DIRECTORY).glob('*/*.mmif'):
+        digests[path.stat().st_ino] = path.stem
+    return digests
+
+
+def collect_garbage(storage_directory, min_age: int = GC_MIN_AGE):
+    """Removes the blobs and their precompressed copies that are not linked from the
+    pipeline directories and that are older than min_age seconds. Returns the number
+    of blobs and bytes removed."""
+    t0 = time.time()
+    removed = freed = 0
+    for blob in (Path(storage_directory) / BLOB_DIRECTORY).glob('*/*.mmif'):
+        try:
+            stat = blob.stat()
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink > 1 or stat.st_mtime > time.time() - min_age:
+            continue
+        for companion in blob.parent.glob(f'{blob.name}.*'):
+            freed += companion.stat().st_size
+            companion.unlink(missing_ok=True)
+        blob.unlink(missing_ok=True)
+        removed += 1
+        freed += stat.st_size
+    print(f'>>   Removed {removed} unused blobs ({freed} bytes) in {time.time() - t0:.2f}s')
+    return removed, freed
@@ -0,0 +1,395 @@
+"""
+SQLite catalog of the MMIF files in the storage directory.
+
+The catalog has one row per stored MMIF file in the mmifs table, one row per
+pipeline with running totals in the pipelines table, and the app, version, parameter
+hash and parameters of each step of a pipeline in the pipeline_steps table. Files
+that are links to a blob (see api/blob_store.py) have the digest of the blob in the
+mmif_digests table. Paths and pipelines are relative to STORAGE_DIR. It is maintained by upload_mmif() and
+lets /storeapi/status aggregate from the database instead of walking the storage
+directory.
+
+When the server starts with an empty catalog and a storage directory that has MMIF
+files, for example after upgrading, the catalog is filled from disk in the background
+by one worker, which holds a lock file meanwhile. Until it is done the routes that
+answer from the catalog return 503 instead of reporting files as missing.
+
+If the catalog gets out of sync with the storage directory, for example because
+files were copied in by hand, it can be rebuilt from disk:
+
+$ python -m api.catalog reconcile
+
+The files in the storage directory can be moved to the flat or sharded layout (see
+api/storage_layout.py) while the server is stopped with:
+
+$ python -m api.catalog reshard [--layout flat|sharded] [-w WORKERS]
+
+Blobs that are not used anymore are removed with:
+
+$ python -m api.catalog gc [--min-age SECONDS]
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from api import STORAGE_DIRECTORY
+from api import blob_store, storage_layout
+from api.mmif_ingest import scan_mmif
+
+
+CATALOG_DATABASE = os.environ.get('CATALOG_DB', Path(__file__).parent / 'catalog.db')
+RECONCILE_LOCK_FILE = Path(f'{CATALOG_DATABASE}.lock')
+
+# number of pipelines returned by /storeapi/status if no limit is given
+STATUS_PAGE_SIZE = int(os.environ.get('STATUS_PAGE_SIZE', 1000))
+
+_connections = threading.local()
+
+
+def initialize_catalog():
+    connection = sqlite3.connect(CATALOG_DATABASE)
+    connection.execute('PRAGMA journal_mode=WAL;')
+    with open(Path(__file__).parent / 'catalog_schema.sql') as f:
+        connection.executescript(f.read())
+    connection.close()
+
+
+def get_catalog_connection():
+    """gets the connection to the catalog for the current worker and thread"""
+    pid = os.getpid()
+    if getattr(_connections, 'pid', None) != pid:
+        connection = sqlite3.connect(CATALOG_DATABASE, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA synchronous=NORMAL;')
+        _connections.connection = connection
+        _connections.pid = pid
+    return _connections.connection
+
+
+def is_dirty(pipeline: str):
+    return '-dirty' in pipeline
+
+
+def steps_of_pipeline(pipeline: str):
+    """Splits a pipeline path into (app, version, param_hash) triples."""
+    segments = pipeline.split('/')
+    return [tuple(segments[i:i + 3]) for i in range(0, len(segments) - 2, 3)]
+
+
+def record_mmif(connection, path: str, pipeline: str, guid: str, size: int,
+                view_count: int, steps: list, digest: str = None):
+    """
+    Adds or updates the catalog entry of a stored MMIF file in a single transaction.
+    The steps are (app, version, param_hash, parameters) tuples for each step of the
+    pipeline, the digest is the one of its blob if the file is a link to a blob.
+    """
+    with connection:
+        _record_mmif(connection, path, pipeline, guid, size, view_count, steps, digest)
+
+
+def _record_mmif(connection, path, pipeline, guid, size, view_count, steps, digest=None):
+    """Like record_mmif() but without committing."""
+    old = connection.execute(
+        "SELECT size FROM mmifs WHERE path=?;", (path,)).fetchone()
+    connection.execute(
+        "INSERT OR REPLACE INTO mmifs VALUES (?, ?, ?, ?, ?, ?, ?);",
+        (path, pipeline, guid, size, view_count, time.time(), is_dirty(pipeline)))
+    if old is None:
+        count_delta, size_delta = 1, size
+    else:
+        count_delta, size_delta = 0, size - old['size']
+    connection.execute(
+        """INSERT INTO pipelines VALUES (?, ?, ?, ?) ON CONFLICT (pipeline) DO UPDATE
+           SET mmif_count=mmif_count+excluded.mmif_count,
+               total_size=total_size+excluded.total_size;""",
+        (pipeline, count_delta, size_delta, is_dirty(pipeline)))
+    connection.executemany(
+        "INSERT OR REPLACE INTO pipeline_steps VALUES (?, ?, ?, ?, ?, ?);",
+        ((pipeline, position, app, version, param_hash, json.dumps(parameters))
+         for position, (app, version, param_hash, parameters) in enumerate(steps)))
+    if digest is None:
+        connection.execute("DELETE FROM mmif_digests WHERE path=?;", (path,))
+    else:
+        connection.execute("INSERT OR REPLACE INTO mmif_digests VALUES (?, ?);", (path, digest))
+
+
+def find_extension(prefix: str, guid: str):
+    """
+    Returns the path of the stored MMIF file for the guid whose pipeline extends the
+    prefix pipeline with the fewest steps, or None if there is none. Ties are broken
+    by the pipeline path so the result does not depend on the order of uploads.
+    """
+    prefix = prefix.rstrip('/') + '/'
+    row = get_catalog_connection().execute(
+        """SELECT path FROM mmifs WHERE guid=? and substr(pipeline, 1, ?)=?
+           ORDER BY length(pipeline) - length(replace(pipeline, '/', '')), pipeline
+           LIMIT 1;""", (guid, len(prefix), prefix)).fetchone()
+    return row['path'] if row is not None else None
+
+
+def presence(pipelines: list, guids: list, rewind: bool = False):
+    """
+    Returns for each pipeline the set of positions in the guid list of the guids
+    that have a stored MMIF for that pipeline. With rewind, also returns for each
+    pipeline a dictionary from the positions of the other guids to the pipeline that
+    their MMIF can be rewound from (the one with the fewest steps, as in
+    find_extension()). Only the catalog is used, no files are read.
+    """
+    connection = get_catalog_connection()
+    connection.execute("""CREATE TEMP TABLE IF NOT EXISTS presence_guids (position INTEGER PRIMARY KEY, guid TEXT);""")
+    connection.execute("""CREATE INDEX IF NOT EXISTS temp.presence_guids_guid ON presence_guids (guid);""")
+    connection.execute("""DELETE FROM presence_guids;""")
+    connection.executemany(
+        """INSERT INTO presence_guids VALUES (?, ?);""", enumerate(guids))
+    results = []
+    for pipeline in pipelines:
+        present = set(row[0] for row in connection.execute(
+            """SELECT g.position FROM presence_guids g
+               JOIN mmifs m ON m.guid=g.guid WHERE m.pipeline=?;""", (pipeline,)))
+        sources = {}
+        if rewind:
+            prefix = pipeline.rstrip('/') + '/'
+            rows = connection.execute(
+                """SELECT g.position, m.pipeline FROM presence_guids g
+                   JOIN mmifs m ON m.guid=g.guid WHERE substr(m.pipeline, 1, ?)=?
+                   ORDER BY length(m.pipeline) - length(replace(m.pipeline, '/', '')) DESC,
+                            m.pipeline DESC;""", (len(prefix), prefix))
+            # the rows are sorted so that the best source of each guid comes last
+            for position, source in rows:
+                if position not in present:
+                    sources[position] = source
+        results.append((present, sources))
+    # only the temporary table was written, but the transaction has to be closed so
+    # that later reads see changes made by other connections
+    connection.commit()
+    return results
+
+
+def read_parameters(storage_directory: str, pipeline: str, position: int, param_hash: str):
+    """Reads the parameter file of a pipeline step, which is stored next to the
+    directory of the step."""
+    step_directory = Path(storage_directory, *pipeline.split('/')[:position * 3 + 2])
+    try:
+        with open(step_directory / f'{param_hash}.json') as f:
+            parameters = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    # older versions wrote an empty string for views without parameters
+    return parameters if parameters else {}
+
+
+def reconcile(storage_directory: str = STORAGE_DIRECTORY, clear: bool = True):
+    """
+    Rebuilds the catalog from the files in the storage directory. With clear the old
+    entries are removed and everything is written in one transaction. Without clear
+    entries are only added or updated, one directory per transaction, so that uploads
+    are not blocked while a large storage directory is read.
+    """
+    t0 = time.time()
+    connection = get_catalog_connection()
+    digests = blob_store.blob_digests(storage_directory)
+    if clear:
+        with connection:
+            connection.execute("DELETE FROM mmifs;")
+            connection.execute("DELETE FROM pipelines;")
+            connection.execute("DELETE FROM pipeline_steps;")
+            connection.execute("DELETE FROM mmif_digests;")
+            for root, mmif_files in stored_directories(storage_directory):
+                _reconcile_directory(connection, storage_directory, root, mmif_files, digests)
+    else:
+        for root, mmif_files in stored_directories(storage_directory):
+            with connection:
+                _reconcile_directory(connection, storage_directory, root, mmif_files, digests)
+    print(f'>>   Reconciled the catalog in {time.time() - t0:.2f}s')
+
+
+def stored_directories(storage_directory: str):
+    """Yields the directories of the storage directory that have MMIF files, with the
+    names of those files."""
+    for root, dirs, files in os.walk(storage_directory):
+        # lock files and temporary files are not part of any pipeline
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        mmif_files = [f for f in files if f.endswith('.mmif')]
+        if mmif_files:
+            yield root, mmif_files
+
+
+def _reconcile_directory(connection, storage_directory, root, mmif_files, digests):
+    directory = os.path.relpath(root, storage_directory)
+    pipeline = storage_layout.pipeline_of(directory)
+    if pipeline in ('.', ''):
+        return
+    steps = [(app, version, param_hash,
+              read_parameters(storage_directory, pipeline, position, param_hash))
+             for position, (app, version, param_hash)
+             in enumerate(steps_of_pipeline(pipeline))]
+    for fname in mmif_files:
+        fpath = os.path.join(root, fname)
+        try:
+            # only the views are counted, so the annotations do not need to be parsed
+            view_count = len(scan_mmif(fpath).views)
+        except Exception as e:
+            print(f'>>   Skipping {fpath}, it is not a valid MMIF file: {e}')
+            continue
+        stat = os.stat(fpath)
+        _record_mmif(connection, os.path.join(directory, fname), pipeline,
+                     fname[:-len('.mmif')], stat.st_size, view_count, steps,
+                     digests.get(stat.st_ino))
+
+
+def is_empty():
+    return get_catalog_connection().execute("SELECT 1 FROM mmifs LIMIT 1;").fetchone() is None
+
+
+def has_stored_mmifs(storage_directory: str):
+    """Returns whether there is at least one MMIF file in the storage directory, which
+    stops walking at the first one."""
+    return next(stored_directories(storage_directory), None) is not None
+
+
+def bootstrap(storage_directory: str = STORAGE_DIRECTORY):
+    """
+    Fills an empty catalog from the MMIF files in the storage directory. The lock is
+    held while the catalog is checked and filled, so when several workers start at
+    the same time one of them fills it and the others find it filled.
+    """
+    with open(RECONCILE_LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_empty() and has_stored_mmifs(storage_directory):
+            print('>>   The catalog is empty, adding the stored MMIF files')
+            reconcile(storage_directory, clear=False)
+        # the worker keeps its connection, so the read transaction has to be closed
+        get_catalog_connection().commit()
+
+
+def start_bootstrap(storage_directory: str = STORAGE_DIRECTORY):
+    thread = threading.Thread(target=bootstrap, args=(storage_directory,),
+                              name='catalog-bootstrap', daemon=True)
+    thread.start()
+    return thread
+
+
+def is_reconciling():
+    """Returns whether a worker is filling the catalog at the moment."""
+    with open(RECONCILE_LOCK_FILE, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    return False
+
+
+def reshard(storage_directory: str = STORAGE_DIRECTORY, sharded: bool = storage_layout.STORAGE_SHARDED,
+            workers: int = 16):
+    """Moves all MMIF files in the storage directory to the flat or sharded layout and
+    updates their paths in the catalog."""
+    t0 = time.time()
+    storage_directory = os.path.normpath(storage_directory)
+    moves = list(storage_layout.files_to_move(storage_directory, sharded))
+    storage_layout.move_all(moves, workers)
+    # all entries are checked, so that files moved by an interrupted run are included
+    connection = get_catalog_connection()
+    updates = []
+    for row in connection.execute("SELECT path, pipeline, guid FROM mmifs;").fetchall():
+        target = storage_layout.mmif_path(row['pipeline'], row['guid'], sharded)
+        if target != row['path'] and os.path.isfile(os.path.join(storage_directory, target)):
+            updates.append((target, row['path']))
+    with connection:
+        connection.executemany("UPDATE mmifs SET path=? WHERE path=?;", updates)
+        connection.executemany("UPDATE mmif_digests SET path=? WHERE path=?;", updates)
+    print(f'>>   Moved {len(moves)} MMIF files to the {"sharded" if sharded else "flat"} '
+          f'layout in {time.time() - t0:.2f}s')
+
+
+def dedup_stats():
+    """Returns the number of files that are links to blobs, the number of blobs, the
+    size of those files and the size of the blobs, which is what they take on disk."""
+    row = get_catalog_connection().execute(
+        """SELECT count(*), count(DISTINCT digest), coalesce(sum(size), 0) FROM mmif_digests
+           JOIN mmifs USING (path);""").fetchone()
+    stored = get_catalog_connection().execute(
+        """SELECT coalesce(sum(size), 0) FROM (SELECT max(size) AS size FROM mmif_digests
+           JOIN mmifs USING (path) GROUP BY digest);""").fetchone()[0]
+    return {"deduplicated_mmif_files": row[0], "blob_count": row[1],
+            "logical_size": row[2], "stored_size": stored, "saved_size": row[2] - stored}
+
+
+def pipeline_status(app: str = None, version: str = None, dirty: bool = None,
+                    limit: int = STATUS_PAGE_SIZE, offset: int = 0):
+    """
+    Returns the storage status in the format of /storeapi/status, restricted to the
+    pipelines that have a step with the given app and version and that are or are not
+    dirty. The totals cover all matching pipelines, the list of pipelines is limited
+    to one page.
+    """
+    conditions = []
+    parameters = []
+    if app is not None or version is not None:
+        step_conditions = ["s.pipeline=p.pipeline"]
+        if app is not None:
+            step_conditions.append("s.app=?")
+            parameters.append(app)
+        if version is not None:
+            step_conditions.append("s.version=?")
+            parameters.append(version)
+        conditions.append(
+            f"EXISTS (SELECT 1 FROM pipeline_steps s WHERE {' and '.join(step_conditions)})")
+    if dirty is not None:
+        conditions.append("p.dirty=?")
+        parameters.append(int(dirty))
+    where = f"WHERE {' and '.join(conditions)}" if conditions else ''
+    # a pipeline is not terminal if another pipeline extends it, '0' is the character
+    # after '/' so this is a range scan over the primary key
+    query = f"""
+        SELECT p.pipeline, p.mmif_count, p.total_size, p.dirty,
+               EXISTS (SELECT 1 FROM pipelines q WHERE q.pipeline>p.pipeline || '/'
+                       and q.pipeline<p.pipeline || '0') AS non_terminal
+        FROM pipelines p {where}"""
+    connection = get_catalog_connection()
+    totals = connection.execute(
+        f"""SELECT count(*), coalesce(sum(mmif_count), 0),
+                   coalesce(sum(mmif_count * non_terminal), 0), coalesce(sum(mmif_count * dirty), 0)
+            FROM ({query});""", parameters).fetchone()
+    rows = connection.execute(
+        f"{query} ORDER BY p.pipeline LIMIT ? OFFSET ?;", (*parameters, limit, offset)).fetchall()
+    pipelines = []
+    for row in rows:
+        spec = {}
+        for step in connection.execute(
+                "SELECT app, version, param_hash, parameters FROM pipeline_steps WHERE pipeline=? ORDER BY position;",
+                (row['pipeline'],)):
+            spec[f"{step['app']}/{step['version']}/{step['param_hash']}"] = json.loads(step['parameters'])
+        pipelines.append({"path": row['pipeline'], "spec": spec,
+                          "mmif_count": row['mmif_count'], "total_size": row['total_size']})
+    return {"total_mmif_files": totals[1], "total_pipelines": totals[0],
+            "pipelines": pipelines, "non_terminal_mmif_count": totals[2],
+            "dirty_pipeline_mmif_count": totals[3], "offset": offset, "limit": limit,
+            "deduplication": dedup_stats()}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['reconcile', 'reshard', 'gc'])
+    parser.add_argument('-s', '--storage-dir', default=STORAGE_DIRECTORY)
+    parser.add_argument('--layout', choices=['flat', 'sharded'],
+                        default='sharded' if storage_layout.STORAGE_SHARDED else 'flat')
+    parser.add_argument('-w', '--workers', type=int, default=16)
+    parser.add_argument('--min-age', type=int, default=blob_store.GC_MIN_AGE,
+                        help='seconds that unused blobs are kept before gc removes them')
+    args = parser.parse_args()
+    initialize_catalog()
+    if args.command == 'reconcile':
+        with open(RECONCILE_LOCK_FILE, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            reconcile(args.storage_dir)
+    elif args.command == 'gc':
+        blob_store.collect_garbage(args.storage_dir, args.min_age)
+    else:
+        reshard(args.storage_dir, args.layout == 'sharded', args.workers)
@@ -0,0 +1,32 @@
+CREATE TABLE IF NOT EXISTS mmifs (
+	path	TEXT PRIMARY KEY,
+	pipeline	TEXT NOT NULL,
+	guid	TEXT NOT NULL,
+	size	INTEGER NOT NULL,
+	view_count	INTEGER NOT NULL,
+	uploaded	REAL NOT NULL,
+	dirty	INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mmifs_pipeline ON mmifs (pipeline);
+CREATE INDEX IF NOT EXISTS mmifs_guid ON mmifs (guid);
+CREATE TABLE IF NOT EXISTS pipelines (
+	pipeline	TEXT PRIMARY KEY,
+	mmif_count	INTEGER NOT NULL,
+	total_size	INTEGER NOT NULL,
+	dirty	INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pipeline_steps (
+	pipeline	TEXT NOT NULL,
+	position	INTEGER NOT NULL,
+	app	TEXT NOT NULL,
+	version	TEXT NOT NULL,
+	param_hash	TEXT NOT NULL,
+	parameters	TEXT NOT NULL,
+	PRIMARY KEY (pipeline, position)
+);
+CREATE INDEX IF NOT EXISTS pipeline_steps_app ON pipeline_steps (app, version);
+CREATE TABLE IF NOT EXISTS mmif_digests (
+	path	TEXT PRIMARY KEY,
+	digest	TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mmif_digests_digest ON mmif_digests (digest);
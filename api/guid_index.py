@@ -0,0 +1,96 @@
+"""
+In-memory index from shortened GUIDs to the files in the asset directory.
+
+This replaces the full directory walk that used to be done for every GUID that was
+not in the database. The index is built by a background thread when the application
+starts and is then refreshed incrementally with the AssetScanner. Until the first
+build is finished lookups return None and the caller has to fall back to a directory
+search. The index also remembers GUIDs that were looked up and not found so that
+repeated requests for them are answered without touching the database.
+"""
+
+import threading
+import time
+from pathlib import Path
+
+from api import shorten_guid
+from api.scanner import AssetScanner
+
+
+# expired entries of the negative cache are pruned when it grows beyond this size
+MAX_MISSING = 100000
+
+
+class GuidIndex:
+
+    def __init__(self, root, missing_ttl: int = 600):
+        self.scanner = AssetScanner(root)
+        self.paths = {}
+        self.missing = {}
+        self.missing_ttl = missing_ttl
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def refresh(self):
+        """Rescans the asset directory and updates the index with the changes."""
+        result = self.scanner.scan()
+        with self.lock:
+            for path in result.removed:
+                key = shorten_guid(Path(path).stem)
+                paths = self.paths.get(key)
+                if paths is not None:
+                    paths.discard(path)
+                    if not paths:
+                        del self.paths[key]
+            for path in result.added:
+                key = shorten_guid(Path(path).stem)
+                self.paths.setdefault(key, set()).add(path)
+                self.missing.pop(key, None)
+        self.ready.set()
+        return result
+
+    def start(self, interval: int):
+        """Builds the index in a background thread and refreshes it every interval
+        seconds, an interval of zero means that the index is built only once."""
+        def run():
+            while True:
+                t0 = time.time()
+                result = self.refresh()
+                print(f'>>   GUID index refreshed in {time.time() - t0:.2f}s '
+                      f'(+{len(result.added)} -{len(result.removed)} files)')
+                if interval <= 0:
+                    break
+                time.sleep(interval)
+        thread = threading.Thread(target=run, name='guid-index', daemon=True)
+        thread.start()
+        return thread
+
+    def lookup(self, guid: str):
+        """Returns the paths of all files for the guid, or None if the index has not
+        been built yet. Unlike directory_search() this only finds exact matches of the
+        shortened guid."""
+        if not self.ready.is_set():
+            return None
+        with self.lock:
+            paths = sorted(self.paths.get(shorten_guid(guid), ()))
+        return [Path(path) for path in paths]
+
+    def is_missing(self, guid: str) -> bool:
+        """Returns True if the guid was recently looked up and not found."""
+        key = shorten_guid(guid)
+        with self.lock:
+            missed = self.missing.get(key)
+            if missed is None:
+                return False
+            if time.time() - missed > self.missing_ttl:
+                del self.missing[key]
+                return False
+            return True
+
+    def remember_missing(self, guid: str):
+        now = time.time()
+        with self.lock:
+            if len(self.missing) >= MAX_MISSING:
+                self.missing = {k: t for k, t in self.missing.items()
+                                if now - t <= self.missing_ttl}
+            self.missing[shorten_guid(guid)] = now
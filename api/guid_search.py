@@ -0,0 +1,121 @@
+"""
+Partial and fuzzy GUID search.
+
+The map_search table is an FTS5 index with the trigram tokenizer over the GUID and
+the file name of each row in the map table, which triggers keep in sync with map
+(see schema.sql). It is used by /searchapi when a match mode is given:
+
+- prefix: the GUID or the file name starts with the query
+- substring: the GUID or the file name contains the query
+- fuzzy: the GUID or the file stem is within a maximum edit distance of the query
+
+Matching ignores case. Queries of at least three characters are answered from the
+trigram index, shorter queries need a scan of the index. For fuzzy matches the
+trigrams of the query find the candidates, ranked by bm25, and the edit distance is
+computed for those. Results are grouped by GUID and ranked, exact and earlier
+matches come first for prefix and substring matches and smaller edit distances for
+fuzzy matches.
+"""
+
+from pathlib import Path
+
+from api import type_filter
+from api.metrics import metrics
+
+
+MATCH_MODES = ('prefix', 'substring', 'fuzzy')
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+FUZZY_DISTANCE = 2
+MAX_FUZZY_DISTANCE = 4
+
+# maximum number of rows that are ranked for a prefix or substring query, and of
+# index entries that are compared with the query for a fuzzy query
+MAX_CANDIDATES = 10000
+FUZZY_CANDIDATES = 500
+
+
+def edit_distance(a: str, b: str, maximum: int) -> int:
+    """Returns the Levenshtein distance of two strings, or maximum + 1 if it is larger
+    than maximum."""
+    if abs(len(a) - len(b)) > maximum:
+        return maximum + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, start=1):
+        current = [i]
+        for j, other in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        if min(current) > maximum:
+            return maximum + 1
+        previous = current
+    return min(previous[-1], maximum + 1)
+
+
+def trigrams(query: str):
+    return sorted(set(query[i:i + 3] for i in range(len(query) - 2)))
+
+
+def candidate_rows(connection, mode: str, query: str, types):
+    condition, parameters = type_filter(types)
+    select = f"""SELECT map.GUID, file_type, server_path FROM map_search
+                 JOIN map ON map.rowid=map_search.rowid
+                 WHERE {{}}{condition}"""
+    if mode == 'fuzzy':
+        if len(query) < 3:
+            return []
+        # every trigram is a phrase, quotes in the query are doubled
+        match = ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in trigrams(query))
+        sql = (select.format('map_search.rowid IN (SELECT rowid FROM map_search WHERE map_search MATCH ? '
+                             'ORDER BY rank LIMIT ?)') + ';')
+        return connection.execute(sql, (match, FUZZY_CANDIDATES, *parameters)).fetchall()
+    pattern = f'{query}%' if mode == 'prefix' else f'%{query}%'
+    # the trigram index is only used for LIKE on a single column, hence the union
+    sql = (select.format('map_search.GUID LIKE ?') + ' UNION ' + select.format('map_search.name LIKE ?')
+           + ' LIMIT ?;')
+    return connection.execute(sql, (pattern, *parameters, pattern, *parameters, MAX_CANDIDATES)).fetchall()
+
+
+def score(mode: str, query: str, guid: str, server_path: str, distance: int):
+    """Returns a sort key for a row, or None if the row does not match. Wildcards in
+    the query match anything in LIKE, so matches are checked again here."""
+    guid = guid.lower()
+    name = Path(server_path).name.lower()
+    if mode == 'fuzzy':
+        best = min(edit_distance(query, guid, distance),
+                   edit_distance(query, Path(name).stem, distance))
+        return (best,) if best <= distance else None
+    if mode == 'prefix':
+        positions = [0 for text in (guid, name) if text.startswith(query)]
+    else:
+        positions = [text.find(query) for text in (guid, name) if query in text]
+    if not positions:
+        return None
+    return (guid != query, min(positions), len(guid))
+
+
+def search(connection, query: str, mode: str, types=(), limit: int = SEARCH_LIMIT,
+           distance: int = FUZZY_DISTANCE):
+    """
+    Returns a ranked list of at most limit matches for the query, each a dictionary
+    with the GUID and its paths. Fuzzy matches also have the edit distance.
+    """
+    query = query.lower()
+    with metrics.timer('sqlite_query_duration_seconds', query=f'guid_search_{mode}'):
+        rows = candidate_rows(connection, mode, query, types)
+    matches = {}
+    for row in rows:
+        key = score(mode, query, row['GUID'], row['server_path'], distance)
+        if key is None:
+            continue
+        match = matches.setdefault(row['GUID'], {'key': key, 'paths': []})
+        match['key'] = min(match['key'], key)
+        match['paths'].append(row['server_path'])
+    ranked = sorted(matches.items(), key=lambda item: (item[1]['key'], item[0]))[:limit]
+    results = []
+    for guid, match in ranked:
+        result = {'guid': guid, 'paths': sorted(match['paths'])}
+        if mode == 'fuzzy':
+            result['distance'] = match['key'][0]
+        results.append(result)
+    return results
@@ -0,0 +1,210 @@
+"""
+Request and hot path metrics in the Prometheus text format.
+
+Metrics are enabled by setting METRICS_DIR to a directory that all worker processes
+can write to. Each worker keeps its counters and histograms in memory and writes them
+to its own file in that directory every METRICS_FLUSH_INTERVAL seconds and when it
+exits. A scrape of /metrics is answered by one of the workers, which first writes its
+own file and then adds up the files of all workers, so the numbers cover the whole
+server. Files of workers that have exited are kept so that counters do not go down
+when gunicorn replaces a worker. The directory should be emptied before the server
+is started.
+
+Without METRICS_DIR nothing is recorded and /metrics returns a 404.
+
+Recorded are:
+
+- datahousing_http_request_duration_seconds: histogram by route, method and status
+- datahousing_http_request_bytes_total, datahousing_http_response_bytes_total: by route
+- datahousing_sqlite_query_duration_seconds: histogram by query
+- datahousing_directory_search_duration_seconds: histogram of the directory search
+  fallback, its count is the number of fallbacks
+- datahousing_mmif_duration_seconds: histogram by step (scan, validate, hash, parse, rewind,
+  serialize)
+- datahousing_mmif_bytes_written_total, datahousing_mmif_bytes_read_total
+- datahousing_cache_requests_total: by cache and result (hit or miss)
+- datahousing_catalog_errors_total: stored MMIFs that could not be added to the catalog
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from flask import Blueprint, Response, abort, g, request
+
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 10))
+
+PREFIX = 'datahousing_'
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def label_key(labels: dict):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics:
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = Path(directory) if directory else None
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if self.directory is None:
+            return
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if self.directory is None:
+            return
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # one count per bucket and for +Inf, then the sum
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def add_collector(self, collect):
+        """Adds a function that returns (name, labels, value) tuples for counters that
+        are kept elsewhere, for example the statistics of a cache. It is called when
+        the metrics are written."""
+        self.collectors.append(collect)
+
+    def flush(self):
+        if self.directory is None:
+            return
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(histogram) for key, histogram in self.histograms.items()}
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                key = (name, label_key(labels))
+                counters[key] = counters.get(key, 0) + value
+        data = {'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [[name, labels, histogram] for (name, labels), histogram in histograms.items()]}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f'metrics-{os.getpid()}.json'
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def start(self, interval: int = METRICS_FLUSH_INTERVAL):
+        if self.directory is None:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                self.flush()
+        threading.Thread(target=run, name='metrics', daemon=True).start()
+        atexit.register(self.flush)
+
+    def collect(self):
+        """Adds up the metrics files of all workers."""
+        counters = {}
+        histograms = {}
+        for path in self.directory.glob('metrics-*.json'):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            for name, labels, value in data['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, histogram in data['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = histograms.setdefault(key, [0] * len(histogram))
+                for i, value in enumerate(histogram):
+                    total[i] += value
+        return counters, histograms
+
+
+def format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render(counters: dict, histograms: dict):
+    """Returns the metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(set(name for name, _ in counters)):
+        lines.append(f'# TYPE {PREFIX}{name} counter')
+        for (_, labels), value in sorted(item for item in counters.items() if item[0][0] == name):
+            lines.append(f'{PREFIX}{name}{format_labels(labels)} {value}')
+    for name in sorted(set(name for name, _ in histograms)):
+        lines.append(f'# TYPE {PREFIX}{name} histogram')
+        for (_, labels), histogram in sorted(item for item in histograms.items() if item[0][0] == name):
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f'{PREFIX}{name}_bucket{format_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{PREFIX}{name}_bucket{format_labels(labels, [("le", "+Inf")])} {histogram[-2]}')
+            lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {histogram[-2]}')
+            lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {histogram[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+# the metrics of this worker
+metrics = Metrics()
+
+
+def instrument(app):
+    """Records the duration and size of all requests to the app. For streamed
+    responses the duration is the time until the response starts."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        # routes are recorded by their rule so that there is one series per route
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        start = g.pop('request_start', None)
+        if start is not None:
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                            route=route, method=request.method, status=response.status_code)
+        metrics.inc('http_request_bytes_total', request.content_length or 0, route=route)
+        if response.content_length is not None:
+            metrics.inc('http_response_bytes_total', response.content_length, route=route)
+        return response
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.get('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        abort(404)
+    metrics.flush()
+    return Response(render(*metrics.collect()), mimetype='text/plain; version=0.0.4')
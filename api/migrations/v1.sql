@@ -0,0 +1,15 @@
+-- Version 1: add a unique constraint on server_path and an index on (GUID, file_type).
+-- Duplicate rows for the same path are collapsed, keeping the oldest one.
+ALTER TABLE map RENAME TO map_v0;
+CREATE TABLE map (
+	GUID	TEXT NOT NULL,
+	file_type	TEXT NOT NULL,
+	server_path	TEXT NOT NULL UNIQUE,
+	date_created TEXT NOT NULL,
+	date_last_accessed TEXT
+);
+INSERT OR IGNORE INTO map
+	SELECT GUID, file_type, server_path, date_created, date_last_accessed
+	FROM map_v0 ORDER BY date_created;
+DROP TABLE map_v0;
+CREATE INDEX IF NOT EXISTS map_guid_file_type ON map (GUID, file_type);
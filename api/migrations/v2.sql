@@ -0,0 +1,7 @@
+-- Version 2: directory listings of the last scan of the assets directory.
+CREATE TABLE IF NOT EXISTS scan_dirs (
+	path	TEXT PRIMARY KEY,
+	mtime	INTEGER NOT NULL,
+	subdirs	TEXT NOT NULL,
+	files	TEXT NOT NULL
+);
@@ -0,0 +1,15 @@
+-- Version 3: log of GUIDs whose rows in map changed, used to invalidate cached results.
+CREATE TABLE IF NOT EXISTS map_changes (
+	seq	INTEGER PRIMARY KEY AUTOINCREMENT,
+	GUID	TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS map_insert AFTER INSERT ON map BEGIN
+	INSERT INTO map_changes (GUID) VALUES (new.GUID);
+END;
+CREATE TRIGGER IF NOT EXISTS map_delete AFTER DELETE ON map BEGIN
+	INSERT INTO map_changes (GUID) VALUES (old.GUID);
+END;
+CREATE TRIGGER IF NOT EXISTS map_update AFTER UPDATE OF GUID, file_type, server_path ON map BEGIN
+	INSERT INTO map_changes (GUID) VALUES (old.GUID);
+	INSERT INTO map_changes (GUID) VALUES (new.GUID);
+END;
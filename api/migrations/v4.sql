@@ -0,0 +1,21 @@
+-- Version 4: trigram index over the GUIDs and file names in map, used for partial and
+-- fuzzy GUID search. The file name is the part of server_path after the last '/'.
+CREATE VIRTUAL TABLE IF NOT EXISTS map_search USING fts5 (
+	GUID,
+	name,
+	tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS map_search_insert AFTER INSERT ON map BEGIN
+	INSERT INTO map_search (rowid, GUID, name) VALUES (new.rowid, new.GUID,
+		substr(new.server_path, length(rtrim(new.server_path, replace(new.server_path, '/', ''))) + 1));
+END;
+CREATE TRIGGER IF NOT EXISTS map_search_delete AFTER DELETE ON map BEGIN
+	DELETE FROM map_search WHERE rowid=old.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS map_search_update AFTER UPDATE OF GUID, server_path ON map BEGIN
+	DELETE FROM map_search WHERE rowid=old.rowid;
+	INSERT INTO map_search (rowid, GUID, name) VALUES (new.rowid, new.GUID,
+		substr(new.server_path, length(rtrim(new.server_path, replace(new.server_path, '/', ''))) + 1));
+END;
+INSERT INTO map_search (rowid, GUID, name)
+	SELECT rowid, GUID, substr(server_path, length(rtrim(server_path, replace(server_path, '/', ''))) + 1) FROM map;
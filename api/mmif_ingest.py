@@ -0,0 +1,187 @@
+"""
+Reading uploaded MMIFs.
+
+Uploaded MMIFs are copied from the request to a temporary file in the storage
+directory in chunks, which is then renamed to its place in the storage directory, so
+the body of a request is never held in memory as a whole. To find that place only
+the location of the first document and the app, parameters and warnings of the views
+are needed, and scan_mmif() reads just those. With the optional ijson package this is
+done without loading the file into memory, otherwise the file is loaded with the json
+module. In both cases the MMIF is not validated and no annotation objects are built,
+full validation with mmif-python is only done when asked for.
+
+The batch upload route accepts a stream of MMIF files in one of these formats:
+
+- tar: an archive with one MMIF file per regular member, the member names are only
+  used to identify the files in the report
+- ndjson: one serialized MMIF per line, identified by line number in the report
+
+Both can be gzip-compressed, either with a Content-Encoding: gzip header or, for tar,
+as a .tar.gz file. The files are copied one at a time from the request stream to
+temporary files and stored by a pool of worker threads. At most a few files per
+worker are waiting at any time, the rest of the request waits in the socket.
+"""
+
+import gzip
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+UPLOAD_FORMATS = {
+    'tar': ('application/x-tar', 'application/gzip', 'application/x-gzip'),
+    'ndjson': ('application/x-ndjson', 'application/jsonl')}
+
+# number of threads that store the MMIFs of a batch upload
+UPLOAD_WORKERS = max(1, int(os.environ.get('UPLOAD_WORKERS', 4)))
+
+CHUNK_SIZE = 1 << 20
+
+
+class ViewSummary(NamedTuple):
+    app: str
+    parameters: dict    # None if the view has no parameters
+    warnings: bool
+    annotations: bool   # only looked at for views with warnings
+
+
+class MmifSummary(NamedTuple):
+    location: str       # location of the first document with an identifier
+    views: list
+
+
+def spool(stream, directory) -> str:
+    """Copies a binary stream to a new temporary file in the directory and returns
+    its path. The file is hidden and does not end in .mmif, so it is ignored by
+    everything that lists stored MMIFs."""
+    fd, path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        # mkstemp() creates files that only the owner can read
+        os.chmod(path, 0o644)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def scan_mmif(path: str) -> MmifSummary:
+    """Reads the fields of a MMIF file that decide where it is stored."""
+    if ijson is None:
+        with open(path, 'rb') as f:
+            mmif = json.load(f)
+        document = first_document_with_id(mmif.get('documents', []))
+        views = [(view.get('metadata', {}), bool(view.get('annotations'))) for view in mmif.get('views', [])]
+    else:
+        with open(path, 'rb') as f:
+            document = first_document_with_id(ijson.items(f, 'documents.item', use_float=True))
+            f.seek(0)
+            metadata = list(ijson.items(f, 'views.item.metadata', use_float=True))
+            # whether a view has annotations only matters for views with warnings,
+            # and finding out takes a slower pass over all parser events
+            annotated = [True] * len(metadata)
+            if any(m.get('warnings') for m in metadata):
+                f.seek(0)
+                annotated = views_with_annotations(f)
+        views = list(zip(metadata, annotated))
+    location = document['properties'].get('location') if document is not None else None
+    return MmifSummary(location, [
+        ViewSummary(metadata.get('app'), metadata.get('parameters'), bool(metadata.get('warnings')), annotations)
+        for metadata, annotations in views])
+
+
+def first_document_with_id(documents):
+    """Returns the first document that has an identifier, or None. The documents are
+    not read any further, with ijson this stops before the views are parsed."""
+    for document in documents:
+        if document.get('properties', {}).get('id'):
+            return document
+    return None
+
+
+def views_with_annotations(f):
+    annotated = []
+    for prefix, event, _ in ijson.parse(f):
+        if prefix == 'views.item' and event == 'start_map':
+            annotated.append(False)
+        elif prefix == 'views.item.annotations.item' and event == 'start_map':
+            annotated[-1] = True
+    return annotated
+
+
+def upload_format(mimetype: str, requested: str = None):
+    """Returns the format of a batch upload, from the format query parameter if it was
+    given and from the content type otherwise. Returns None if it is unknown."""
+    if requested is not None:
+        return requested if requested in UPLOAD_FORMATS else None
+    for name, mimetypes in UPLOAD_FORMATS.items():
+        if mimetype in mimetypes:
+            return name
+    return None
+
+
+def read_tar(stream, directory):
+    """Yields (member name, temporary file) for the regular files in a tar stream,
+    which may be compressed."""
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            yield member.name, spool(archive.extractfile(member), directory)
+
+
+def read_ndjson(stream, directory):
+    """Yields ('line N', temporary file) for the non-empty lines of a stream."""
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if line:
+            yield f'line {number}', spool(io.BytesIO(line), directory)
+
+
+READERS = {'tar': read_tar, 'ndjson': read_ndjson}
+
+
+def read_upload(stream, upload_format: str, directory, content_encoding: str = None):
+    if content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    return READERS[upload_format](stream, directory)
+
+
+def store_all(files, store, workers: int = UPLOAD_WORKERS):
+    """
+    Calls store(path) for each (name, path) in files in a thread pool and yields
+    (name, result) in the order of the files. New files are only read when fewer
+    than twice the number of workers are waiting, so that memory use is bounded.
+    If the files cannot be read to the end, the last result is an error named 'request'.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        try:
+            for name, path in files:
+                pending.append((name, executor.submit(store, path)))
+                while len(pending) >= workers * 2:
+                    name, future = pending.popleft()
+                    yield name, future.result()
+        except (tarfile.TarError, OSError, EOFError, zlib.error) as e:
+            # the rest of the request cannot be read, what was read is still stored
+            read_error = {"status": "error", "message": f"{type(e).__name__} - {e}"}, 400
+            pending.append(('request', None))
+        while pending:
+            name, future = pending.popleft()
+            yield name, read_error if future is None else future.result()
+    finally:
+        executor.shutdown()
@@ -1,15 +1,38 @@
+import base64
+import fcntl
+import gzip
 import hashlib
+import io
 import json
-import re
 import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 
-from mmif import utils
 from clams_utils.aapb import guidhandler
-from flask import request, jsonify, Blueprint, current_app
+from flask import request, jsonify, Blueprint, Response, stream_with_context, send_file
 from mmif import Mmif
 
 from api import STORAGE_DIRECTORY
+from api import blob_store, catalog
+from api.metrics import metrics
+from api.mmif_ingest import UPLOAD_FORMATS, CHUNK_SIZE, upload_format, read_upload, store_all, spool, scan_mmif
+from api.mmif_streaming import STREAM_FORMATS, STREAMERS
+from api.rewind_cache import RewindCache
+from api.storage_layout import mmif_path, find_mmif, list_mmifs
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from mmif.utils import rewind
+except ImportError:
+    # mmif-python keeps the rewinder with its command line tools
+    from mmif.utils.cli import rewind
 
 
 # make blueprint of app to be used in __init__.py
@@ -21,6 +44,28 @@ bp = Blueprint(__file__.split(os.sep)[-1].split('.')[0].replace('_', '-'), __nam
 
 API_PREFIX = '/storeapi'
 
+# Precompressed copies of stored MMIF files that are written at upload time and sent
+# to clients that accept the encoding, a comma-separated list of 'gzip' and 'zstd'.
+# The zstd copies require the optional zstandard package.
+SIDECAR_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+MMIF_SIDECARS = [encoding.strip() for encoding in os.environ.get('MMIF_SIDECARS', '').split(',')
+                 if encoding.strip() in SIDECAR_SUFFIXES]
+
+# Directory and maximum size in bytes of the cache of rewound MMIFs, a size of 0
+# disables the cache.
+REWIND_CACHE_DIR = os.environ.get('REWIND_CACHE_DIR', Path(__file__).parent / 'rewind-cache')
+REWIND_CACHE_SIZE = int(os.environ.get('REWIND_CACHE_SIZE', 1 << 30))
+rewind_cache = RewindCache(REWIND_CACHE_DIR, REWIND_CACHE_SIZE) if REWIND_CACHE_SIZE > 0 else None
+
+# Uploads of the same MMIF file are serialized with a lock on one of this many lock
+# files in the .locks directory of the storage directory. These are flock locks, so
+# they work across worker processes.
+STORAGE_LOCK_STRIPES = int(os.environ.get('STORAGE_LOCK_STRIPES', 64))
+
+# Directories and parameter files that are known to exist, so that uploads to a
+# pipeline that was seen before need no mkdir or parameter file writes.
+known_paths = set()
+
 
 class StorageServerError(Exception):
     pass
@@ -41,35 +86,67 @@ def split_appname_appversion(long_app_id):
     return app_name, app_version
 
 
-def identifier_of_first_document(mmif_file: Mmif):
-    for doc in mmif_file.documents:
-        if doc.id:
-            return doc.id
-    return None
-
-
 @bp.post(f"{API_PREFIX}/upload")
 def upload_mmif():
+    overwrite = request.args.get('overwrite')
+    overwrite = True if overwrite in ('1', 't', 'true', 'True') else False
+    validate = request.args.get('validate') in ('1', 't', 'true', 'True')
+    path = spool(request.stream, STORAGE_DIRECTORY)
+    return store_mmif(path, overwrite, validate)
+
+
+@bp.post(f"{API_PREFIX}/upload/batch")
+def upload_mmif_batch():
+    """
+    Stores all MMIFs in a tar or NDJSON request body (see api/mmif_ingest.py) with a
+    pool of workers and returns the result of each file, in the same format as the
+    response of the upload route, together with counts per status.
+    """
+    overwrite = request.args.get('overwrite')
+    overwrite = True if overwrite in ('1', 't', 'true', 'True') else False
+    validate = request.args.get('validate') in ('1', 't', 'true', 'True')
+    fmt = upload_format(request.mimetype, request.args.get('format'))
+    if fmt is None:
+        return jsonify({'error': f'Unknown upload format, use one of {", ".join(UPLOAD_FORMATS)}'}), 400
+    files = read_upload(request.stream, fmt, STORAGE_DIRECTORY, request.headers.get('Content-Encoding'))
+    results = []
+    counts = {'success': 0, 'warning': 0, 'error': 0}
+    for name, (result, code) in store_all(files, lambda path: store_mmif(path, overwrite, validate)):
+        counts[result['status']] += 1
+        results.append(dict(result, name=name, code=code))
+    return jsonify({'counts': counts, 'results': results})
+
+
+def store_mmif(upload: str, overwrite: bool, validate: bool = False):
+    """
+    Moves an uploaded MMIF file from its temporary file to the directory of its
+    pipeline and returns the response as a dictionary and a status code. This does not
+    use the request, so it can run in worker threads for batch uploads. Only the
+    fields needed to find the directory are read from the file (see scan_mmif() in
+    api/mmif_ingest.py), unless validate is true, in which case the file is loaded
+    with mmif-python first. The temporary file is always removed. A file that was
+    stored but could not be added to the catalog is still reported as stored.
+    """
     try:
-        body = request.get_data(as_text=True)
-        overwrite = request.args.get('overwrite')
-        overwrite = True if overwrite in ('1', 't', 'true', 'True') else False
-        mmif = Mmif(body)
+        if validate:
+            with metrics.timer('mmif_duration_seconds', step='validate'), open(upload, 'r') as f:
+                Mmif(f.read())
+        with metrics.timer('mmif_duration_seconds', step='scan'):
+            mmif = scan_mmif(upload)
         # TODO (krim @ 3/21/25): hardcoding of document id might be a bad idea,
         # fix this after https://github.com/clamsproject/mmif-python/pull/304 is merged
-        # NOTE (marc @ 4/15/25): I had examples where the identifier was not 'd1' so I got 
-        # rid of the hard-wired doc id with the hack below awaiting the merge above
-        identifier = identifier_of_first_document(mmif)
-        guid = guidhandler.get_aapb_guid_from(mmif[identifier].location)
+        # NOTE (marc @ 4/15/25): I had examples where the identifier was not 'd1' so
+        # scan_mmif() takes the location of the first document with an identifier
+        guid = guidhandler.get_aapb_guid_from(mmif.location)
         cur_root = Path(STORAGE_DIRECTORY)
         last_suffix = None
-        mmif_fname = None
+        steps = []
         for view in mmif.views:
-            if not view.annotations and view.metadata.warnings:
+            if not view.annotations and view.warnings:
                 # skip "warning" views
                 continue
-            param_dict, param_hash = parse_parameters(view)
-            appn, appv = split_appname_appversion(view.metadata.app)
+            param_dict, param_hash = parse_parameters(view.parameters)
+            appn, appv = split_appname_appversion(view.app)
             if appv is None:
                 return upload_no_version_response(appn)
             # TODO (krim @ 3/21/25): we might want "sanitize" appn and appv to make sure
@@ -78,59 +155,200 @@ def upload_mmif():
             if cur_suffix != last_suffix:
                 cur_root = cur_root / cur_suffix
                 last_suffix = cur_suffix
-            cur_root.mkdir(parents=True, exist_ok=True)
-            with open(cur_root.parent / f'{param_hash}.json', 'w') as f:
-                json.dump(param_dict, f, indent=2)
-            mmif_fname = cur_root / f'{guid}.mmif'
-        if not mmif_fname:
-            return upload_no_views_response(mmif_fname)
-        if mmif_fname.exists():
-            if overwrite:
-                with open(mmif_fname, 'w') as f:
-                    f.write(body)
-                return upload_overwrite_response(mmif_fname)
+                steps.append((appn, appv, param_hash, param_dict))
+        if not steps:
+            return upload_no_views_response(None)
+        digest = None
+        if blob_store.STORAGE_DEDUP:
+            with metrics.timer('mmif_duration_seconds', step='hash'):
+                digest = blob_store.file_digest(upload)
+        ensure_directory(cur_root)
+        step_root = Path(STORAGE_DIRECTORY)
+        for appn, appv, param_hash, param_dict in steps:
+            # the parameter file is stored next to the directory of the step
+            write_parameters(step_root / appn / appv, param_hash, param_dict)
+            step_root = step_root / appn / appv / param_hash
+        # the lock does not depend on the layout, see api/storage_layout.py
+        with storage_lock(cur_root / f'{guid}.mmif'):
+            existing = find_mmif(cur_root, guid)
+            existed = existing is not None
+            if existed and not overwrite:
+                return upload_not_saved_response(existing)
+            # existing files are replaced where they are, new files are stored in the
+            # configured layout
+            mmif_fname = Path(existing if existed else mmif_path(cur_root, guid))
+            ensure_directory(mmif_fname.parent)
+            if digest is None:
+                move_into_place(upload, mmif_fname)
+                metrics.inc('mmif_bytes_written_total', mmif_fname.stat().st_size)
+                write_sidecars(mmif_fname)
             else:
-                return upload_not_saved_response(mmif_fname)
-        else:
-            with open(mmif_fname, 'w') as f:
-                f.write(body)
-            return upload_created_response(mmif_fname)
+                blob = blob_store.blob_path(STORAGE_DIRECTORY, digest)
+                if existed and blob_store.is_stored_as(mmif_fname, blob):
+                    # the content did not change, so there is nothing to write
+                    return upload_overwrite_response(mmif_fname)
+                metrics.inc('mmif_bytes_written_total', store_deduplicated(upload, mmif_fname, blob))
+            try:
+                add_to_catalog(cur_root, mmif_fname, guid, len(mmif.views), steps, digest)
+            except sqlite3.Error as e:
+                # the file is stored, so the upload succeeded and the catalog catches up
+                # with the next reconcile, rewinds find the file without it
+                print(f'>>   Could not add {mmif_fname} to the catalog: {type(e).__name__} - {e}')
+                metrics.inc('catalog_errors_total')
+            if existed and rewind_cache is not None:
+                rewind_cache.invalidate(guid)
+        return upload_overwrite_response(mmif_fname) if existed else upload_created_response(mmif_fname)
     except Exception as e:
         return upload_error_response(e)
+    finally:
+        # the file is still there if it was not stored
+        Path(upload).unlink(missing_ok=True)
+
+
+def ensure_directory(directory: Path):
+    if directory not in known_paths:
+        directory.mkdir(parents=True, exist_ok=True)
+        known_paths.add(directory)
+
+
+def write_parameters(directory: Path, param_hash: str, param_dict):
+    """Writes the parameter file of a pipeline step if it does not exist yet. Since the
+    name of the file is the hash of its content an existing file is never rewritten."""
+    path = directory / f'{param_hash}.json'
+    if path in known_paths:
+        return
+    if not path.exists():
+        write_atomically(path, lambda f: f.write(json.dumps(param_dict, indent=2).encode('utf-8')))
+    known_paths.add(path)
+
+
+def write_atomically(path: Path, write):
+    """Calls write() with a temporary file next to path, which then replaces path, so
+    that readers never see a partially written file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def move_into_place(upload: str, mmif_fname: Path):
+    """Renames an uploaded file to its name in the storage directory, replacing an
+    existing file in one step."""
+    try:
+        os.replace(upload, mmif_fname)
+    except FileNotFoundError:
+        # the directory was removed after it was added to known_paths
+        known_paths.discard(mmif_fname.parent)
+        ensure_directory(mmif_fname.parent)
+        os.replace(upload, mmif_fname)
+
+
+def store_deduplicated(upload: str, mmif_fname: Path, blob: Path):
+    """Links mmif_fname and its precompressed copies to the blob, after storing the
+    upload as the blob if there is no blob with that content yet (see
+    api/blob_store.py). Returns the number of bytes written."""
+    ensure_directory(blob.parent)
+    written = 0
+    try:
+        blob_store.link_into_place(blob, mmif_fname)
+    except FileNotFoundError:
+        # new content, or a blob that was just removed by the garbage collection
+        os.replace(upload, blob)
+        written = blob.stat().st_size
+        write_sidecars(blob)
+        blob_store.link_into_place(blob, mmif_fname)
+    for encoding, suffix in SIDECAR_SUFFIXES.items():
+        sidecar = Path(f'{mmif_fname}{suffix}')
+        if encoding in MMIF_SIDECARS and os.path.exists(f'{blob}{suffix}'):
+            blob_store.link_into_place(f'{blob}{suffix}', sidecar)
+        else:
+            sidecar.unlink(missing_ok=True)
+    return written
+
+
+@contextmanager
+def storage_lock(mmif_fname: Path):
+    """Holds the lock for a stored MMIF file, which is shared with the files whose
+    names hash to the same stripe."""
+    lock_directory = Path(STORAGE_DIRECTORY) / '.locks'
+    ensure_directory(lock_directory)
+    stripe = int(hashlib.md5(str(mmif_fname).encode('utf-8')).hexdigest(), 16) % STORAGE_LOCK_STRIPES
+    with open(lock_directory / f'{stripe}.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_sidecars(mmif_fname: Path):
+    """Writes the precompressed copies of a stored MMIF file configured in MMIF_SIDECARS
+    and removes outdated copies in other encodings. The file is compressed in chunks."""
+    for encoding, suffix in SIDECAR_SUFFIXES.items():
+        sidecar = Path(f'{mmif_fname}{suffix}')
+        if encoding not in MMIF_SIDECARS or (encoding == 'zstd' and zstandard is None):
+            sidecar.unlink(missing_ok=True)
+            continue
+        with open(mmif_fname, 'rb') as source:
+            write_atomically(sidecar, lambda f: compress(source, f, encoding))
+
+
+def compress(source, f, encoding: str):
+    if encoding == 'gzip':
+        # an empty file name and mtime keep the compressed copy reproducible
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=6, mtime=0) as compressed:
+            shutil.copyfileobj(source, compressed, CHUNK_SIZE)
+    else:
+        zstandard.ZstdCompressor(level=10).copy_stream(source, f)
+
+
+def add_to_catalog(pipeline_dir: Path, mmif_fname: Path, guid: str, view_count: int, steps: list,
+                   digest: str = None):
+    """Records a stored MMIF file in the catalog, with the digest of its blob if it
+    was stored deduplicated."""
+    pipeline = pipeline_dir.relative_to(STORAGE_DIRECTORY).as_posix()
+    catalog.record_mmif(
+        catalog.get_catalog_connection(), mmif_fname.relative_to(STORAGE_DIRECTORY).as_posix(),
+        pipeline, guid, mmif_fname.stat().st_size, view_count, steps, digest)
 
 
 def upload_no_views_response(mmif_fname):
-    return jsonify(
-        {"status": "warning",
-         "filename": str(mmif_fname),
-         "message": f"file had no contentful views and was not saved"}), 200
+    return {
+        "status": "warning",
+        "filename": str(mmif_fname),
+        "message": f"file had no contentful views and was not saved"}, 200
 
 
 def upload_created_response(mmif_fname):
-    return jsonify(
-        {"status": "success",
-         "filename": str(mmif_fname),
-         "message": "file created"}), 201
+    return {
+        "status": "success",
+        "filename": str(mmif_fname),
+        "message": "file created"}, 201
 
 
 def upload_not_saved_response(mmif_fname):
-    return jsonify(
-        {"status": "warning",
-         "filename": str(mmif_fname),
-         "message": "file not saved because it already exists"}), 200
+    return {
+        "status": "warning",
+        "filename": str(mmif_fname),
+        "message": "file not saved because it already exists"}, 200
 
 
 def upload_overwrite_response(mmif_fname):
-    return jsonify(
-        {"status": "success",
-         "filename": str(mmif_fname),
-         "message": "file existed and was overwritten"}), 201
+    return {
+        "status": "success",
+        "filename": str(mmif_fname),
+        "message": "file existed and was overwritten"}, 201
 
 
 def upload_no_version_response(appn):
-    return jsonify(
-        {"status": "error",
-         "message": f"app {appn} version is underspecified"}), 400
+    return {
+        "status": "error",
+        "message": f"app {appn} version is underspecified"}, 400
 
 
 def upload_error_response(e):
@@ -148,6 +366,9 @@ def download_mmif():
     # get number of views for rewind if necessary
     num_views = len(data.get('pipeline', []))
     guid = data.get('guid')
+    stream = data.get('stream')
+    if stream is not None and stream not in STREAM_FORMATS:
+        return jsonify({'error': f'Unknown stream format, use one of {", ".join(STREAM_FORMATS)}'}), 400
     # validate existence of pipeline, guid is not necessary if you just want the pipeline returned
     if not pipeline:
         return jsonify({'error': 'Missing required parameters: need at least a pipeline'})
@@ -159,25 +380,48 @@ def download_mmif():
     # Checking if the GUID is a single value or a list
     if not isinstance(guid, list):
         return single_guid_download_response(pipeline, guid, num_views)
+    elif stream:
+        return streaming_download_response(pipeline, guid, num_views, stream)
     else:
         return multi_guid_download_response(pipeline, guid, num_views)
 
 
-def parse_parameters(view):
+@bp.get(f"{API_PREFIX}/download/<path:pipeline>/<guid>")
+def download_stored_mmif(pipeline, guid):
     """
-    Convert the parameter dictionary to a string and then hash it, this hash will be
-    the name of another subdirectory of the path. Return the dictionary and the hash.
+    Sends the MMIF for a guid and a pipeline given as its path in the storage
+    directory, as listed by /storeapi/status and the presence route. Unlike with the
+    POST route, clients can cache the response: requests with If-None-Match or
+    If-Modified-Since get a 304 if the stored file did not change. Prefixes of stored
+    pipelines are rewound like with the POST route.
     """
+    segments = pipeline.strip('/').split('/')
+    # hidden names cover '..' and the .blobs and .locks directories
+    if len(segments) % 3 != 0 or any(not segment or segment.startswith('.') for segment in segments + [guid]):
+        return jsonify({'error': f'Not a stored pipeline: {pipeline}'}), 404
+    pipeline = os.path.join(STORAGE_DIRECTORY, *segments)
+    path = find_mmif(pipeline, guid)
+    if path is not None:
+        return send_stored_mmif(path)
     try:
-        param_dict = view.metadata.parameters
-        # param_dict = {k: v.replace("'", '\"') for k, v in param_dict.items()}
-        # print(param_dict)
-        param_list = ['='.join(pair) for pair in param_dict.items()]
-        param_list.sort()
-        param_string = ','.join(param_list)
-    except KeyError:
-        param_dict = ""
-        param_string = ""
+        serialized = rewind_time(pipeline, guid + '.mmif', len(segments) // 3)
+    except FileNotFoundError:
+        return jsonify({'error': f'Did not find: {guid}'}), 404
+    return Response(serialized, mimetype='application/json')
+
+
+def parse_parameters(parameters):
+    """
+    Convert the parameter dictionary of a view to a string and then hash it, this hash
+    will be the name of another subdirectory of the path. Return the dictionary and the
+    hash. Views without parameters get an empty dictionary, like mmif-python gives.
+    """
+    param_dict = parameters if parameters is not None else {}
+    # param_dict = {k: v.replace("'", '\"') for k, v in param_dict.items()}
+    # print(param_dict)
+    param_list = ['='.join(pair) for pair in param_dict.items()]
+    param_list.sort()
+    param_string = ','.join(param_list)
     # hash the (sorted and concatenated list of params) string and join with path
     # NOTE: this is *not* for security purposes, so the usage of md5 is not an issue.
     param_hash = hashlib.md5(param_string.encode('utf-8')).hexdigest()
@@ -217,7 +461,7 @@ def zero_guid_download_response(pipeline: str):
     and the list of files found there. This allows clients to utilize the api without
     downloading files (for working with local files).
     """
-    filenames = [p.stem for p in Path(pipeline).glob('*')]
+    filenames = [p.stem for p in list_mmifs(pipeline)]
     return jsonify({'pipeline': pipeline, 'filenames': filenames})
 
 
@@ -226,6 +470,9 @@ def single_guid_download_response(pipeline: str, guid: str, num_views: int):
     When retrieving the MMIF object for a pipeline and a single GUID, just return
     the MMIF object or an error if the search failed.
     """
+    path = find_mmif(pipeline, guid)
+    if path is not None:
+        return send_stored_mmif(path)
     try:
         mmif = get_mmif_for_guid(pipeline, guid, num_views)
         return mmif
@@ -233,6 +480,36 @@ def single_guid_download_response(pipeline: str, guid: str, num_views: int):
         return {"error": str(e)}, 201
 
 
+def send_stored_mmif(path: str):
+    """
+    Sends a stored MMIF file as it is on disk, without parsing it. The response has
+    ETag and Last-Modified headers and GET requests with If-None-Match or
+    If-Modified-Since get a 304 if the file did not change, this does not apply to the
+    POST download route. If the client accepts an encoding for which
+    there is an up-to-date precompressed copy, that copy is sent instead.
+    """
+    stat = os.stat(path)
+    for encoding, suffix in SIDECAR_SUFFIXES.items():
+        sidecar = path + suffix
+        if not request.accept_encodings[encoding]:
+            continue
+        try:
+            sidecar_stat = os.stat(sidecar)
+        except FileNotFoundError:
+            continue
+        if sidecar_stat.st_mtime < stat.st_mtime:
+            continue
+        metrics.inc('mmif_bytes_read_total', sidecar_stat.st_size)
+        response = send_file(sidecar, mimetype='application/json', conditional=True, etag=True)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+    metrics.inc('mmif_bytes_read_total', stat.st_size)
+    response = send_file(path, mimetype='application/json', conditional=True, etag=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 def multi_guid_download_response(pipeline: str, guids: list, num_views: int):
     """
     When retrieving multiple MMIFs for a pipeline, we construct a json object to
@@ -240,7 +517,6 @@ def multi_guid_download_response(pipeline: str, guids: list, num_views: int):
     """
     mmifs_by_guid = dict()
     for guid in guids:
-        response = single_guid_download_response(pipeline, guid, num_views)
         try:
             mmif = get_mmif_for_guid(pipeline, guid, num_views)
             mmifs_by_guid[guid] = mmif
@@ -249,17 +525,58 @@ def multi_guid_download_response(pipeline: str, guids: list, num_views: int):
     return mmifs_by_guid
 
 
+def streaming_download_response(pipeline: str, guids: list, num_views: int, stream: str):
+    """
+    Streams the MMIFs for many guids in one of the formats in STREAM_FORMATS, see
+    api/mmif_streaming.py. Stored files are sent as they are, in chunks, so memory use
+    does not grow with the number of guids.
+    """
+    def open_mmif(guid):
+        return open_mmif_for_guid(pipeline, guid, num_views)
+    generator = STREAMERS[stream](guids, open_mmif)
+    headers = {}
+    if stream in ('tar', 'zip'):
+        headers['Content-Disposition'] = f'attachment; filename=mmifs.{stream}'
+    return Response(stream_with_context(generator), mimetype=STREAM_FORMATS[stream], headers=headers)
+
+
+def open_mmif_for_guid(pipeline: str, guid: str, num_views: int):
+    """
+    Like get_mmif_for_guid() but returns a binary file object without parsing a stored
+    file. Rewound MMIFs are returned as an in-memory file object.
+    """
+    path = find_mmif(pipeline, guid)
+    try:
+        if path is None:
+            raise FileNotFoundError
+        fh = open(path, 'rb')
+    except FileNotFoundError:
+        try:
+            return io.BytesIO(rewind_time(pipeline, guid + '.mmif', num_views).encode('utf-8'))
+        except FileNotFoundError:
+            raise StorageServerError(f'Did not find: {guid}')
+    # the file is about to be read, so let the kernel start reading it ahead
+    os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+    metrics.inc('mmif_bytes_read_total', os.fstat(fh.fileno()).st_size)
+    return fh
+
+
 def get_mmif_for_guid(pipeline: str, guid: str, num_views: int):
     """
     Retrieve the MMIF file for a pipeline and GUID. If none was found raise a
     StorageServerError.
     """
+    path = find_mmif(pipeline, guid)
     guid = guid + ".mmif"
-    path = os.path.join(pipeline, guid)
     # if filepath exists, we can return it
     try:
+        if path is None:
+            raise FileNotFoundError
         with open(path, 'r') as file:
-            mmif = json.loads(file.read())
+            data = file.read()
+            metrics.inc('mmif_bytes_read_total', os.fstat(file.fileno()).st_size)
+        with metrics.timer('mmif_duration_seconds', step='parse'):
+            mmif = json.loads(data)
         return mmif
     # otherwise we will use the rewinder to check if the user provided a prefix of a
     # mmif pipeline that we have previously stored
@@ -274,22 +591,132 @@ def get_mmif_for_guid(pipeline: str, guid: str, num_views: int):
 
 def rewind_time(pipeline, guid, num_views):
     """
-    This method takes in a pipeline (path), a guid, and a number of views, and uses
-    os.walk to iterate through directories that begin with that pipeline. It takes
-    the first mmif file that matches the guid and uses the rewind feature to include
-    only the views indicated by the pipeline.
+    This method takes in a pipeline (path), a guid, and a number of views, and finds
+    a stored MMIF for the guid whose pipeline extends the given pipeline (see
+    find_rewind_source()). It then uses the rewind feature to include only the views
+    indicated by the pipeline.
+    """
+    prefix = os.path.relpath(pipeline, STORAGE_DIRECTORY)
+    guid = guid[:-len('.mmif')]
+    path = find_rewind_source(pipeline, guid)
+    if path is None:
+        raise FileNotFoundError
+    source = os.path.join(STORAGE_DIRECTORY, path)
+    if rewind_cache is not None:
+        serialized = rewind_cache.get(prefix, guid, num_views, source)
+        metrics.inc('cache_requests_total', cache='rewind', result='miss' if serialized is None else 'hit')
+        if serialized is not None:
+            return serialized
+    # rewind the mmif
+    with open(source, 'r') as f:
+        data = f.read()
+        metrics.inc('mmif_bytes_read_total', os.fstat(f.fileno()).st_size)
+    with metrics.timer('mmif_duration_seconds', step='parse'):
+        mmif = Mmif(data)
+    with metrics.timer('mmif_duration_seconds', step='rewind'):
+        # we need to calculate the number of views to rewind
+        rewound = rewind.rewind_mmif(mmif, len(mmif.views) - num_views)
+    with metrics.timer('mmif_duration_seconds', step='serialize'):
+        serialized = rewound.serialize()
+    if rewind_cache is not None:
+        rewind_cache.put(prefix, guid, num_views, source, serialized)
+    return serialized
+
+
+def find_rewind_source(pipeline: str, guid: str):
+    """
+    Returns the path, relative to the storage directory, of the stored MMIF for the
+    guid whose pipeline extends the given pipeline with the fewest steps according to
+    the catalog, or None if there is no such MMIF. While the catalog is being filled
+    at startup (see api/catalog.py) a miss may be a file that was not added yet, so
+    then the pipeline directory is searched instead.
     """
-    for home, dirs, files in os.walk(pipeline):
-        # find mmif with matching guid to rewind
-        for file in files:
-            if guid == file:
-                # rewind the mmif
-                with open(os.path.join(home, file), 'r') as f:
-                    mmif = Mmif(f.read())
-                    # we need to calculate the number of views to rewind
-                    rewound = utils.rewind.rewind_mmif(mmif, len(mmif.views) - num_views)
-                return rewound.serialize()
-    raise FileNotFoundError
+    path = catalog.find_extension(os.path.relpath(pipeline, STORAGE_DIRECTORY), guid)
+    if path is None and catalog.is_reconciling():
+        path = search_rewind_source(pipeline, guid)
+    return path
+
+
+def search_rewind_source(pipeline: str, guid: str):
+    """Searches the pipeline directory breadth first, so that the file found is the one
+    with the fewest additional steps."""
+    fname = f'{guid}.mmif'
+    level = [pipeline]
+    while level:
+        next_level = []
+        for directory in level:
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name == fname and entry.is_file():
+                    return os.path.relpath(entry.path, STORAGE_DIRECTORY)
+                # lock files and temporary files are not part of any pipeline
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    next_level.append(entry.path)
+        level = next_level
+    return None
+
+
+@bp.post(f"{API_PREFIX}/presence")
+def presence_matrix():
+    """
+    Answers which guids have a stored MMIF for which pipelines. The request has a list
+    of pipeline specifications in the format of the download route and a list of guids.
+    For each pipeline the response has a bitmap with one bit per guid, in the order of
+    the guids and with the most significant bit of each byte first, that is set if
+    there is a MMIF for the guid. With "rewind" it also has, for the guids without a
+    MMIF, the stored pipeline that the MMIF could be rewound from. The answer comes
+    from the catalog, no files are read.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    specs = data.get('pipelines')
+    guids = data.get('guids')
+    if not isinstance(specs, list) or not all(is_pipeline_spec(spec) for spec in specs) \
+            or not isinstance(guids, list) or not all(isinstance(guid, str) for guid in guids):
+        return jsonify({'error': 'Missing required parameters: need a list of pipelines and a list of guids'}), 400
+    if catalog.is_reconciling():
+        return catalog_unavailable()
+    pipelines = [pipeline_from_param_json({'pipeline': spec}) for spec in specs]
+    results = catalog.presence(pipelines, guids, rewind=bool(data.get('rewind')))
+    response = []
+    for pipeline, (present, sources) in zip(pipelines, results):
+        entry = {'pipeline': pipeline, 'present': presence_bitmap(present, len(guids)),
+                 'present_count': len(present)}
+        if data.get('rewind'):
+            entry['rewind'] = {guids[position]: source for position, source in sorted(sources.items())}
+        response.append(entry)
+    return jsonify({'guid_count': len(guids), 'pipelines': response})
+
+
+def catalog_unavailable():
+    """The response of the routes that answer from the catalog while it is being filled
+    from the storage directory, when their answer would be incomplete."""
+    response = jsonify({'error': 'The catalog of stored MMIF files is being built, try again later'})
+    response.headers['Retry-After'] = '60'
+    return response, 503
+
+
+def is_pipeline_spec(spec):
+    """Returns whether spec is a pipeline in the format of the download route, which is
+    a dictionary from apps to their parameters, with strings as parameter values."""
+    if not isinstance(spec, dict):
+        return False
+    for parameters in spec.values():
+        # anything but a dictionary counts as no parameters, see pipeline_from_param_json()
+        if isinstance(parameters, dict) and not all(isinstance(value, str) for value in parameters.values()):
+            return False
+    return True
+
+
+def presence_bitmap(positions, size: int):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 0x80 >> (position & 7)
+    return base64.b64encode(bits).decode('ascii')
 
 
 @bp.route(f"{API_PREFIX}/status", methods=["GET"])
@@ -297,49 +724,21 @@ def storage_analytics():
     """
     Provide analytics and status information about the current MMIF storage system.
     This method returns info on the total number of MMIF files, number of unique pipelines,
-    app parameters, non-terminal MMIFs, and dirty pipeline MMIFs.
-    """
-    # TODO (ledibr @ 10/12/25): consider adding params to show/hide certain parts e.g. full pipeline specs?
-    response = {"total_mmif_files": 0, "total_pipelines": 0, "pipelines": [],
-                "non_terminal_mmif_count": 0, "dirty_pipeline_mmif_count": 0}
-    app_specs = {}
-
-    for root, dirs, files in os.walk(STORAGE_DIRECTORY):
-        if current_app.config.get('DEBUG'):
-            print("Root:", root)
-            print("dirs:", dirs)
-            print("files:", files)
-
-        curr_pipeline = root[root.index(STORAGE_DIRECTORY) + len(STORAGE_DIRECTORY):]
-        curr_pipeline = curr_pipeline.lstrip('/')
-
-        json_list = [f for f in files if re.search(r'\.json$', f)]
-        for subdir in dirs:
-            config = subdir + '.json'
-            if config in json_list:
-                curr_app = curr_pipeline[curr_pipeline.rfind('/', 0, curr_pipeline.rfind('/'))+1:]
-                full_path = os.path.join(curr_app, subdir)
-                with open(os.path.join(root, config), 'r') as f:
-                    app_specs[full_path] = json.load(f)
-                if len(app_specs[full_path]) == 0:
-                    app_specs[full_path] = {}
-        mmif_list = [f for f in files if re.search(r'\.mmif$', f)]
-        if mmif_list:
-            response["total_mmif_files"] += len(mmif_list)
-            response["total_pipelines"] += 1
-
-            pipeline_stats = {"path": curr_pipeline, "spec": {}, "mmif_count": len(mmif_list)}
-            segments = curr_pipeline.split("/")
-            curr_apps = ["/".join(segments[i:i + 3]) for i in range(0, len(segments), 3)]
-            for i, app in enumerate(curr_apps):
-                if app in app_specs:
-                    pipeline_stats["spec"][app] = app_specs[app]
-            response["pipelines"].append(pipeline_stats)
-
-            if re.search(r'-dirty', curr_pipeline):
-                response["dirty_pipeline_mmif_count"] += len(mmif_list)
-            if dirs:
-                response["non_terminal_mmif_count"] += len(mmif_list)
-    # TODO (ledibr @ 10/27/25): the response seems to be in alphabetical key order, not chronological.
-    # given how long these might get, do we want to potentially return this differently?
+    app parameters, non-terminal MMIFs, and dirty pipeline MMIFs. The numbers come from
+    the catalog (see api/catalog.py), so no files are read. The pipelines can be filtered
+    with the app, version and dirty query parameters and are paged with limit and offset.
+    """
+    dirty = request.args.get('dirty')
+    if dirty is not None:
+        dirty = dirty in ('1', 't', 'true', 'True')
+    try:
+        limit = int(request.args.get('limit', catalog.STATUS_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if catalog.is_reconciling():
+        return catalog_unavailable()
+    response = catalog.pipeline_status(
+        app=request.args.get('app'), version=request.args.get('version'),
+        dirty=dirty, limit=limit, offset=offset)
     return jsonify(response)
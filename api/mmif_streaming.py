@@ -0,0 +1,180 @@
+"""
+Streaming responses for multi-GUID downloads.
+
+Each of the generators here takes a list of guids and a function that opens the MMIF
+for a guid as a binary file object (or raises StorageServerError), and yields the
+response in chunks. Files are copied in chunks and never parsed, so the memory used
+does not depend on the number of guids. A small thread pool opens the next files
+while the current one is sent, which also asks the kernel to read them ahead.
+
+Supported formats:
+
+- ndjson: one line per guid with {"guid": ..., "mmif": ...} or {"guid": ..., "error": ...}
+- json: one object from guids to MMIFs or errors, like the non-streaming response
+- tar and zip: archives with a <guid>.mmif member per guid and an errors.json member
+  with the guids that were not found
+"""
+
+import io
+import itertools
+import json
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'tar': 'application/x-tar',
+    'zip': 'application/zip'}
+
+# size of the chunks read from the MMIF files and the number of files opened ahead
+CHUNK_SIZE = 1 << 20
+STREAM_PREFETCH = max(1, int(os.environ.get('STREAM_PREFETCH', 4)))
+
+
+def prefetched(guids: list, open_mmif):
+    """
+    Yields (guid, file object or None, error message or None) for each guid, with
+    the next files being opened in a thread pool. The file objects are closed after
+    the consumer asks for the next one.
+    """
+    def open_or_error(guid):
+        try:
+            return open_mmif(guid), None
+        except Exception as e:
+            return None, str(e)
+
+    executor = ThreadPoolExecutor(max_workers=STREAM_PREFETCH)
+    pending = deque()
+    remaining = iter(guids)
+    try:
+        for guid in itertools.islice(remaining, STREAM_PREFETCH):
+            pending.append((guid, executor.submit(open_or_error, guid)))
+        while pending:
+            guid, future = pending.popleft()
+            next_guid = next(remaining, None)
+            if next_guid is not None:
+                pending.append((next_guid, executor.submit(open_or_error, next_guid)))
+            fh, error = future.result()
+            try:
+                yield guid, fh, error
+            finally:
+                if fh is not None:
+                    fh.close()
+    finally:
+        # the client may have gone away, so close whatever was opened ahead
+        for _, future in pending:
+            fh, _ = future.result()
+            if fh is not None:
+                fh.close()
+        executor.shutdown()
+
+
+def read_chunks(fh):
+    return iter(lambda: fh.read(CHUNK_SIZE), b'')
+
+
+def stream_ndjson(guids: list, open_mmif):
+    for guid, fh, error in prefetched(guids, open_mmif):
+        if error is not None:
+            yield json.dumps({'guid': guid, 'error': error}).encode() + b'\n'
+            continue
+        yield b'{"guid": ' + json.dumps(guid).encode() + b', "mmif": '
+        for chunk in read_chunks(fh):
+            # line breaks in valid JSON are always whitespace between tokens (inside
+            # strings they have to be escaped), so they can be replaced with spaces
+            yield chunk.replace(b'\n', b' ').replace(b'\r', b' ')
+        yield b'}\n'
+
+
+def stream_json(guids: list, open_mmif):
+    yield b'{'
+    for i, (guid, fh, error) in enumerate(prefetched(guids, open_mmif)):
+        yield (b', ' if i else b'') + json.dumps(guid).encode() + b': '
+        if error is not None:
+            yield json.dumps({'error': error}).encode()
+        else:
+            yield from read_chunks(fh)
+    yield b'}'
+
+
+def file_size(fh):
+    if isinstance(fh, io.BytesIO):
+        return fh.getbuffer().nbytes
+    return os.fstat(fh.fileno()).st_size
+
+
+def stream_tar(guids: list, open_mmif):
+    errors = {}
+    for guid, fh, error in prefetched(guids, open_mmif):
+        if error is not None:
+            errors[guid] = error
+            continue
+        yield from tar_member(f'{guid}.mmif', file_size(fh), read_chunks(fh))
+    data = json.dumps(errors, indent=2).encode()
+    yield from tar_member('errors.json', len(data), [data])
+    # a tar archive ends with two empty blocks
+    yield tarfile.NUL * tarfile.BLOCKSIZE * 2
+
+
+def tar_member(name: str, size: int, chunks):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    yield info.tobuf(format=tarfile.PAX_FORMAT)
+    for chunk in chunks:
+        yield chunk
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only file object that collects what was written until it is taken out
+    with drain(), used to stream a zip archive that is written by zipfile."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(guids: list, open_mmif):
+    buffer = ChunkBuffer()
+    errors = {}
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for guid, fh, error in prefetched(guids, open_mmif):
+            if error is not None:
+                errors[guid] = error
+                continue
+            with archive.open(f'{guid}.mmif', 'w', force_zip64=True) as member:
+                for chunk in read_chunks(fh):
+                    member.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+        archive.writestr('errors.json', json.dumps(errors, indent=2))
+    yield buffer.drain()
+
+
+STREAMERS = {'ndjson': stream_ndjson, 'json': stream_json, 'tar': stream_tar, 'zip': stream_zip}
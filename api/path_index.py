@@ -0,0 +1,173 @@
+"""
+Memory-mapped index from shortened GUIDs to asset paths.
+
+The index is a file that is written for every database snapshot by a rebuild (see
+api/rebuild.py) next to the snapshot, as <snapshot>.idx. Workers map it read-only
+when they open a connection to the snapshot, so all workers share the same pages in
+the page cache and a lookup is a binary search in memory without system calls,
+locks or SQLite.
+
+The file has a header, an array of fixed-width entries sorted by key and a blob with
+all paths. Each entry is the shortened GUID, padded with zero bytes to the width of
+the longest one, a file type code, and the offset and length of the path in the
+blob. A GUID with several files has several consecutive entries.
+
+The index reflects the map table at the time the snapshot was built. Changes made
+after that, by the watcher or by the directory search fallback, are recorded in the
+map_changes table, and the GUIDs changed since the index was written are looked up
+in the database instead. The sequence number of the last change that is in the
+index is stored in the header.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+from api import shorten_guid, file_types
+
+
+MAGIC = b'BAAPBIX1'
+# magic, key width, number of entries, offset of the path blob, last map_changes seq
+HEADER = struct.Struct('<8sIQQq')
+TYPE_CODES = [file_type for file_type, _ in file_types] + ['other']
+
+
+def entry_struct(key_width: int):
+    # key, file type code, path offset, path length
+    return struct.Struct(f'<{key_width}sBQI')
+
+
+def last_change(connection) -> int:
+    """Returns the sequence number of the last change in the map_changes table, which
+    is also right when the table was emptied."""
+    row = connection.execute("SELECT seq FROM sqlite_sequence WHERE name='map_changes';").fetchone()
+    return row[0] if row is not None else 0
+
+
+def write_index(connection, path):
+    """Writes the index of the map table to a temporary file and renames it to path."""
+    count, key_width = connection.execute(
+        "SELECT count(*), coalesce(max(length(CAST(GUID AS BLOB))), 1) FROM map;").fetchone()
+    entry = entry_struct(key_width)
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.building')
+    try:
+        with os.fdopen(fd, 'wb') as f, tempfile.TemporaryFile(dir=directory) as blob:
+            f.write(HEADER.pack(MAGIC, key_width, count, HEADER.size + count * entry.size,
+                                last_change(connection)))
+            offset = 0
+            # the binary collation orders by the UTF-8 bytes, which is the order of
+            # the zero-padded keys
+            for guid, file_type, server_path in connection.execute(
+                    "SELECT GUID, file_type, server_path FROM map ORDER BY GUID, file_type, server_path;"):
+                encoded = server_path.encode('utf-8')
+                code = TYPE_CODES.index(file_type) if file_type in TYPE_CODES else TYPE_CODES.index('other')
+                f.write(entry.pack(guid.encode('utf-8'), code, offset, len(encoded)))
+                blob.write(encoded)
+                offset += len(encoded)
+            blob.seek(0)
+            shutil.copyfileobj(blob, f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class IndexFile:
+
+    """A mapped index file, which is never changed once it is written."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_width, self.count, self.blob_offset, self.last_change = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a path index')
+        self.entry = entry_struct(self.key_width)
+
+    def lookup(self, guid: str):
+        key = shorten_guid(guid).encode('utf-8')
+        if len(key) > self.key_width:
+            return []
+        key = key.ljust(self.key_width, b'\0')
+        size = self.entry.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER.size + mid * size
+            if self.map[start:start + self.key_width] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        rows = []
+        for i in range(lo, self.count):
+            entry_key, code, offset, length = self.entry.unpack_from(self.map, HEADER.size + i * size)
+            if entry_key != key:
+                break
+            start = self.blob_offset + offset
+            rows.append({'file_type': TYPE_CODES[code],
+                         'server_path': self.map[start:start + length].decode('utf-8')})
+        return rows
+
+
+class PathIndex:
+
+    """The index of the snapshot that the workers currently use, together with the
+    GUIDs that changed since it was written."""
+
+    def __init__(self):
+        self.index = None
+        self.changed = set()
+        self.last_change = None
+        self.lock = threading.Lock()
+
+    def load(self, database_path: str):
+        """Maps the index of a database snapshot, if it has one."""
+        path = f'{database_path}.idx'
+        if self.index is not None and self.index.path == path:
+            return
+        try:
+            index = IndexFile(path)
+        except (FileNotFoundError, ValueError, struct.error):
+            index = None
+        with self.lock:
+            # the previous mapping is closed when the last lookup using it is done
+            self.index = index
+            self.changed = set()
+            self.last_change = index.last_change if index is not None else None
+
+    def lookup(self, guid: str, types=()):
+        """Returns the rows for a guid like database_search(), or None if the index
+        cannot answer for the guid and the database has to be used."""
+        index = self.index
+        if index is None or shorten_guid(guid) in self.changed:
+            return None
+        rows = index.lookup(guid)
+        if types:
+            rows = [row for row in rows if row['file_type'] in types]
+        return rows
+
+    def invalidate(self, guid: str):
+        self.changed.add(shorten_guid(guid))
+
+    def apply_changes(self, connection):
+        """Marks the guids that changed in the map_changes table since the index was
+        written. If some of those changes were already pruned from the table the index
+        cannot be used anymore."""
+        with self.lock:
+            if self.index is None:
+                return
+            changes = connection.execute(
+                "SELECT seq, GUID FROM map_changes WHERE seq>? ORDER BY seq;",
+                (self.last_change,)).fetchall()
+            if changes and changes[0][0] > self.last_change + 1:
+                self.index = None
+                return
+            for seq, guid in changes:
+                self.changed.add(guid)
+                self.last_change = seq
@@ -0,0 +1,173 @@
+"""
+Opt-in profiling of single requests.
+
+Profiling is enabled by setting PROFILE_DIR to a directory that the workers can
+write to. Without it no hooks are installed and requests are not affected at all.
+When it is set, a request is profiled if
+
+- it has an X-Profile header or a profile query parameter and the admin token in
+  the X-Admin-Token header (see ADMIN_TOKEN), or
+- it is picked at random, PROFILE_SAMPLE_RATE is the percentage of requests that
+  are picked (default 0).
+
+There are two kinds of profiles, set with PROFILE_MODE:
+
+- stack (default): the stack of the thread handling the request is sampled every
+  PROFILE_INTERVAL seconds (default 0.005) by a background thread. This measures
+  wall-clock time, so time spent waiting for the disk or SQLite shows up, and is
+  written as folded stacks (<name>.folded), the input format of flamegraph.pl and
+  speedscope.
+- cprofile: the request is run under cProfile, which counts every function call and
+  has a higher overhead, and the statistics are written with pstats (<name>.prof),
+  for snakeviz or python -m pstats.
+
+Each profile has a <name>.json with the route, method, URL, status, duration and, if
+the request has them, the guid and pipeline. Profiles cover the response until it is
+done, including streamed responses.
+"""
+
+import cProfile
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+import api
+
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'stack')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+
+# request bodies larger than this are not parsed to find the guid and pipeline
+MAX_TAG_BODY = 1 << 20
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def folded_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+
+    """Counts the stacks of a thread, sampled every interval seconds by another thread."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[folded_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path_prefix: str):
+        with open(f'{path_prefix}.folded', 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class CallProfiler:
+
+    """Runs cProfile in the thread handling the request."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path_prefix: str):
+        self.profile.dump_stats(f'{path_prefix}.prof')
+
+
+def profile_requested():
+    """Returns whether the current request is profiled. Asking for a profile without
+    the admin token aborts the request."""
+    if 'X-Profile' in request.headers or 'profile' in request.args:
+        api.check_admin_token()
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() * 100 < PROFILE_SAMPLE_RATE
+
+
+def request_tags():
+    """Returns the guid and pipeline of the request from the query string or a JSON
+    body that was already read by the route."""
+    tags = {'guid': request.args.get('guid'), 'pipeline': None}
+    if (request.content_length or 0) <= MAX_TAG_BODY:
+        data = request.get_json(force=True, silent=True)
+        if isinstance(data, dict):
+            tags['guid'] = tags['guid'] or data.get('guid') or data.get('guids')
+            tags['pipeline'] = data.get('pipeline')
+    return tags
+
+
+def instrument(app, directory: str = PROFILE_DIR):
+    """Adds the hooks that profile requests to the app."""
+    os.makedirs(directory, exist_ok=True)
+    profilers = {'stack': lambda: StackSampler(threading.get_ident()), 'cprofile': CallProfiler}
+    if PROFILE_MODE not in profilers:
+        raise ValueError(f'Unknown PROFILE_MODE {PROFILE_MODE}, use one of {", ".join(profilers)}')
+    sequence = itertools.count()
+
+    @app.before_request
+    def start_profile():
+        if profile_requested():
+            g.profiler = profilers[PROFILE_MODE]()
+            g.profile_start = time.perf_counter()
+            g.profiler.start()
+
+    @app.after_request
+    def record_status(response):
+        if 'profiler' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def write_profile(exception):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.stop()
+        duration = time.perf_counter() - g.pop('profile_start')
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', route).strip('-') or 'root'
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(sequence)}-{slug}'
+        path_prefix = os.path.join(directory, name)
+        profiler.write(path_prefix)
+        info = {'route': route, 'method': request.method, 'url': request.url,
+                'status': g.pop('profile_status', None), 'duration': duration,
+                'mode': PROFILE_MODE, 'error': repr(exception) if exception is not None else None,
+                **request_tags()}
+        with open(f'{path_prefix}.json', 'w') as f:
+            json.dump(info, f, indent=2, default=str)
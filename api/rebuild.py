@@ -0,0 +1,212 @@
+"""
+Rebuilding the asset database without downtime.
+
+A rebuild writes a new database to a shadow file in the snapshots directory while
+the server keeps answering requests from the current database. When the shadow is
+finished it is renamed to its final snapshot name and DATABASE, which is a symbolic
+link to the current snapshot, is atomically replaced with a link to the new one.
+Workers notice the new link on their next request and reopen their connection (see
+get_db_connection() in api/__init__.py). The last few snapshots are kept around so
+that workers in the middle of a request are not affected.
+
+Before the swap the memory-mapped path index of the new snapshot is written next to
+it (see api/path_index.py), so workers can use it as soon as they switch.
+
+The swap renames a link and not the database file itself because SQLite names the
+WAL files after the database path, so a new database renamed over a live one would
+pick up the WAL file of the old one.
+
+Only one rebuild runs at a time, across all gunicorn workers, which is enforced with
+a lock file. Progress is written to a status file so any worker can report it.
+
+Every gunicorn worker creates the application when it boots, including workers that
+are restarted after a timeout, so the rebuild at startup is skipped if the current
+database is a snapshot that was built less than REBUILD_MAX_AGE seconds ago. That
+way the workers started together, and workers restarted later, do not rebuild again.
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from flask import Blueprint, jsonify, request
+
+import api
+from api import DATABASE, SCHEMA_VERSION
+from api.path_index import write_index
+
+
+bp = Blueprint('rebuild', __name__)
+
+SNAPSHOT_DIRECTORY = DATABASE.parent / 'snapshots'
+STATUS_FILE = DATABASE.parent / 'rebuild.json'
+LOCK_FILE = DATABASE.parent / 'rebuild.lock'
+
+# number of snapshots to keep, including the current one
+KEEP_SNAPSHOTS = 3
+
+# the rebuild at startup is skipped if the current snapshot is younger than this
+REBUILD_MAX_AGE = int(os.environ.get('REBUILD_MAX_AGE', 3600))
+
+
+def acquire_rebuild_lock():
+    """Returns an open lock file if no other rebuild is running, None otherwise. The
+    lock is held until the file is closed."""
+    fh = open(LOCK_FILE, 'w')
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fh.close()
+        return None
+    return fh
+
+
+def write_status(status: dict):
+    tmp = STATUS_FILE.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp, STATUS_FILE)
+
+
+def read_status_file():
+    try:
+        with open(STATUS_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'state': 'never run'}
+
+
+def read_status():
+    """Returns the status of the last rebuild. A rebuild that is still marked as
+    running while nobody holds the lock was interrupted, for example because the
+    worker running it was restarted."""
+    status = read_status_file()
+    if status.get('state') == 'running':
+        lock = acquire_rebuild_lock()
+        if lock is not None:
+            lock.close()
+            status['state'] = 'interrupted'
+    return status
+
+
+def rebuild_database(lock, incremental: bool = False, workers: int = None):
+    """
+    Builds a new snapshot of the database and swaps it in. With incremental the
+    current database is copied and only updated with the changes since the last
+    scan, otherwise the snapshot is built from scratch. The lock is released when
+    the rebuild is done.
+    """
+    status = {'state': 'running', 'incremental': incremental, 'stage': 'preparing',
+              'started': time.time(), 'directories_scanned': 0}
+
+    def progress(directories):
+        status['directories_scanned'] = directories
+        write_status(status)
+
+    try:
+        write_status(status)
+        SNAPSHOT_DIRECTORY.mkdir(exist_ok=True)
+        # we hold the lock, so any shadow lying around is left by a failed rebuild
+        for stale in SNAPSHOT_DIRECTORY.glob('*.building'):
+            stale.unlink()
+        name = f'database-{time.strftime("%Y%m%d-%H%M%S")}.db'
+        shadow = SNAPSHOT_DIRECTORY / (name + '.building')
+        connection = sqlite3.connect(shadow)
+        if incremental and os.path.exists(api.database_path()):
+            source = sqlite3.connect(api.database_path())
+            source.backup(connection)
+            source.close()
+        else:
+            incremental = False
+            with open(Path(api.__file__).parent / 'schema_scratch.sql') as f:
+                connection.executescript(f.read())
+            api.set_schema_version(connection, SCHEMA_VERSION)
+        status['stage'] = 'scanning'
+        write_status(status)
+        added, removed = api.populate_database(
+            connection, incremental=incremental, workers=workers, progress=progress)
+        status.update(stage='indexing', added=len(added), removed=len(removed))
+        write_status(status)
+        snapshot = SNAPSHOT_DIRECTORY / name
+        write_index(connection, f'{snapshot}.idx')
+        status['stage'] = 'swapping'
+        write_status(status)
+        # closing the last connection in WAL mode checkpoints and removes the WAL file
+        connection.execute('PRAGMA journal_mode=WAL;')
+        connection.close()
+        os.replace(shadow, snapshot)
+        swap_database(snapshot)
+        remove_old_snapshots()
+        status.update(state='done', stage='done', finished=time.time())
+        write_status(status)
+    except Exception as e:
+        status.update(state='failed', error=f'{type(e).__name__} - {e}', finished=time.time())
+        write_status(status)
+        raise
+    finally:
+        lock.close()
+
+
+def swap_database(snapshot: Path):
+    """Atomically points DATABASE to the snapshot."""
+    tmp = DATABASE.with_name(DATABASE.name + '.link')
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(os.path.relpath(snapshot, DATABASE.parent))
+    os.replace(tmp, DATABASE)
+
+
+def remove_old_snapshots():
+    snapshots = sorted(SNAPSHOT_DIRECTORY.glob('database-*.db'))
+    for snapshot in snapshots[:-KEEP_SNAPSHOTS]:
+        for path in (snapshot, Path(f'{snapshot}-wal'), Path(f'{snapshot}-shm'), Path(f'{snapshot}.idx')):
+            path.unlink(missing_ok=True)
+
+
+def snapshot_age():
+    """Returns the number of seconds since the current snapshot was built, or None if
+    DATABASE is not a snapshot made by a rebuild that finished."""
+    status = read_status_file()
+    if status.get('state') != 'done' or not DATABASE.is_symlink() or not DATABASE.exists():
+        return None
+    return time.time() - status['finished']
+
+
+def start_rebuild(incremental: bool = False, max_age: int = None):
+    """Starts a rebuild in a background thread, returns False if a rebuild is
+    already running or, with max_age, if the current snapshot is younger than
+    max_age seconds."""
+    lock = acquire_rebuild_lock()
+    if lock is None:
+        return False
+    if max_age is not None:
+        # checked while holding the lock, so a rebuild that just finished is seen
+        age = snapshot_age()
+        if age is not None and age < max_age:
+            print(f'>>   Skipping the rebuild, the current snapshot is {age:.0f}s old')
+            lock.close()
+            return False
+    thread = threading.Thread(
+        target=rebuild_database, args=(lock, incremental), name='rebuild', daemon=True)
+    thread.start()
+    return True
+
+
+@bp.route('/admin/rebuild', methods=['GET'])
+def rebuild_status():
+    api.check_admin_token()
+    return jsonify(read_status())
+
+
+@bp.route('/admin/rebuild', methods=['POST'])
+def trigger_rebuild():
+    api.check_admin_token()
+    incremental = request.args.get('incremental') in ('1', 't', 'true', 'True')
+    if not start_rebuild(incremental):
+        return jsonify({'status': 'error',
+                        'message': 'a rebuild is already running',
+                        'rebuild': read_status()}), 409
+    return jsonify({'status': 'success', 'message': 'rebuild started'}), 202
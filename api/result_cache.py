@@ -0,0 +1,112 @@
+"""
+In-process cache of /searchapi results.
+
+Results are cached by shortened GUID and requested file types, with a time to live
+and least-recently-used eviction when the cache is full. The onlyfirst variant of a
+request is answered from the same entry.
+
+Entries are invalidated when the rows of their GUID change. Changes made through the
+connection of the current thread are invalidated directly by the code making them.
+Changes made by other connections, for example by the watcher or by another worker,
+are found through the map_changes table, which is filled by triggers on the map
+table. Readers check PRAGMA data_version, which only changes when another connection
+committed, and only then look for new rows in map_changes.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.keys_by_guid = {}
+        self.last_change = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, guid: str, types: tuple):
+        """Returns the cached rows for a shortened guid and file types, or None."""
+        key = (guid, types)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            stored, rows = entry
+            if time.time() - stored > self.ttl:
+                self._remove(key)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return rows
+
+    def put(self, guid: str, types: tuple, rows: list):
+        key = (guid, types)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.entries[key] = (time.time(), rows)
+            self.keys_by_guid.setdefault(guid, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        del self.entries[key]
+        keys = self.keys_by_guid[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_guid[key[0]]
+
+    def invalidate(self, guid: str):
+        """Removes all entries for a shortened guid."""
+        with self.lock:
+            for key in self.keys_by_guid.pop(guid, ()):
+                del self.entries[key]
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_guid.clear()
+            self.last_change = None
+
+    def apply_changes(self, connection):
+        """Invalidates the entries of all guids that were changed since the last call,
+        according to the map_changes table."""
+        with self.lock:
+            last_change = self.last_change
+        if last_change is None:
+            # nothing is known about earlier changes, so start from the current state
+            with self.lock:
+                self.entries.clear()
+                self.keys_by_guid.clear()
+                self.last_change = connection.execute(
+                    "SELECT coalesce(max(seq), 0) FROM map_changes;").fetchone()[0]
+            return
+        changes = connection.execute(
+            "SELECT seq, GUID FROM map_changes WHERE seq>? ORDER BY seq;",
+            (last_change,)).fetchall()
+        first = connection.execute("SELECT min(seq) FROM map_changes;").fetchone()[0]
+        if first is not None and first > last_change + 1:
+            # the changes we have not seen yet were already pruned from the table
+            self.clear()
+            return
+        for seq, guid in changes:
+            self.invalidate(guid)
+        if changes:
+            with self.lock:
+                self.last_change = max(self.last_change or 0, changes[-1][0])
+
+    def info(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, size=len(self.entries), maxsize=self.maxsize, ttl=self.ttl,
+                        hit_ratio=self.stats['hits'] / lookups if lookups else None)
@@ -0,0 +1,133 @@
+"""
+Disk cache of rewound MMIF files.
+
+Rewinding parses the full stored MMIF, removes views and serializes the result, which
+is repeated for every request of the same prefix. The cache keeps the serialized
+result in a file named after the prefix, the number of views and the source file,
+with the modification time of the source file in the name so that a changed source
+never produces a hit. Files are grouped in one directory per guid, which is removed
+when a MMIF for the guid is overwritten.
+
+The total size of the cache is capped. Hits update the modification time of the
+cache file and when the cache grows beyond the cap the least recently used files
+are removed until it is back under 90% of the cap. All workers share the directory,
+so the size is kept in a file in the cache directory that is updated under a flock
+lock, and the cap applies to the cache as a whole and not to each worker. Removed
+entries are not subtracted from that size, so it can be too high, but never too
+low, and it is set to the real size whenever entries are evicted.
+"""
+
+import fcntl
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class RewindCache:
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size_file = self.directory / '.size'
+
+    def guid_directory(self, guid: str) -> Path:
+        # guids come from requests, so they are hashed rather than used as names
+        return self.directory / hashlib.md5(guid.encode('utf-8')).hexdigest()
+
+    def entry_path(self, prefix: str, guid: str, num_views: int, source: str) -> Path:
+        key = hashlib.md5(f'{prefix}\0{num_views}\0{source}'.encode('utf-8')).hexdigest()
+        mtime = os.stat(source).st_mtime_ns
+        return self.guid_directory(guid) / f'{key}-{mtime}.mmif'
+
+    def get(self, prefix: str, guid: str, num_views: int, source: str):
+        """Returns the cached rewound MMIF as a string, or None."""
+        path = self.entry_path(prefix, guid, num_views, source)
+        try:
+            with open(path, 'r') as f:
+                serialized = f.read()
+        except FileNotFoundError:
+            return None
+        # the modification time is used to find the least recently used entries
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return serialized
+
+    def put(self, prefix: str, guid: str, num_views: int, source: str, serialized: str):
+        path = self.entry_path(prefix, guid, num_views, source)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # entries for older versions of the source file will never be hit again
+        for outdated in path.parent.glob(f"{path.name.rsplit('-', 1)[0]}-*.mmif"):
+            outdated.unlink(missing_ok=True)
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(serialized)
+            added = f.tell()
+        os.replace(tmp, path)
+        with self.shared_size() as size:
+            # the first entry is counted by total_size()
+            size[0] = self.total_size() if size[0] is None else size[0] + added
+            if size[0] > self.max_bytes:
+                size[0] = self.evict()
+
+    @contextmanager
+    def shared_size(self):
+        """Locks the size file and yields a list with the size of the cache, or None if
+        it is not known yet, which is written back when the block is left."""
+        with open(self.size_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read().strip()
+                size = [int(content) if content else None]
+                yield size
+                f.seek(0)
+                f.truncate()
+                f.write(str(size[0]))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def invalidate(self, guid: str):
+        """Removes all cached rewinds for the guid."""
+        directory = self.guid_directory(guid)
+        if not directory.is_dir():
+            return
+        for entry in directory.iterdir():
+            entry.unlink(missing_ok=True)
+        try:
+            directory.rmdir()
+        except OSError:
+            # another worker just added an entry
+            pass
+
+    def entries(self):
+        for directory in os.scandir(self.directory):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    try:
+                        yield entry.path, entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+    def total_size(self):
+        return sum(stat.st_size for _, stat in self.entries())
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is under 90% of its
+        maximum size and returns the new size. The size is recounted from the
+        directory, this is called while holding the lock of the size file."""
+        entries = sorted(self.entries(), key=lambda entry: entry[1].st_mtime)
+        size = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+                size -= stat.st_size
+            except FileNotFoundError:
+                pass
+        return size
@@ -0,0 +1,165 @@
+"""
+Walking the asset directory.
+
+The scanner keeps the modification time and the listing of every directory it has
+visited. On a re-scan, directories whose mtime did not change are not listed again,
+their cached listing is used instead, so a re-scan of an unchanged tree only costs
+one stat call per directory. Directories are visited in parallel by a thread pool,
+which helps most on network filesystems where each call mostly waits on the server.
+Files and directories that are symbolic links are skipped, which is what
+check_symlink() does for individual paths.
+
+The directory listings can be saved to and loaded from the scan_dirs table so that
+incremental scans also work across restarts.
+
+Usage:
+
+$ python -m api.scanner [--incremental] [-w WORKERS]
+
+This rebuilds the database from the files in ASSET_DIR in a shadow copy and swaps it
+in when it is done (see api/rebuild.py). With --incremental only the paths that
+changed since the last scan are added or removed.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import NamedTuple
+
+
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', 8))
+
+
+class DirectoryListing(NamedTuple):
+    mtime: int
+    subdirs: tuple
+    files: tuple
+
+
+class ScanResult(NamedTuple):
+    added: list
+    removed: list
+    changed_dirs: list
+    removed_dirs: list
+
+
+def list_directory(directory: str, mtime: int) -> DirectoryListing:
+    """Lists the sub directories and regular files in a directory, ignoring symlinks."""
+    subdirs = []
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry.name)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+    return DirectoryListing(mtime, tuple(subdirs), tuple(files))
+
+
+class AssetScanner:
+
+    def __init__(self, root, workers: int = SCAN_WORKERS):
+        self.root = str(root)
+        self.workers = workers
+        self.listings = {}
+
+    def files(self):
+        """Iterates over the paths of all files found by the last scan."""
+        for directory, listing in self.listings.items():
+            for name in listing.files:
+                yield os.path.join(directory, name)
+
+    def _visit(self, directory: str):
+        """Returns the listing of a directory, which is the cached listing if the
+        directory did not change, or None if the directory does not exist."""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return directory, None
+        listing = self.listings.get(directory)
+        if listing is not None and listing.mtime == mtime:
+            return directory, listing
+        return directory, list_directory(directory, mtime)
+
+    def scan(self, progress=None) -> ScanResult:
+        """
+        Walks the tree and returns the file paths that were added and removed since
+        the previous scan, as well as the directories that changed or disappeared.
+        On the first scan all files are returned as added. If given, progress is
+        called with the number of directories visited every 1000 directories.
+        """
+        result = ScanResult([], [], [], [])
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self._visit, self.root)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory, listing = future.result()
+                    if listing is None:
+                        continue
+                    seen.add(directory)
+                    if progress is not None and len(seen) % 1000 == 0:
+                        progress(len(seen))
+                    old_listing = self.listings.get(directory)
+                    if listing is not old_listing:
+                        self.listings[directory] = listing
+                        result.changed_dirs.append(directory)
+                        old_files = set(old_listing.files) if old_listing else set()
+                        new_files = set(listing.files)
+                        result.added.extend(
+                            os.path.join(directory, f) for f in new_files - old_files)
+                        result.removed.extend(
+                            os.path.join(directory, f) for f in old_files - new_files)
+                    for subdir in listing.subdirs:
+                        pending.add(executor.submit(
+                            self._visit, os.path.join(directory, subdir)))
+        for directory in set(self.listings) - seen:
+            listing = self.listings.pop(directory)
+            result.removed_dirs.append(directory)
+            result.removed.extend(os.path.join(directory, f) for f in listing.files)
+        return result
+
+    def load(self, connection):
+        """Loads the directory listings saved by a previous scan."""
+        self.listings = {}
+        for path, mtime, subdirs, files in connection.execute(
+                "SELECT path, mtime, subdirs, files FROM scan_dirs;"):
+            self.listings[path] = DirectoryListing(
+                mtime, tuple(json.loads(subdirs)), tuple(json.loads(files)))
+
+    def save(self, connection, result: ScanResult):
+        """Saves the directory listings that changed in the last scan, this does not
+        commit so it can be part of the same transaction as the changes to the map."""
+        connection.executemany(
+            "DELETE FROM scan_dirs WHERE path=?;",
+            ((d,) for d in result.removed_dirs))
+        connection.executemany(
+            "INSERT OR REPLACE INTO scan_dirs VALUES (?, ?, ?, ?);",
+            ((d, self.listings[d].mtime,
+              json.dumps(self.listings[d].subdirs), json.dumps(self.listings[d].files))
+             for d in result.changed_dirs))
+
+
+if __name__ == '__main__':
+
+    import api
+    from api import rebuild
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only add and remove paths that changed since the last scan')
+    parser.add_argument('-w', '--workers', type=int, default=SCAN_WORKERS)
+    args = parser.parse_args()
+    t0 = time.time()
+    api.initialize_database()
+    lock = rebuild.acquire_rebuild_lock()
+    if lock is None:
+        exit('A database rebuild is already running')
+    rebuild.rebuild_database(lock, incremental=args.incremental, workers=args.workers)
+    print(f'Finished in {time.time() - t0:.2f}s')
@@ -1,9 +1,49 @@
 DROP TABLE IF EXISTS map;
+DROP TABLE IF EXISTS scan_dirs;
+DROP TABLE IF EXISTS map_changes;
+DROP TABLE IF EXISTS map_search;
 CREATE TABLE IF NOT EXISTS map (
 	GUID	TEXT NOT NULL,
 	file_type	TEXT NOT NULL,
-	server_path	TEXT NOT NULL,
+	server_path	TEXT NOT NULL UNIQUE,
 	date_created TEXT NOT NULL,
 	date_last_accessed TEXT
 );
-
+CREATE INDEX IF NOT EXISTS map_guid_file_type ON map (GUID, file_type);
+CREATE TABLE IF NOT EXISTS scan_dirs (
+	path	TEXT PRIMARY KEY,
+	mtime	INTEGER NOT NULL,
+	subdirs	TEXT NOT NULL,
+	files	TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS map_changes (
+	seq	INTEGER PRIMARY KEY AUTOINCREMENT,
+	GUID	TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS map_insert AFTER INSERT ON map BEGIN
+	INSERT INTO map_changes (GUID) VALUES (new.GUID);
+END;
+CREATE TRIGGER IF NOT EXISTS map_delete AFTER DELETE ON map BEGIN
+	INSERT INTO map_changes (GUID) VALUES (old.GUID);
+END;
+CREATE TRIGGER IF NOT EXISTS map_update AFTER UPDATE OF GUID, file_type, server_path ON map BEGIN
+	INSERT INTO map_changes (GUID) VALUES (old.GUID);
+	INSERT INTO map_changes (GUID) VALUES (new.GUID);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS map_search USING fts5 (
+	GUID,
+	name,
+	tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS map_search_insert AFTER INSERT ON map BEGIN
+	INSERT INTO map_search (rowid, GUID, name) VALUES (new.rowid, new.GUID,
+		substr(new.server_path, length(rtrim(new.server_path, replace(new.server_path, '/', ''))) + 1));
+END;
+CREATE TRIGGER IF NOT EXISTS map_search_delete AFTER DELETE ON map BEGIN
+	DELETE FROM map_search WHERE rowid=old.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS map_search_update AFTER UPDATE OF GUID, server_path ON map BEGIN
+	DELETE FROM map_search WHERE rowid=old.rowid;
+	INSERT INTO map_search (rowid, GUID, name) VALUES (new.rowid, new.GUID,
+		substr(new.server_path, length(rtrim(new.server_path, replace(new.server_path, '/', ''))) + 1));
+END;
@@ -0,0 +1,114 @@
+"""
+Where MMIF files are stored within the directory of their pipeline.
+
+In the flat layout the MMIF for a guid is stored directly in the directory of its
+pipeline, as <pipeline>/<guid>.mmif. With 100k files or more in one directory listing
+it is slow, especially on network filesystems. In the sharded layout, which is used
+for new files when STORAGE_SHARDED is set, it is stored as <pipeline>/@<shard>/<guid>.mmif,
+where the shard is the first two hex digits of the md5 hash of the guid. That spreads
+the files of a pipeline evenly over at most 256 directories. Shard directories start
+with '@', which app names do not, so they are never mistaken for a pipeline step.
+
+Files are found in both layouts, so the layout can be switched at any time. Existing
+files can be moved to the configured layout with:
+
+$ python -m api.catalog reshard [--layout flat|sharded] [-w WORKERS]
+
+This should be run while the server is stopped. It moves the MMIF files and their
+precompressed copies in parallel and then updates the paths in the catalog.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+STORAGE_SHARDED = os.environ.get('STORAGE_SHARDED', '0') in ('1', 't', 'true', 'True')
+
+# suffixes of the files that are stored next to a MMIF file, see MMIF_SIDECARS
+COMPANION_SUFFIXES = ('.gz', '.zst')
+
+
+def shard_of(guid: str) -> str:
+    return '@' + hashlib.md5(guid.encode('utf-8')).hexdigest()[:2]
+
+
+def is_shard(name: str) -> bool:
+    return name.startswith('@')
+
+
+def mmif_path(pipeline_dir, guid: str, sharded: bool = None) -> str:
+    """Returns the path of the MMIF for the guid in the flat or sharded layout, by
+    default in the configured one."""
+    if sharded is None:
+        sharded = STORAGE_SHARDED
+    if sharded:
+        return os.path.join(pipeline_dir, shard_of(guid), f'{guid}.mmif')
+    return os.path.join(pipeline_dir, f'{guid}.mmif')
+
+
+def find_mmif(pipeline_dir, guid: str):
+    """Returns the path of the stored MMIF for the guid in either layout, or None. The
+    configured layout is tried first."""
+    for sharded in (STORAGE_SHARDED, not STORAGE_SHARDED):
+        path = mmif_path(pipeline_dir, guid, sharded)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def list_mmifs(pipeline_dir):
+    """Yields the paths of the MMIF files of a pipeline in both layouts."""
+    directory = Path(pipeline_dir)
+    yield from directory.glob('*.mmif')
+    yield from directory.glob('@*/*.mmif')
+
+
+def pipeline_of(directory: str) -> str:
+    """Returns the pipeline directory of a directory with MMIF files, which is the
+    parent directory for a shard."""
+    if is_shard(os.path.basename(directory)):
+        return os.path.dirname(directory)
+    return directory
+
+
+def files_to_move(storage_directory: str, sharded: bool):
+    """Yields (source, target) for the MMIF files that are not in the given layout."""
+    for root, dirs, files in os.walk(storage_directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        if root == storage_directory:
+            continue
+        pipeline_dir = pipeline_of(root)
+        for name in files:
+            if not name.endswith('.mmif'):
+                continue
+            source = os.path.join(root, name)
+            target = mmif_path(pipeline_dir, name[:-len('.mmif')], sharded)
+            if source != target:
+                yield source, target
+
+
+def move_mmif(source: str, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    for suffix in COMPANION_SUFFIXES:
+        try:
+            os.rename(source + suffix, target + suffix)
+        except FileNotFoundError:
+            pass
+    # the MMIF file goes last so that an interrupted run can be continued
+    os.rename(source, target)
+
+
+def move_all(moves: list, workers: int = 16):
+    """Moves the files for a list of (source, target) pairs with a thread pool, which
+    helps on network filesystems, and removes shard directories that became empty."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda move: move_mmif(*move), moves))
+    for directory in set(os.path.dirname(source) for source, _ in moves):
+        if is_shard(os.path.basename(directory)):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # there are files left that are not MMIFs
+                pass
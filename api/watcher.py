@@ -0,0 +1,203 @@
+"""
+Keeping the map table in sync with the assets directory.
+
+The watcher feeds file system changes in ASSET_DIR into the map table so that new
+media can be found without the directory search fallback and deleted media are not
+handed out to clients anymore. Changes are collected and written in batches.
+
+There are two ways of watching:
+
+- inotify, which is used when the optional inotify_simple package is installed. Every
+  directory gets a watch and created, moved and deleted files and directories are
+  handled as they happen. Note that each directory takes one watch, so on large trees
+  fs.inotify.max_user_watches may need to be raised. If adding the watches fails the
+  watcher falls back to polling.
+- polling, which rescans the tree with the AssetScanner every WATCH_INTERVAL seconds.
+  Since the scanner only lists directories whose mtime changed this is cheap on a
+  tree that does not change much.
+
+In both cases the rules used when building the database apply: symbolic links are
+ignored and only files starting with 'cpb' and not in hidden directories are added.
+Only one process runs the watcher, which is enforced with a lock file.
+"""
+
+import fcntl
+import os
+import threading
+import time
+from pathlib import Path
+
+import api
+from api import DATABASE, SEARCH_DIRECTORY, check_symlink, is_asset_path
+from api.scanner import AssetScanner
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+LOCK_FILE = DATABASE.parent / 'watcher.lock'
+
+# Seconds between scans when polling, and seconds that inotify events are collected
+# before they are written to the database.
+WATCH_INTERVAL = int(os.environ.get('WATCH_INTERVAL', 60))
+WATCH_BATCH_DELAY = float(os.environ.get('WATCH_BATCH_DELAY', 2))
+
+
+class PollingWatcher:
+
+    def __init__(self, root, interval: int = WATCH_INTERVAL):
+        self.scanner = AssetScanner(root)
+        self.interval = interval
+
+    def run(self):
+        connection = None
+        while True:
+            # a new connection means that a rebuild swapped in a new database, which
+            # comes with its own directory listings
+            if api.get_db_connection() is not connection:
+                connection = api.get_db_connection()
+                self.scanner.load(connection)
+            result = self.scanner.scan()
+            added = [path for path in result.added if is_asset_path(path)]
+            removed = [path for path in result.removed if is_asset_path(path)]
+            with connection:
+                api.update_map(connection, added, removed)
+                self.scanner.save(connection, result)
+            if added or removed:
+                print(f'>>   Watcher added {len(added)} and removed {len(removed)} paths')
+            time.sleep(self.interval)
+
+
+class InotifyWatcher:
+
+    def __init__(self, root, batch_delay: float = WATCH_BATCH_DELAY):
+        self.root = str(root)
+        self.batch_delay = batch_delay
+        self.mask = flags.CREATE | flags.MOVED_TO | flags.DELETE | flags.MOVED_FROM
+        self.inotify = INotify()
+        self.overflow = False
+        self.directories = {}
+        self.added = set()
+        self.removed = set()
+        self.removed_dirs = set()
+
+    def watch_tree(self, directory: str):
+        """Adds watches for a directory and everything below it. Files already in
+        the directory are treated as added since they may have been created before
+        the watch was in place."""
+        for root, dirs, files in os.walk(directory):
+            # hidden directories are not in the map, and os.walk does not follow
+            # symbolic links to directories
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            wd = self.inotify.add_watch(root, self.mask)
+            self.directories[wd] = root
+            for name in files:
+                self.file_created(os.path.join(root, name))
+
+    def unwatch_tree(self, directory: str):
+        prefix = directory.rstrip('/') + '/'
+        for wd, path in list(self.directories.items()):
+            if path == directory or path.startswith(prefix):
+                del self.directories[wd]
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    # the kernel already removed the watch of a deleted directory
+                    pass
+        self.added = set(path for path in self.added if not path.startswith(prefix))
+        self.removed_dirs.add(directory)
+
+    def file_created(self, path: str):
+        if is_asset_path(path) and not check_symlink(Path(path)):
+            self.added.add(path)
+            self.removed.discard(path)
+
+    def file_removed(self, path: str):
+        self.removed.add(path)
+        self.added.discard(path)
+
+    def handle(self, event):
+        if event.mask & flags.Q_OVERFLOW:
+            self.overflow = True
+            return
+        directory = self.directories.get(event.wd)
+        if directory is None or not event.name:
+            return
+        path = os.path.join(directory, event.name)
+        if event.mask & flags.ISDIR:
+            if event.mask & (flags.CREATE | flags.MOVED_TO):
+                if not event.name.startswith('.'):
+                    self.watch_tree(path)
+            else:
+                self.unwatch_tree(path)
+        elif event.mask & (flags.CREATE | flags.MOVED_TO):
+            self.file_created(path)
+        else:
+            self.file_removed(path)
+
+    def flush(self, connection):
+        if not (self.added or self.removed or self.removed_dirs):
+            return
+        with connection:
+            # directories are removed first since a directory may have been moved
+            # away and back again within one batch
+            api.update_map(connection, [], [], self.removed_dirs)
+            api.update_map(connection, self.added, self.removed)
+        print(f'>>   Watcher added {len(self.added)} and removed '
+              f'{len(self.removed)} paths and {len(self.removed_dirs)} directories')
+        self.added, self.removed, self.removed_dirs = set(), set(), set()
+
+    def run(self):
+        connection = api.get_db_connection()
+        while True:
+            for event in self.inotify.read(timeout=1000, read_delay=int(self.batch_delay * 1000)):
+                self.handle(event)
+            if api.get_db_connection() is not connection or self.overflow:
+                # events that arrived while a rebuild was running may be missing from
+                # the new database, and when the event queue overflowed events were
+                # lost, in both cases the database is brought up to date with a rescan
+                connection = api.get_db_connection()
+                self.flush(connection)
+                api.populate_database(connection, incremental=True)
+                self.overflow = False
+            self.flush(connection)
+
+
+def start_watcher(mode: str = 'auto'):
+    """
+    Starts the watcher in a background thread, using inotify if mode is 'auto' or
+    'inotify' and inotify is available, and polling otherwise. Returns False if the
+    watcher already runs in another process.
+    """
+    lock = open(LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+
+    def run():
+        watcher = None
+        if mode in ('auto', 'inotify') and INotify is not None:
+            try:
+                watcher = InotifyWatcher(SEARCH_DIRECTORY)
+                watcher.watch_tree(SEARCH_DIRECTORY)
+                watcher.flush(api.get_db_connection())
+                print(f'>>   Watching {len(watcher.directories)} directories with inotify')
+            except OSError as e:
+                print(f'>>   Could not watch with inotify ({e}), polling instead')
+                if watcher is not None:
+                    watcher.inotify.close()
+                watcher = None
+        if watcher is None:
+            watcher = PollingWatcher(SEARCH_DIRECTORY)
+            print(f'>>   Polling for changes every {watcher.interval}s')
+        watcher.run()
+
+    # the lock is kept open by the thread for the lifetime of the process
+    thread = threading.Thread(target=run, name='watcher', daemon=True)
+    thread.lock = lock
+    thread.start()
+    return True
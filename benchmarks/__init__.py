@@ -0,0 +1,7 @@
+"""
+Benchmarks with a synthetic corpus.
+
+benchmarks/corpus.py generates asset directories and MMIF files, benchmarks/scenario.py
+measures the server on them for one size and benchmarks/run.py runs the scenario for
+several sizes and writes the results to a JSON file. See python -m benchmarks.run --help.
+"""
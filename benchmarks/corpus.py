@@ -0,0 +1,138 @@
+"""
+Generators for synthetic asset directories and MMIF files.
+
+Everything is generated from a seeded random number generator, so the same
+arguments always give the same corpus.
+
+An asset directory has one directory per file type with the files spread over a
+tree of numbered directories, like the directory of the archive. Asset files are
+empty since only their names matter to the server. Optionally some files get a
+symbolic link in a links directory, which the server has to skip, and a few hidden
+directories get files that are not added to the database.
+
+MMIF files have a video document for one of the GUIDs and one or more views per
+step of a pipeline, each view has a number of TimeFrame annotations, which decides
+the size of the file.
+"""
+
+import json
+import os
+import random
+import string
+from pathlib import Path
+
+
+ASSET_EXTENSIONS = {'video': '.mp4', 'audio': '.mp3', 'text': '.txt', 'image': '.jpg', 'markup': '.xml'}
+
+MMIF_VERSION = '1.0.4'
+TIMEFRAME = 'http://mmif.clams.ai/vocabulary/TimeFrame/v5'
+VIDEO_DOCUMENT = 'http://mmif.clams.ai/vocabulary/VideoDocument/v1'
+
+
+def make_guid(rng: random.Random) -> str:
+    suffix = ''.join(rng.choices(string.ascii_lowercase + string.digits, k=10))
+    return f'cpb-aacip-{rng.randint(10, 999)}-{suffix}'
+
+
+def make_guids(count: int, seed: int = 0):
+    """Returns count distinct GUIDs."""
+    rng = random.Random(seed)
+    guids = set()
+    while len(guids) < count:
+        guids.add(make_guid(rng))
+    return sorted(guids)
+
+
+def asset_directory(rng: random.Random, depth: int, fanout: int):
+    return Path(*(f'{rng.randrange(fanout):03d}' for _ in range(depth)))
+
+
+def generate_assets(directory, guids, file_types=('video', 'text'), depth: int = 2,
+                    fanout: int = 32, symlinks: float = 0.0, hidden_dirs: int = 0,
+                    seed: int = 0):
+    """
+    Creates an empty file for each GUID and file type below directory and returns the
+    number of files created. A fraction symlinks of the GUIDs also gets a symbolic link
+    to its first file, and hidden_dirs hidden directories get a few files each.
+    """
+    rng = random.Random(seed)
+    root = Path(directory)
+    created = set()
+    count = 0
+    for guid in guids:
+        subdirectory = asset_directory(rng, depth, fanout)
+        for file_type in file_types:
+            parent = root / file_type / subdirectory
+            if parent not in created:
+                parent.mkdir(parents=True, exist_ok=True)
+                created.add(parent)
+            (parent / f'{guid}{ASSET_EXTENSIONS[file_type]}').touch()
+            count += 1
+        if symlinks and rng.random() < symlinks:
+            links = root / 'links'
+            links.mkdir(exist_ok=True)
+            target = root / file_types[0] / subdirectory / f'{guid}{ASSET_EXTENSIONS[file_types[0]]}'
+            (links / target.name).symlink_to(target)
+    for i in range(hidden_dirs):
+        hidden = root / file_types[0] / f'.hidden-{i}'
+        hidden.mkdir(parents=True, exist_ok=True)
+        for guid in rng.sample(guids, min(10, len(guids))):
+            (hidden / f'{guid}{ASSET_EXTENSIONS[file_types[0]]}').touch()
+    return count
+
+
+def make_pipeline(steps: int, seed: int = 0):
+    """Returns a list of (app identifier, parameters) for the steps of a pipeline."""
+    rng = random.Random(seed)
+    return [(f'http://apps.clams.ai/bench-app-{step}/v{rng.randint(1, 9)}.{rng.randint(0, 9)}',
+             {'threshold': f'0.{rng.randint(1, 9)}', 'sampleRate': str(rng.choice((100, 500, 1000)))})
+            for step in range(steps)]
+
+
+def pipeline_spec(pipeline, steps: int = None):
+    """Returns the pipeline of the download and presence routes for the first steps of
+    a pipeline, by default all of them."""
+    return {'/'.join(app.split('/')[3:]): parameters for app, parameters in pipeline[:steps]}
+
+
+def make_mmif(guid: str, pipeline, views_per_step: int = 1, annotations: int = 50,
+              rng: random.Random = None) -> dict:
+    rng = rng or random.Random(guid)
+    views = []
+    for app, parameters in pipeline:
+        for _ in range(views_per_step):
+            view_id = f'v_{len(views) + 1}'
+            start = 0
+            frames = []
+            for i in range(annotations):
+                end = start + rng.randint(100, 5000)
+                frames.append({'@type': TIMEFRAME, 'properties': {
+                    'id': f'tf_{i + 1}', 'start': start, 'end': end,
+                    'frameType': rng.choice(('bars', 'slate', 'chyron', 'credits')),
+                    'timeUnit': 'milliseconds'}})
+                start = end
+            views.append({
+                'id': view_id,
+                'metadata': {'app': app, 'timestamp': '2025-01-01T00:00:00.000000',
+                             'parameters': parameters, 'appConfiguration': parameters,
+                             'contains': {TIMEFRAME: {'document': 'd1'}}},
+                'annotations': frames})
+    return {
+        'metadata': {'mmif': f'http://mmif.clams.ai/{MMIF_VERSION}'},
+        'documents': [{'@type': VIDEO_DOCUMENT, 'properties': {
+            'id': 'd1', 'mime': 'video/mp4', 'location': f'file:///data/video/{guid}.mp4'}}],
+        'views': views}
+
+
+def generate_mmifs(directory, guids, pipeline, views_per_step: int = 1, annotations: int = 50,
+                   seed: int = 0):
+    """Writes a MMIF file for each GUID to directory and returns their paths."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for guid in guids:
+        path = os.path.join(directory, f'{guid}.mmif')
+        with open(path, 'w') as f:
+            json.dump(make_mmif(guid, pipeline, views_per_step, annotations, rng), f)
+        paths.append(path)
+    return paths
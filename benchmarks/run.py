@@ -0,0 +1,111 @@
+"""
+Runs the benchmarks for one or more corpus sizes and writes the results to a JSON file.
+
+$ python -m benchmarks.run [--scale N ...] [-o RESULTS] [--keep] [scenario options]
+$ python -m benchmarks.run --compare OLD NEW [--threshold PERCENT]
+
+Each scale is the number of GUIDs in a generated asset directory, the default scales
+are 10k, 100k and 1M. The number of MMIF files and pipelines grow with the scale
+unless they are fixed with --mmifs and --pipelines. For each scale an asset
+directory and a MMIF corpus are generated in a temporary directory and benchmarks/scenario.py measures building the
+database, /searchapi hits, misses and substring matches, batch uploads, downloads,
+rewinds and /storeapi/status with the Flask test client. Options that are not listed
+here are handed to the scenario, see python -m benchmarks.scenario --help.
+
+The results file also records the commit, the Python and SQLite versions and the
+options, and two results files can be compared with --compare, which prints the
+numbers that changed by more than the threshold (default 10%).
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+
+DEFAULT_SCALES = (10000, 100000, 1000000)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scale(scale: int, options: list, keep: bool):
+    workdir = tempfile.mkdtemp(prefix=f'datahousing-bench-{scale}-')
+    output = os.path.join(workdir, 'results.json')
+    try:
+        subprocess.run([sys.executable, '-m', 'benchmarks.scenario', workdir, '-o', output,
+                        '--assets', str(scale), *options], check=True)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        if keep:
+            print(f'Kept the files for scale {scale} in {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def flatten(results, prefix=''):
+    """Yields (dotted name, value) for the numbers in nested results."""
+    if isinstance(results, dict):
+        for key, value in results.items():
+            yield from flatten(value, f'{prefix}.{key}' if prefix else str(key))
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            yield from flatten(value, f'{prefix}[{i}]')
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        yield prefix, results
+
+
+def compare(old_file: str, new_file: str, threshold: float):
+    with open(old_file) as f:
+        old = {f'{run["assets"]}.{name}': value for run in json.load(f)['runs']
+               for name, value in flatten(run)}
+    with open(new_file) as f:
+        new = {f'{run["assets"]}.{name}': value for run in json.load(f)['runs']
+               for name, value in flatten(run)}
+    for name in sorted(set(old) & set(new)):
+        if old[name] == 0:
+            continue
+        change = (new[name] - old[name]) / old[name] * 100
+        if abs(change) >= threshold:
+            print(f'{name:60} {old[name]:>12} {new[name]:>12} {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, action='append', help='number of GUIDs, can be repeated')
+    parser.add_argument('-o', '--output', default=f'benchmarks/results-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    parser.add_argument('--keep', action='store_true', help='keep the generated files')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=10.0)
+    args, options = parser.parse_known_args()
+    if args.compare:
+        compare(*args.compare, args.threshold)
+        return
+    started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    runs = []
+    for scale in args.scale or DEFAULT_SCALES:
+        t0 = time.time()
+        runs.append(run_scale(scale, options, args.keep))
+        print(f'>>   Finished scale {scale} in {time.time() - t0:.1f}s')
+    results = {'started': started, 'commit': git_commit(),
+               'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+               'platform': platform.platform(), 'options': options, 'runs': runs}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Runs the benchmarks for one corpus size in a fresh working directory.
+
+The server reads its configuration from the environment when the api package is
+imported, so this module points the environment at the working directory first and
+is run in its own process for each size by benchmarks/run.py:
+
+$ python -m benchmarks.scenario WORKDIR --assets 10000 -o RESULTS [options]
+
+Unless --mmifs and --pipelines are given, the MMIF corpus grows with the asset
+directory: one MMIF for every MMIFS_PER_ASSET GUIDs, spread over one pipeline for
+every MMIFS_PER_PIPELINE MMIFs, so that /storeapi/status and the catalog are measured
+at each size as well.
+
+The results are written to a JSON file, stdout has the output of the server.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import tarfile
+import time
+
+
+# the size of the MMIF corpus if it is not given, relative to the number of assets
+MMIFS_PER_ASSET = 10
+MMIFS_PER_PIPELINE = 1000
+
+
+def percentiles(samples):
+    """Returns the count, p50, p99 and maximum of a list of durations in milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {'count': len(ordered), 'p50_ms': round(rank(0.50) * 1000, 3),
+            'p99_ms': round(rank(0.99) * 1000, 3), 'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+def timed(function, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def latencies(client, requests):
+    """Sends (method, url, kwargs) requests and returns the durations and the number of
+    responses with an error status."""
+    durations = []
+    errors = 0
+    for method, url, kwargs in requests:
+        response, duration = timed(getattr(client, method), url, **kwargs)
+        durations.append(duration)
+        errors += response.status_code >= 400
+    return durations, errors
+
+
+def configure(workdir: str):
+    """Points the server configuration at the working directory."""
+    os.environ.update({
+        'ASSET_DIR': os.path.join(workdir, 'assets'),
+        'STORAGE_DIR': os.path.join(workdir, 'storage'),
+        'ASSET_DB': os.path.join(workdir, 'db', 'database.db'),
+        'CATALOG_DB': os.path.join(workdir, 'db', 'catalog.db'),
+        'REWIND_CACHE_DIR': os.path.join(workdir, 'rewind-cache'),
+        'BUILD_DB': '0',
+        'WATCH_ASSETS': ''})
+    for name in ('assets', 'storage', 'db', 'mmifs'):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+
+
+def upload_batches(client, paths, batch_size: int):
+    """Uploads the files as tar batches and returns the duration, bytes sent and counts."""
+    counts = {'success': 0, 'warning': 0, 'error': 0}
+    sent = 0
+    t0 = time.perf_counter()
+    for start in range(0, len(paths), batch_size):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for i, path in enumerate(paths[start:start + batch_size]):
+                tar.add(path, arcname=str(i))
+        body = archive.getvalue()
+        sent += len(body)
+        response = client.post('/storeapi/upload/batch', data=body, content_type='application/x-tar')
+        for status, count in response.get_json()['counts'].items():
+            counts[status] += count
+    return time.perf_counter() - t0, sent, counts
+
+
+def run(args):
+    from benchmarks import corpus
+    configure(args.workdir)
+    mmif_count = args.mmifs if args.mmifs is not None else max(1, args.assets // MMIFS_PER_ASSET)
+    pipeline_count = args.pipelines if args.pipelines is not None else max(1, mmif_count // MMIFS_PER_PIPELINE)
+    results = {'assets': args.assets, 'mmifs': mmif_count, 'pipelines': pipeline_count}
+    rng = random.Random(args.seed)
+
+    guids = corpus.make_guids(args.assets + args.requests, args.seed)
+    stored = guids[:args.assets]
+    absent = guids[args.assets:]
+    files, duration = timed(
+        corpus.generate_assets, os.environ['ASSET_DIR'], stored, depth=args.depth,
+        fanout=args.fanout, symlinks=args.symlinks, hidden_dirs=args.hidden_dirs, seed=args.seed)
+    results['generate_assets'] = {'files': files, 'seconds': round(duration, 3)}
+
+    import api
+    from api import rebuild
+    api.initialize_database()
+    _, duration = timed(rebuild.rebuild_database, rebuild.acquire_rebuild_lock(), False, args.scan_workers)
+    results['db_build_seconds'] = round(duration, 3)
+    _, duration = timed(rebuild.rebuild_database, rebuild.acquire_rebuild_lock(), True, args.scan_workers)
+    results['db_incremental_build_seconds'] = round(duration, 3)
+
+    app = api.create_app(False)
+    client = app.test_client()
+    api.guid_index.ready.wait()
+
+    search = {}
+    for name, sample in (('hit', rng.choices(stored, k=args.requests)), ('miss', absent)):
+        durations, errors = latencies(client, [('get', '/searchapi', {'query_string': {'guid': guid}})
+                                               for guid in sample])
+        search[name] = dict(percentiles(durations), errors=errors)
+    durations, _ = latencies(client, [('get', '/searchapi', {'query_string': {'guid': guid[10:16], 'match': 'substring'}})
+                                      for guid in rng.choices(stored, k=min(args.requests, 200))])
+    search['substring'] = percentiles(durations)
+    results['searchapi'] = search
+
+    # the guids are spread over the pipelines round robin, pipelines made with different
+    # seeds have the same apps with other versions and parameters
+    pipelines = [corpus.make_pipeline(args.steps, args.seed + i) for i in range(pipeline_count)]
+    mmif_guids = stored[:mmif_count]
+    stored_mmifs = [(guid, pipelines[i % pipeline_count]) for i, guid in enumerate(mmif_guids)]
+    paths = []
+    for i, pipeline in enumerate(pipelines):
+        paths.extend(corpus.generate_mmifs(
+            os.path.join(args.workdir, 'mmifs', str(i)), mmif_guids[i::pipeline_count], pipeline,
+            args.views_per_step, args.annotations, args.seed))
+    duration, sent, counts = upload_batches(client, paths, args.batch_size)
+    results['upload'] = {'files': len(paths), 'bytes': sent, 'seconds': round(duration, 3),
+                         'files_per_second': round(len(paths) / duration, 1),
+                         'mb_per_second': round(sent / duration / 1e6, 2), 'counts': counts}
+
+    sample = rng.choices(stored_mmifs, k=min(args.requests, 200))
+    durations, errors = latencies(client, [
+        ('post', '/storeapi/download', {'json': {'pipeline': corpus.pipeline_spec(pipeline), 'guid': guid}})
+        for guid, pipeline in sample])
+    results['download'] = dict(percentiles(durations), errors=errors)
+    if args.steps > 1:
+        requests = [('post', '/storeapi/download',
+                     {'json': {'pipeline': corpus.pipeline_spec(pipeline, args.steps - 1), 'guid': guid}})
+                    for guid, pipeline in sample]
+        # the first round fills the rewind cache, the second one is answered from it
+        results['rewind'] = {}
+        for name in ('cold', 'warm'):
+            durations, errors = latencies(client, requests)
+            results['rewind'][name] = dict(percentiles(durations), errors=errors)
+    durations, errors = latencies(client, [('get', '/storeapi/status', {})] * 20)
+    results['status'] = dict(percentiles(durations), errors=errors)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('workdir')
+    parser.add_argument('-o', '--output', required=True, help='JSON file for the results')
+    parser.add_argument('--assets', type=int, default=10000, help='number of GUIDs in the asset directory')
+    parser.add_argument('--depth', type=int, default=2, help='depth of the asset directory tree')
+    parser.add_argument('--fanout', type=int, default=32, help='subdirectories per directory')
+    parser.add_argument('--symlinks', type=float, default=0.01, help='fraction of GUIDs with a symbolic link')
+    parser.add_argument('--hidden-dirs', type=int, default=2)
+    parser.add_argument('--scan-workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000, help='number of requests per measurement')
+    parser.add_argument('--mmifs', type=int, help='number of MMIF files to upload, by default '
+                        f'one for every {MMIFS_PER_ASSET} assets')
+    parser.add_argument('--pipelines', type=int, help='number of pipelines the MMIF files are spread '
+                        f'over, by default one for every {MMIFS_PER_PIPELINE} MMIF files')
+    parser.add_argument('--steps', type=int, default=3, help='number of steps of each pipeline')
+    parser.add_argument('--views-per-step', type=int, default=1)
+    parser.add_argument('--annotations', type=int, default=50, help='annotations per view')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,70 +2,183 @@
 
 Batch script to add MMIF files from a directory to the storage server.
 
-The storage server is expected to run on 127.0.0.1:8001.
-
 Usage:
 
-$ python populate.py <directory> [-d] [-c INT]
-
-This walks through the entire directory and tries to upload all files with the .mmif
-extension. It assumes that MMIF files are always inside directories starting with
-"preds@". Failures are written to the log. When debug=True the log name will be just
-"log.txt", otherwise the name will include a timestamp. The -c option limits the
-number of files from a "preds@" directory, the default is some high number.
+$ python populate_mmif.py <directory> [-d] [-c INT] [-a] [-u URL] [-b INT] [-j INT]
+                          [--overwrite] [--checkpoint FILE]
 
-For example, for the entire evaluation code or some subdirectory thereof:
+This walks through the entire directory and uploads all files with the .mmif extension
+with the storeapi/upload/batch route, in batches of files that are sent as tar
+archives. By default it assumes that MMIF files are always inside directories starting
+with "preds@" as in the evaluations repository, use -a to upload MMIF files from all
+directories. The -c option limits the number of files from a directory, the default is
+some high number.
 
-$ python populate.py ../aapb-evaluations
-$ python populate.py ../aapb-evaluations/timeframe-eval
-$ python populate.py ../aapb-evaluations/timeframe-eval/preds@swt@3.1@batch2
+Several batches are uploaded at the same time (-j, default 4) over persistent
+connections to the server (-u, default http://127.0.0.1:8001). Files that were handled
+by the server, whether they were stored or not, are added to a checkpoint file and are
+skipped when the script is run again, so an interrupted run can just be restarted.
+Failures and the server response for each file are written to the log, and the
+throughput is printed after every batch. When debug=True the log name will be just
+"log.txt", otherwise the name will include a timestamp.
 
-Curl request used in this code:
-
-$ curl -X POST 127.0.0.1:8001/storeapi/upload -d @<some_mmif_fille>
+For example, for the entire evaluation code or some subdirectory thereof:
 
-TODO (marc @ 4/21/25). This needs to be generalized (assuming it is useful useful beyond
-what I used it for when populating MMIF storage) since it only works for files on the
-evaluations repository at https://github.com/clamsproject/aapb-evaluations, which is now
-deprecated.
+$ python populate_mmif.py ../aapb-evaluations
+$ python populate_mmif.py ../aapb-evaluations/timeframe-eval
+$ python populate_mmif.py ../aapb-evaluations/timeframe-eval/preds@swt@3.1@batch2
 
 """
 
 
-import os, argparse, time, subprocess
+import os, argparse, time, json, tarfile, tempfile, threading, http.client
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlparse
 
 
-url = '127.0.0.1:8001/storeapi/upload'
+upload_path = '/storeapi/upload/batch'
 
 
 def timestamp():
     return datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
 
-def populate_storage_directory(evaluation_data: str, maxcount: int, debug: bool):
+def find_mmif_files(evaluation_data: str, maxcount: int, all_directories: bool):
+    for directory, _, filenames in os.walk(top=evaluation_data):
+        if not all_directories and 'preds@' not in directory:
+            continue
+        mmif_files = sorted(filename for filename in filenames if filename.endswith('.mmif'))
+        for filename in mmif_files[:maxcount]:
+            yield os.path.join(directory, filename)
+
+
+def batches(paths, size: int):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Uploader:
+
+    """Uploads batches of MMIF files, each thread keeps its own connection open."""
+
+    def __init__(self, url: str, overwrite: bool):
+        parsed = urlparse(url if '://' in url else f'http://{url}')
+        self.connection_class = (http.client.HTTPSConnection if parsed.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.netloc = parsed.netloc
+        self.path = parsed.path.rstrip('/') + upload_path + ('?overwrite=true' if overwrite else '')
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connection_class(self.netloc, timeout=600)
+        return self.local.connection
+
+    def upload(self, paths: list):
+        """Sends the files as one tar archive and returns the results from the server
+        by position in the list, and the size of the archive. The archive is written
+        to a temporary file so that large files are not held in memory."""
+        with tempfile.TemporaryFile() as archive:
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                for i, path in enumerate(paths):
+                    tar.add(path, arcname=str(i))
+            size = archive.tell()
+            archive.seek(0)
+            try:
+                connection = self.connection()
+                connection.request('POST', self.path, body=archive, headers={
+                    'Content-Type': 'application/x-tar', 'Content-Length': str(size)})
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                # the connection is reopened for the next batch
+                self.local.connection.close()
+                self.local.connection = None
+                raise
+        if response.status != 200:
+            raise RuntimeError(f'{response.status} {response.reason} {body[:200]}')
+        return {int(result['name']): result for result in json.loads(body)['results']
+                if result['name'].isdigit()}, size
+
+
+def read_checkpoint(checkpoint: str):
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as fh:
+        return set(line.rstrip('\n') for line in fh)
+
+
+def populate_storage_directory(evaluation_data: str, maxcount: int, debug: bool,
+                               all_directories: bool = False, url: str = 'http://127.0.0.1:8001',
+                               batch_size: int = 20, jobs: int = 4, overwrite: bool = False,
+                               checkpoint: str = 'populate_mmif.checkpoint'):
     log = 'log.txt' if debug else f'log-{timestamp()}.txt'
-    with open(log, 'w') as fh_log:
-        for directory, _, filenames in os.walk(top=evaluation_data):
-            if 'preds@' in directory:
-                fh_log.write(f'{timestamp()} >>> Uploading files from {directory}\n')
-                print(f'Uploading files from {directory}')
-                count = 0
-                for filename in filenames:
-                    if not filename.endswith('.mmif'):
-                        continue
-                    count += 1
-                    if count > maxcount:
-                        break
-                    print(f'    {count} {filename}')
-                    t0 = time.time()
-                    path = f'{directory}/{filename}'
-                    size = os.path.getsize(path)
-                    command = ['curl', '-X', 'POST', url, '-d', f'@{path}']
-                    result = subprocess.run(command, capture_output=True)
-                    time_elapsed = time.time() - t0
-                    fh_log.write(f'{timestamp()} --- {filename} size={size} time={time_elapsed:.6f}\n')
-                    fh_log.write(f'{result.stdout.decode("utf-8").strip()}\n')
+    done = read_checkpoint(checkpoint)
+    paths = (path for path in find_mmif_files(evaluation_data, maxcount, all_directories)
+             if path not in done)
+    uploader = Uploader(url, overwrite)
+    counts = {'success': 0, 'warning': 0, 'error': 0}
+    uploaded_files = uploaded_bytes = 0
+    t0 = time.time()
+    print(f'Uploading files from {evaluation_data}, skipping {len(done)} files in {checkpoint}')
+    with open(log, 'w') as fh_log, open(checkpoint, 'a') as fh_checkpoint, \
+            ThreadPoolExecutor(max_workers=jobs) as executor:
+        # only submit a few batches ahead so that walking a large tree does not
+        # queue up everything at once
+        pending = []
+        for batch in batches(paths, batch_size):
+            pending.append((batch, executor.submit(uploader.upload, batch)))
+            if len(pending) < jobs * 2:
+                continue
+            batch, future = pending.pop(0)
+            uploaded_files, uploaded_bytes = handle_batch(
+                batch, future, fh_log, fh_checkpoint, counts, t0, uploaded_files, uploaded_bytes)
+        for batch, future in pending:
+            uploaded_files, uploaded_bytes = handle_batch(
+                batch, future, fh_log, fh_checkpoint, counts, t0, uploaded_files, uploaded_bytes)
+    print(f'Done, {counts["success"]} stored, {counts["warning"]} warnings, '
+          f'{counts["error"]} errors, see {log}')
+
+
+def handle_batch(batch: list, future, fh_log, fh_checkpoint, counts: dict,
+                 t0: float, uploaded_files: int, uploaded_bytes: int):
+    """Logs the results of an uploaded batch and adds the files to the checkpoint,
+    returns the updated number of uploaded files and bytes."""
+    try:
+        results, size = future.result()
+    except Exception as e:
+        counts['error'] += len(batch)
+        fh_log.write(f'{timestamp()} >>> Batch of {len(batch)} files failed: {e}\n')
+        for path in batch:
+            fh_log.write(f'{timestamp()} --- {path} not uploaded\n')
+        fh_log.flush()
+        return uploaded_files, uploaded_bytes
+    for i, path in enumerate(batch):
+        result = results.get(i, {'status': 'error', 'message': 'missing from the response'})
+        counts[result['status']] += 1
+        fh_log.write(f'{timestamp()} --- {path} {json.dumps(result)}\n')
+        # files with errors are tried again when the script is restarted
+        if result['status'] != 'error':
+            fh_checkpoint.write(f'{path}\n')
+    fh_checkpoint.flush()
+    log_throughput(fh_log, t0, uploaded_files + len(batch), uploaded_bytes + size, counts)
+    fh_log.flush()
+    return uploaded_files + len(batch), uploaded_bytes + size
+
+
+def log_throughput(fh_log, t0: float, files: int, size: int, counts: dict):
+    elapsed = time.time() - t0
+    message = (f'{files} files in {elapsed:.1f}s, {files / elapsed:.1f} files/s, '
+               f'{size / elapsed / 1e6:.2f} MB/s ({counts["error"]} errors)')
+    print(f'    {message}')
+    fh_log.write(f'{timestamp()} >>> {message}\n')
 
 
 if __name__ == '__main__':
@@ -74,5 +187,14 @@ if __name__ == '__main__':
     parser.add_argument('evaluation_data')
     parser.add_argument('-c', '--count', type=int, default=10000)
     parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('-a', '--all-directories', action='store_true',
+                        help='upload from all directories, not just preds@ directories')
+    parser.add_argument('-u', '--url', default='http://127.0.0.1:8001')
+    parser.add_argument('-b', '--batch-size', type=int, default=20)
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='number of concurrent uploads')
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--checkpoint', default='populate_mmif.checkpoint')
     args = parser.parse_args()
-    populate_storage_directory(args.evaluation_data, args.count, args.debug)
+    populate_storage_directory(
+        args.evaluation_data, args.count, args.debug, args.all_directories, args.url,
+        args.batch_size, args.jobs, args.overwrite, args.checkpoint)
@@ -0,0 +1,142 @@
+"""
+Shared fixtures for the tests.
+
+The server reads its configuration from the environment when the api package is
+imported, so the environment is pointed at a temporary directory here, before any
+test module imports api. All tests share that directory and one application, the
+fixtures empty the parts of it that a test uses.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from benchmarks import corpus
+
+ROOT = Path(tempfile.mkdtemp(prefix='datahousing-tests-'))
+os.environ.update({
+    'ASSET_DIR': str(ROOT / 'assets'),
+    'STORAGE_DIR': str(ROOT / 'storage'),
+    'ASSET_DB': str(ROOT / 'db' / 'database.db'),
+    'CATALOG_DB': str(ROOT / 'db' / 'catalog.db'),
+    'REWIND_CACHE_DIR': str(ROOT / 'rewind-cache'),
+    'BUILD_DB': '0',
+    'WATCH_ASSETS': '',
+    'GUID_INDEX_REFRESH': '0',
+    'METRICS_DIR': '',
+    'PROFILE_DIR': ''})
+for name in ('assets', 'storage', 'db'):
+    (ROOT / name).mkdir()
+
+# the map table as it was created before schema versions were introduced
+BASELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS map (
+	GUID	TEXT NOT NULL,
+	file_type	TEXT NOT NULL,
+	server_path	TEXT NOT NULL,
+	date_created TEXT NOT NULL,
+	date_last_accessed TEXT
+);
+"""
+
+
+# a pipeline of three steps with one view each
+PIPELINE = corpus.make_pipeline(3)
+
+
+def make_asset(guid: str, suffix: str = '.mp4', directory: str = 'videos') -> Path:
+    path = ROOT / 'assets' / directory / f'{guid}{suffix}'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'asset')
+    return path
+
+
+def make_baseline_database(path, paths):
+    """Writes a database with the baseline schema and a row for each path, rows for
+    the same path are repeated like the baseline did on every lookup miss."""
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    today = str(date.today())
+    for server_path in paths:
+        guid = Path(server_path).stem
+        connection.execute("INSERT INTO map VALUES (?, ?, ?, ?, ?);",
+                           (guid, 'video', str(server_path), today, today))
+    connection.commit()
+    return connection
+
+
+@pytest.fixture
+def map_database(tmp_path):
+    """Returns the path of a database with the current schema and two connections to
+    it, one that reads and one that makes changes like another worker would."""
+    import api
+    path = tmp_path / 'database.db'
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL;')
+    connection.executescript((Path(api.__file__).parent / 'schema.sql').read_text())
+    connection.close()
+    reader = api.open_db_connection(str(path))
+    writer = api.open_db_connection(str(path))
+    yield path, reader, writer
+    reader.close()
+    writer.close()
+
+
+def add_rows(connection, *paths):
+    """Adds rows for the paths like the watcher or another worker does."""
+    import api
+    with connection:
+        api.update_map(connection, list(paths), [])
+
+
+def remove_rows(connection, *paths):
+    import api
+    with connection:
+        api.update_map(connection, [], list(paths))
+
+
+@pytest.fixture(scope='session')
+def app():
+    import api
+    application = api.create_app(False)
+    api.guid_index.ready.wait()
+    return application
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def storage(app):
+    """Empties the storage directory, the catalog and the caches of stored MMIFs."""
+    from api import catalog, mmif_storage
+    storage_directory = ROOT / 'storage'
+    shutil.rmtree(storage_directory)
+    storage_directory.mkdir()
+    shutil.rmtree(ROOT / 'rewind-cache', ignore_errors=True)
+    mmif_storage.known_paths.clear()
+    connection = catalog.get_catalog_connection()
+    with connection:
+        for table in ('mmifs', 'pipelines', 'pipeline_steps', 'mmif_digests'):
+            connection.execute(f"DELETE FROM {table};")
+    return storage_directory
+
+
+def store_request(client, mmif: dict, **args):
+    return client.post('/storeapi/upload', data=json.dumps(mmif), query_string=args)
+
+
+def stored_path(storage_directory, pipeline, guid: str) -> Path:
+    """Returns where the MMIF for the guid and the steps of a benchmark pipeline is
+    stored in the flat layout."""
+    from api.mmif_storage import pipeline_from_param_json
+    return Path(storage_directory, pipeline_from_param_json({'pipeline': corpus.pipeline_spec(pipeline)}),
+                f'{guid}.mmif')
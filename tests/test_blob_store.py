@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from api import blob_store, catalog
+from benchmarks import corpus
+from conftest import PIPELINE, store_request, stored_path
+
+
+@pytest.fixture
+def dedup(storage, monkeypatch):
+    monkeypatch.setattr(blob_store, 'STORAGE_DEDUP', True)
+    return storage
+
+
+def blobs(storage):
+    return sorted((storage / blob_store.BLOB_DIRECTORY).glob('*/*.mmif'))
+
+
+def test_upload_is_stored_as_link_to_blob(client, dedup):
+    guid = 'cpb-aacip-970-dedup0001'
+    assert store_request(client, corpus.make_mmif(guid, PIPELINE)).status_code == 201
+    path = stored_path(dedup, PIPELINE, guid)
+    [blob] = blobs(dedup)
+    assert blob.stem == blob_store.file_digest(path)
+    assert os.path.samefile(path, blob)
+    assert blob.stat().st_nlink == 2
+    stats = client.get('/storeapi/status').get_json()['deduplication']
+    assert stats['deduplicated_mmif_files'] == 1
+    assert stats['blob_count'] == 1
+
+
+def test_unchanged_overwrite_writes_nothing(client, dedup):
+    guid = 'cpb-aacip-971-dedup0001'
+    mmif = corpus.make_mmif(guid, PIPELINE)
+    store_request(client, mmif)
+    path = stored_path(dedup, PIPELINE, guid)
+    before = path.stat()
+    response = store_request(client, mmif, overwrite='true')
+    assert response.get_json()['message'] == 'file existed and was overwritten'
+    after = path.stat()
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert len(blobs(dedup)) == 1
+
+
+def test_same_content_in_two_places_shares_a_blob(client, dedup):
+    guid = 'cpb-aacip-972-dedup0001'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    [blob] = blobs(dedup)
+    other = dedup / 'copy-app' / 'v1' / 'hash' / f'{guid}.mmif'
+    other.parent.mkdir(parents=True)
+    blob_store.link_into_place(blob, other)
+    assert os.path.samefile(other, stored_path(dedup, PIPELINE, guid))
+    assert blob.stat().st_nlink == 3
+    assert len(blobs(dedup)) == 1
+
+
+def test_gc_removes_unused_blobs(client, dedup):
+    guid = 'cpb-aacip-973-dedup0001'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    [old] = blobs(dedup)
+    store_request(client, corpus.make_mmif(guid, PIPELINE, annotations=5), overwrite='true')
+    assert len(blobs(dedup)) == 2
+    assert old.stat().st_nlink == 1
+    # young blobs are kept, they may be about to be linked by an upload
+    assert blob_store.collect_garbage(dedup, min_age=3600) == (0, 0)
+    removed, freed = blob_store.collect_garbage(dedup, min_age=0)
+    assert (removed, freed > 0) == (1, True)
+    [current] = blobs(dedup)
+    assert os.path.samefile(current, stored_path(dedup, PIPELINE, guid))
+
+
+def test_reconcile_keeps_digests(client, dedup):
+    guid = 'cpb-aacip-974-dedup0001'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    before = catalog.dedup_stats()
+    catalog.reconcile(str(dedup))
+    assert catalog.dedup_stats() == before
+    assert before['deduplicated_mmif_files'] == 1
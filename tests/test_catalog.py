@@ -0,0 +1,52 @@
+import fcntl
+import json
+
+from api import catalog
+from benchmarks import corpus
+from conftest import PIPELINE, store_request, stored_path
+
+
+def copy_in(storage, pipeline, guid):
+    """Writes a MMIF to the storage directory without the upload route, like the
+    files stored before the catalog existed."""
+    mmif = corpus.make_mmif(guid, pipeline)
+    path = stored_path(storage, pipeline, guid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(mmif))
+    return mmif
+
+
+def test_bootstrap_fills_an_empty_catalog(client, storage):
+    copy_in(storage, PIPELINE, 'cpb-aacip-980-existing01')
+    copy_in(storage, PIPELINE[:2], 'cpb-aacip-980-existing01')
+    copy_in(storage, PIPELINE[:2], 'cpb-aacip-981-existing01')
+    broken = stored_path(storage, PIPELINE[:1], 'cpb-aacip-982-broken0001')
+    broken.parent.mkdir(parents=True, exist_ok=True)
+    broken.write_text('{"views": [')
+    assert client.get('/storeapi/status').get_json()['total_mmif_files'] == 0
+    catalog.bootstrap(str(storage))
+    status = client.get('/storeapi/status').get_json()
+    assert (status['total_mmif_files'], status['total_pipelines']) == (3, 2)
+    assert status['non_terminal_mmif_count'] == 2
+    row = catalog.get_catalog_connection().execute(
+        "SELECT view_count FROM mmifs WHERE guid='cpb-aacip-980-existing01' ORDER BY view_count;").fetchall()
+    assert [r['view_count'] for r in row] == [2, 3]
+
+
+def test_bootstrap_leaves_a_filled_catalog_alone(client, storage):
+    store_request(client, corpus.make_mmif('cpb-aacip-983-uploaded01', PIPELINE))
+    copy_in(storage, PIPELINE, 'cpb-aacip-984-copied0001')
+    catalog.bootstrap(str(storage))
+    assert client.get('/storeapi/status').get_json()['total_mmif_files'] == 1
+
+
+def test_catalog_routes_are_unavailable_while_it_is_filled(client, storage):
+    with open(catalog.RECONCILE_LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        response = client.get('/storeapi/status')
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+        response = client.post('/storeapi/presence', json={
+            'pipelines': [corpus.pipeline_spec(PIPELINE)], 'guids': ['cpb-aacip-985-waiting01']})
+        assert response.status_code == 503
+    assert client.get('/storeapi/status').status_code == 200
@@ -0,0 +1,55 @@
+import json
+
+from benchmarks import corpus
+from conftest import PIPELINE, store_request, stored_path
+
+
+def download_url(storage, pipeline, guid):
+    path = stored_path(storage, pipeline, guid).relative_to(storage)
+    return f'/storeapi/download/{path.parent.as_posix()}/{guid}'
+
+
+def test_repeated_download_is_not_modified(client, storage):
+    guid = 'cpb-aacip-900-download01'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    url = download_url(storage, PIPELINE, guid)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert json.loads(response.data)['documents'][0]['properties']['location'].endswith(f'{guid}.mp4')
+    etag = response.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(url, headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+    # a changed file is sent again
+    store_request(client, corpus.make_mmif(guid, PIPELINE, annotations=3), overwrite='true')
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_post_download_sends_the_file(client, storage):
+    guid = 'cpb-aacip-901-download01'
+    mmif = corpus.make_mmif(guid, PIPELINE)
+    store_request(client, mmif)
+    response = client.post('/storeapi/download', json={'pipeline': corpus.pipeline_spec(PIPELINE), 'guid': guid})
+    assert response.status_code == 200
+    assert 'ETag' in response.headers
+    assert json.loads(response.data) == mmif
+
+
+def test_prefix_download_is_rewound(client, storage):
+    guid = 'cpb-aacip-902-download01'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    response = client.get(download_url(storage, PIPELINE[:2], guid))
+    assert response.status_code == 200
+    assert len(json.loads(response.data)['views']) == 2
+
+
+def test_download_of_unknown_or_hidden_paths(client, storage):
+    guid = 'cpb-aacip-903-download01'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    url = download_url(storage, PIPELINE, guid)
+    assert client.get(url.replace(guid, 'cpb-aacip-903-missing001')).status_code == 404
+    assert client.get('/storeapi/download/../../etc/passwd/x').status_code == 404
+    assert client.get('/storeapi/download/.locks/a/b/0.lock').status_code == 404
+    # not a whole number of steps
+    assert client.get(url.rsplit('/', 2)[0] + f'/{guid}').status_code == 404
@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+
+import api
+from conftest import make_baseline_database
+
+
+def test_baseline_database_is_migrated(tmp_path):
+    paths = ['/assets/a/cpb-aacip-111-aaaa.mp4', '/assets/a/cpb-aacip-111-aaaa.mp4',
+             '/assets/b/cpb-aacip-222-bbbb.mp3']
+    connection = make_baseline_database(tmp_path / 'database.db', paths)
+    api.migrate_database(connection)
+    assert api.get_schema_version(connection) == api.SCHEMA_VERSION
+    # v1 collapses the duplicate rows and adds the index
+    assert connection.execute("SELECT count(*) FROM map;").fetchone()[0] == 2
+    assert connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='map_guid_file_type';").fetchone()
+    # v2 adds the scan listings, v3 logs changes to map
+    assert connection.execute("SELECT count(*) FROM scan_dirs;").fetchone()[0] == 0
+    connection.execute("INSERT INTO map VALUES ('cpb-aacip-333-cccc', 'video', '/x/cpb-aacip-333-cccc.mp4', '', '');")
+    connection.commit()
+    assert [row[0] for row in connection.execute("SELECT GUID FROM map_changes;")] == ['cpb-aacip-333-cccc']
+    # v4 backfills the trigram index and keeps it in sync
+    names = sorted(row[0] for row in connection.execute("SELECT name FROM map_search;"))
+    assert names == ['cpb-aacip-111-aaaa.mp4', 'cpb-aacip-222-bbbb.mp3', 'cpb-aacip-333-cccc.mp4']
+
+
+def test_migration_runs_once_for_concurrent_workers(tmp_path):
+    database = tmp_path / 'database.db'
+    paths = [f'/assets/cpb-aacip-{i:03d}-x.mp4' for i in range(200)]
+    make_baseline_database(database, paths).close()
+    errors = []
+
+    def worker():
+        connection = sqlite3.connect(database, timeout=30)
+        try:
+            api.migrate_database(connection)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    connection = sqlite3.connect(database)
+    assert api.get_schema_version(connection) == api.SCHEMA_VERSION
+    assert connection.execute("SELECT count(*) FROM map;").fetchone()[0] == 200
+    # the backfill of the trigram index ran only once
+    assert connection.execute("SELECT count(*) FROM map_search;").fetchone()[0] == 200
+
+
+def test_failed_migration_leaves_version(tmp_path, monkeypatch):
+    connection = make_baseline_database(tmp_path / 'database.db', ['/assets/cpb-aacip-1-a.mp4'])
+    broken = tmp_path / 'migrations'
+    broken.mkdir()
+    for version in range(1, api.SCHEMA_VERSION + 1):
+        (broken / f'v{version}.sql').write_text((api.MIGRATIONS_DIRECTORY / f'v{version}.sql').read_text())
+    (broken / 'v2.sql').write_text('CREATE TABLE scan_dirs (path TEXT);\nSELECT * FROM no_such_table;\n')
+    monkeypatch.setattr(api, 'MIGRATIONS_DIRECTORY', broken)
+    try:
+        api.migrate_database(connection)
+    except sqlite3.OperationalError:
+        pass
+    else:
+        raise AssertionError('the broken migration did not fail')
+    assert api.get_schema_version(connection) == 0
+    assert connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='scan_dirs';").fetchone() is None
@@ -0,0 +1,37 @@
+import api
+from api.path_index import PathIndex, write_index
+from conftest import add_rows, remove_rows
+
+
+def test_path_index_falls_back_for_changed_guids(map_database):
+    path, reader, writer = map_database
+    add_rows(writer, '/assets/video/cpb-aacip-7-g.mp4', '/assets/text/cpb-aacip-7-g.txt',
+        '/assets/video/cpb-aacip-8-h.mp4')
+    write_index(reader, f'{path}.idx')
+    index = PathIndex()
+    index.load(str(path))
+    assert index.lookup('cpb-aacip-7-g') == [
+        {'file_type': 'text', 'server_path': '/assets/text/cpb-aacip-7-g.txt'},
+        {'file_type': 'video', 'server_path': '/assets/video/cpb-aacip-7-g.mp4'}]
+    assert index.lookup('cpb-aacip-7-g', ['video']) == [
+        {'file_type': 'video', 'server_path': '/assets/video/cpb-aacip-7-g.mp4'}]
+    assert index.lookup('cpb-aacip-9-unknown') == []
+    remove_rows(writer, '/assets/video/cpb-aacip-8-h.mp4')
+    add_rows(writer, '/assets/video/cpb-aacip-9-unknown.mp4')
+    index.apply_changes(reader)
+    assert index.lookup('cpb-aacip-8-h') is None
+    assert index.lookup('cpb-aacip-9-unknown') is None
+    assert index.lookup('cpb-aacip-7-g', ['video']) is not None
+
+
+def test_path_index_is_dropped_when_changes_were_pruned(map_database, monkeypatch):
+    path, reader, writer = map_database
+    add_rows(writer, '/assets/cpb-aacip-10-i.mp4')
+    write_index(reader, f'{path}.idx')
+    index = PathIndex()
+    index.load(str(path))
+    monkeypatch.setattr(api, 'MAX_MAP_CHANGES', 1)
+    add_rows(writer, '/assets/cpb-aacip-11-j.mp4', '/assets/cpb-aacip-12-k.mp4')
+    add_rows(writer, '/assets/cpb-aacip-13-l.mp4')
+    index.apply_changes(reader)
+    assert index.lookup('cpb-aacip-10-i') is None
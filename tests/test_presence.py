@@ -0,0 +1,44 @@
+import base64
+
+from benchmarks import corpus
+from conftest import PIPELINE, store_request
+
+
+def bits(encoded, size):
+    data = base64.b64decode(encoded)
+    return [bool(data[i >> 3] & (0x80 >> (i & 7))) for i in range(size)]
+
+
+def test_presence_of_stored_and_rewindable_mmifs(client, storage):
+    guids = ['cpb-aacip-960-present01', 'cpb-aacip-961-absent001', 'cpb-aacip-962-present01']
+    for guid in (guids[0], guids[2]):
+        store_request(client, corpus.make_mmif(guid, PIPELINE))
+    response = client.post('/storeapi/presence', json={
+        'pipelines': [corpus.pipeline_spec(PIPELINE), corpus.pipeline_spec(PIPELINE, 1)],
+        'guids': guids, 'rewind': True})
+    assert response.status_code == 200
+    full, prefix = response.get_json()['pipelines']
+    assert bits(full['present'], 3) == [True, False, True]
+    assert full['present_count'] == 2
+    assert bits(prefix['present'], 3) == [False, False, False]
+    assert sorted(prefix['rewind']) == [guids[0], guids[2]]
+
+
+def test_invalid_presence_requests(client, storage):
+    guids = ['cpb-aacip-963-x']
+    invalid = [
+        {'pipelines': [['a']], 'guids': guids},
+        {'pipelines': ['swt-detection/v1'], 'guids': guids},
+        {'pipelines': [{'swt-detection/v1': {'pretty': True}}], 'guids': guids},
+        {'pipelines': {}, 'guids': guids},
+        {'pipelines': [], 'guids': [1]},
+        [1, 2]]
+    for body in invalid:
+        response = client.post('/storeapi/presence', json=body)
+        assert response.status_code == 400, body
+        assert 'error' in response.get_json()
+    response = client.post('/storeapi/presence', data='{"pipelines": [', content_type='application/json')
+    assert response.status_code == 400
+    # parameters that are not a dictionary count as no parameters, like for downloads
+    response = client.post('/storeapi/presence', json={'pipelines': [{'swt-detection/v1': []}], 'guids': guids})
+    assert response.status_code == 200
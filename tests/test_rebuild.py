@@ -0,0 +1,34 @@
+import threading
+
+import api
+from api import rebuild
+from conftest import make_asset
+
+
+def wait_for_rebuilds():
+    for thread in threading.enumerate():
+        if thread.name == 'rebuild':
+            thread.join()
+
+
+def test_startup_rebuild_is_skipped_for_recent_snapshot(app):
+    make_asset('cpb-aacip-500-rebuilt')
+    rebuild.rebuild_database(rebuild.acquire_rebuild_lock())
+    assert rebuild.read_status()['state'] == 'done'
+    assert api.DATABASE.is_symlink()
+    snapshot = api.database_path()
+    # a worker that boots right after the rebuild does not start another one
+    assert not rebuild.start_rebuild(max_age=3600)
+    assert api.database_path() == snapshot
+    # an older snapshot is rebuilt
+    assert rebuild.start_rebuild(max_age=0)
+    wait_for_rebuilds()
+    assert rebuild.read_status()['state'] == 'done'
+
+
+def test_rebuild_is_not_started_twice(app):
+    lock = rebuild.acquire_rebuild_lock()
+    try:
+        assert not rebuild.start_rebuild()
+    finally:
+        lock.close()
@@ -0,0 +1,45 @@
+import api
+from api.result_cache import ResultCache
+from conftest import add_rows, make_asset, remove_rows
+
+
+def test_result_cache_is_invalidated_by_other_connections(map_database):
+    _, reader, writer = map_database
+    cache = ResultCache(maxsize=10, ttl=300)
+    cache.apply_changes(reader)
+    add_rows(writer, '/assets/cpb-aacip-1-a.mp4', '/assets/cpb-aacip-2-b.mp4')
+    cache.apply_changes(reader)
+    # the cache and map_changes use shortened guids
+    cache.put(api.shorten_guid('cpb-aacip-1-a'), (), ['a'])
+    cache.put(api.shorten_guid('cpb-aacip-2-b'), (), ['b'])
+    remove_rows(writer, '/assets/cpb-aacip-1-a.mp4')
+    cache.apply_changes(reader)
+    assert cache.get(api.shorten_guid('cpb-aacip-1-a'), ()) is None
+    assert cache.get(api.shorten_guid('cpb-aacip-2-b'), ()) == ['b']
+    assert cache.stats['invalidations'] == 1
+
+
+def test_result_cache_is_cleared_when_changes_were_pruned(map_database, monkeypatch):
+    _, reader, writer = map_database
+    cache = ResultCache(maxsize=10, ttl=300)
+    cache.apply_changes(reader)
+    cache.put(api.shorten_guid('cpb-aacip-3-c'), (), ['c'])
+    # only the last change is kept, so the cache cannot know what else changed
+    monkeypatch.setattr(api, 'MAX_MAP_CHANGES', 1)
+    add_rows(writer, '/assets/cpb-aacip-4-d.mp4', '/assets/cpb-aacip-5-e.mp4')
+    add_rows(writer, '/assets/cpb-aacip-6-f.mp4')
+    cache.apply_changes(reader)
+    assert cache.get(api.shorten_guid('cpb-aacip-3-c'), ()) is None
+
+
+def test_searchapi_sees_rows_changed_by_other_connections(client):
+    old = make_asset('cpb-aacip-720-moved0001', directory='old')
+    new = make_asset('cpb-aacip-720-moved0001', directory='new')
+    writer = api.open_db_connection()
+    add_rows(writer, str(old))
+    assert client.get('/searchapi', query_string={'guid': 'cpb-aacip-720-moved0001'}).get_json() == [str(old)]
+    # the result is cached now, the move has to invalidate it
+    with writer:
+        api.update_map(writer, [str(new)], [str(old)])
+    writer.close()
+    assert client.get('/searchapi', query_string={'guid': 'cpb-aacip-720-moved0001'}).get_json() == [str(new)]
@@ -0,0 +1,68 @@
+import fcntl
+import json
+
+from api import catalog, mmif_storage
+from benchmarks import corpus
+from conftest import PIPELINE, store_request, stored_path
+
+
+def download(client, steps: int, guid):
+    return client.post('/storeapi/download',
+                       json={'pipeline': corpus.pipeline_spec(PIPELINE, steps), 'guid': guid})
+
+
+def test_prefix_is_rewound_from_catalog(client, storage):
+    guid = 'cpb-aacip-800-rewind0001'
+    assert store_request(client, corpus.make_mmif(guid, PIPELINE)).status_code == 201
+    response = download(client, 2, guid)
+    views = json.loads(response.data)['views']
+    assert [view['metadata']['app'] for view in views] == [app for app, _ in PIPELINE[:2]]
+    # the second request is answered from the rewind cache with the same result
+    assert json.loads(download(client, 2, guid).data)['views'] == views
+
+
+def copy_in(storage, pipeline, guid):
+    path = stored_path(storage, pipeline, guid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(corpus.make_mmif(guid, pipeline)))
+
+
+def test_file_not_in_catalog_is_used_after_reconcile(client, storage):
+    guid = 'cpb-aacip-801-copied0001'
+    copy_in(storage, PIPELINE, guid)
+    assert download(client, 1, guid).get_json() == {'error': f'Did not find: {guid}'}
+    catalog.reconcile(str(storage))
+    views = json.loads(download(client, 1, guid).data)['views']
+    assert [view['metadata']['app'] for view in views] == [PIPELINE[0][0]]
+
+
+def test_directory_is_searched_while_catalog_is_filled(client, storage):
+    guid = 'cpb-aacip-805-copied0001'
+    # the longer pipeline comes first in the directory listing
+    shorter = PIPELINE[:1] + [('http://apps.clams.ai/late-app/v1.0', {})]
+    copy_in(storage, PIPELINE, guid)
+    copy_in(storage, shorter, guid)
+    prefix = str(stored_path(storage, PIPELINE[:1], guid).parent)
+    assert mmif_storage.find_rewind_source(prefix, guid) is None
+    with open(catalog.RECONCILE_LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        source = mmif_storage.find_rewind_source(prefix, guid)
+        assert mmif_storage.find_rewind_source(prefix, 'cpb-aacip-806-missing001') is None
+    # the one with the fewest additional steps, like the catalog would return
+    assert source == str(stored_path(storage, shorter, guid).relative_to(storage))
+
+
+def test_unknown_guid_is_not_found(client, storage):
+    store_request(client, corpus.make_mmif('cpb-aacip-802-stored0001', PIPELINE))
+    response = download(client, 2, 'cpb-aacip-803-unknown001')
+    assert response.get_json() == {'error': 'Did not find: cpb-aacip-803-unknown001'}
+
+
+def test_rewind_uses_shortest_extension(client, storage):
+    guid = 'cpb-aacip-804-sources001'
+    store_request(client, corpus.make_mmif(guid, PIPELINE))
+    store_request(client, corpus.make_mmif(guid, PIPELINE[:2]))
+    prefix = stored_path(storage, PIPELINE[:1], guid).parent
+    source = mmif_storage.find_rewind_source(str(prefix), guid)
+    assert source == catalog.find_extension(str(prefix.relative_to(storage)), guid)
+    assert source == str(stored_path(storage, PIPELINE[:2], guid).relative_to(storage))
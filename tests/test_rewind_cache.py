@@ -0,0 +1,49 @@
+import os
+
+from api.rewind_cache import RewindCache
+
+
+def cache_size(directory):
+    return sum(path.stat().st_size for path in directory.glob('*/*.mmif'))
+
+
+def test_size_cap_is_shared_by_workers(tmp_path):
+    source = tmp_path / 'source.mmif'
+    source.write_text('{}')
+    directory = tmp_path / 'cache'
+    # two workers with their own cache object and a cap of ten entries
+    workers = [RewindCache(directory, 10_000), RewindCache(directory, 10_000)]
+    for i in range(50):
+        workers[i % 2].put('a/b/c', f'cpb-aacip-{i:03d}', 1, str(source), 'x' * 1000)
+        assert cache_size(directory) <= 10_000
+    assert cache_size(directory) > 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    source = tmp_path / 'source.mmif'
+    source.write_text('{}')
+    cache = RewindCache(tmp_path / 'cache', 3_500)
+    cache.put('a/b/c', 'cpb-aacip-old', 1, str(source), 'x' * 1000)
+    cache.put('a/b/c', 'cpb-aacip-used', 1, str(source), 'y' * 1000)
+    cache.put('a/b/c', 'cpb-aacip-new', 1, str(source), 'z' * 1000)
+    # make the first entry the oldest and the second one the most recently used
+    for i, guid in enumerate(('cpb-aacip-old', 'cpb-aacip-new', 'cpb-aacip-used')):
+        entry = cache.entry_path('a/b/c', guid, 1, str(source))
+        os.utime(entry, (1000 + i, 1000 + i))
+    cache.put('a/b/c', 'cpb-aacip-last', 1, str(source), 'w' * 1000)
+    assert cache.get('a/b/c', 'cpb-aacip-old', 1, str(source)) is None
+    assert cache.get('a/b/c', 'cpb-aacip-used', 1, str(source)) == 'y' * 1000
+    assert cache.get('a/b/c', 'cpb-aacip-last', 1, str(source)) == 'w' * 1000
+
+
+def test_changed_source_is_a_miss(tmp_path):
+    source = tmp_path / 'source.mmif'
+    source.write_text('{}')
+    cache = RewindCache(tmp_path / 'cache', 10_000)
+    cache.put('a/b/c', 'cpb-aacip-1', 1, str(source), 'old')
+    assert cache.get('a/b/c', 'cpb-aacip-1', 1, str(source)) == 'old'
+    source.write_text('{"views": []}')
+    os.utime(source, ns=(0, source.stat().st_mtime_ns + 1))
+    assert cache.get('a/b/c', 'cpb-aacip-1', 1, str(source)) is None
+    cache.invalidate('cpb-aacip-1')
+    assert not cache.guid_directory('cpb-aacip-1').exists()
@@ -0,0 +1,84 @@
+import api
+from conftest import make_asset
+
+
+def add_paths_from_other_connection(paths):
+    """Adds rows like the watcher or another worker does, with their own connection."""
+    connection = api.open_db_connection()
+    with connection:
+        api.update_map(connection, [str(path) for path in paths], [])
+    connection.close()
+
+
+def test_missing_guid_is_found_after_another_connection_adds_it(client):
+    guid = 'cpb-aacip-700-added-later'
+    response = client.get('/searchapi', query_string={'guid': guid})
+    assert response.text == 'The requested file does not exist in our server'
+    assert api.guid_index.is_missing(guid)
+    path = make_asset(guid)
+    add_paths_from_other_connection([path])
+    response = client.get('/searchapi', query_string={'guid': guid})
+    assert response.get_json() == [str(path)]
+
+
+def test_missing_guid_is_not_searched_again(client, monkeypatch):
+    guid = 'cpb-aacip-701-never-there'
+    client.get('/searchapi', query_string={'guid': guid})
+    searched = []
+    monkeypatch.setattr(api, 'filename_search', lambda guid: searched.append(guid) or [])
+    response = client.get('/searchapi', query_string={'guid': guid})
+    assert response.text == 'The requested file does not exist in our server'
+    assert searched == []
+
+
+def test_asset_not_in_database_is_added(client):
+    guid = 'cpb-aacip-702-only-on-disk'
+    path = make_asset(guid, '.mp3', 'audio')
+    api.guid_index.refresh()
+    response = client.get('/searchapi', query_string={'guid': guid})
+    assert response.get_json() == [str(path)]
+    row = api.get_db_connection().execute(
+        "SELECT file_type FROM map WHERE server_path=?;", (str(path),)).fetchone()
+    assert row['file_type'] == 'audio'
+
+
+def cache_stats(client):
+    return client.get('/searchapi/stats').get_json()['result_cache']
+
+
+def test_indexed_guids_do_not_use_result_cache(client):
+    from api import rebuild
+    indexed = make_asset('cpb-aacip-710-indexed001')
+    rebuild.rebuild_database(rebuild.acquire_rebuild_lock())
+    # the first request switches to the new snapshot, which empties the cache
+    client.get('/searchapi', query_string={'guid': 'cpb-aacip-710-indexed001'})
+    before = cache_stats(client)
+    for _ in range(3):
+        assert client.get('/searchapi', query_string={'guid': 'cpb-aacip-710-indexed001'}).get_json() == [str(indexed)]
+    after = cache_stats(client)
+    assert (after['hits'], after['misses'], after['size']) == (before['hits'], before['misses'], before['size'])
+    # a guid added after the snapshot is answered by the database and then the cache
+    added = make_asset('cpb-aacip-711-changed001')
+    add_paths_from_other_connection([added])
+    for _ in range(3):
+        assert client.get('/searchapi', query_string={'guid': 'cpb-aacip-711-changed001'}).get_json() == [str(added)]
+    after = cache_stats(client)
+    assert after['misses'] == before['misses'] + 1
+    assert after['hits'] == before['hits'] + 2
+
+
+def test_batch_search_rejects_invalid_file_types(client):
+    for body in ({'guids': ['cpb-aacip-730-batch0001'], 'file': 5},
+                 {'guids': ['cpb-aacip-730-batch0001'], 'file': ['video', None]},
+                 ['cpb-aacip-730-batch0001']):
+        response = client.post('/searchapi/batch', json=body)
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
+
+
+def test_batch_search_filters_file_types(client):
+    video = make_asset('cpb-aacip-731-batch0001')
+    make_asset('cpb-aacip-731-batch0001', '.txt', 'text')
+    api.guid_index.refresh()
+    response = client.post('/searchapi/batch', json={'guids': ['cpb-aacip-731-batch0001'], 'file': 'video'})
+    assert response.get_json() == {'cpb-aacip-731-batch0001': [str(video)]}
@@ -0,0 +1,39 @@
+import json
+import sqlite3
+
+from mmif import Mmif
+
+from api import catalog
+from benchmarks import corpus
+from conftest import PIPELINE, store_request, stored_path
+
+
+def test_view_without_parameters_is_stored_with_empty_parameters(client, storage):
+    guid = 'cpb-aacip-950-noparams01'
+    mmif = corpus.make_mmif(guid, PIPELINE[:1])
+    del mmif['views'][0]['metadata']['parameters']
+    assert Mmif(json.dumps(mmif)).views[0].metadata.parameters == {}
+    assert store_request(client, mmif).status_code == 201
+    pipeline_dir = stored_path(storage, [(PIPELINE[0][0], {})], guid).parent
+    assert json.loads(pipeline_dir.with_name(f'{pipeline_dir.name}.json').read_text()) == {}
+    uploaded = client.get('/storeapi/status').get_json()['pipelines']
+    assert [pipeline['spec'] for pipeline in uploaded] == [{pipeline_dir.relative_to(storage).as_posix(): {}}]
+    catalog.reconcile(str(storage))
+    assert client.get('/storeapi/status').get_json()['pipelines'] == uploaded
+
+
+def test_upload_is_stored_when_catalog_write_fails(client, storage, monkeypatch):
+    guid = 'cpb-aacip-951-locked0001'
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(catalog, 'record_mmif', locked)
+    response = store_request(client, corpus.make_mmif(guid, PIPELINE))
+    assert response.status_code == 201
+    assert response.get_json()['status'] == 'success'
+    assert stored_path(storage, PIPELINE, guid).is_file()
+    assert client.get('/storeapi/status').get_json()['total_mmif_files'] == 0
+    monkeypatch.undo()
+    catalog.reconcile(str(storage))
+    assert client.get('/storeapi/status').get_json()['total_mmif_files'] == 1
@@ -3,7 +3,7 @@ import pathlib
 load_dotenv(dotenv_path=pathlib.Path(__file__).parent/'.env.production', verbose=True)
 
 import api
-# init db once here
-api.initialize_database(True)
-# so that gunicorn workers do not init db again
-app = api.create_app(False)
+# the database is rebuilt in a shadow file in the background while requests are
+# served from the last snapshot, only one worker gets to run the rebuild and it is
+# skipped if the snapshot is recent, see api/rebuild.py
+app = api.create_app(True)